@@ -0,0 +1,339 @@
+"""書類生成パイプラインのベンチマーク。
+
+DocumentGenerator.generate で書類を生成し、エンジンが MetricsRegistry に記録した段階ごと（テンプレートの複製、記入、
+保存、PDF変換・直接描画、保存先への配置）の所要時間を集計して、結果をJSONで出力する。
+LibreOfficeがない環境でも動くよう、既定では入力ごとに空のPDFを書き出すだけの擬似sofficeで変換段階を代用する。
+
+    python benchmark.py --output bench.json
+    python benchmark.py --quick
+    python benchmark.py --real-soffice [--soffice パス] [--workers N]
+    python benchmark.py --documents 1,100 --lines 10,1000
+    python benchmark.py --baseline 前回のbench.json  # 前回より遅くなった段階があれば終了コード1
+
+擬似sofficeの変換に時間がかかるように見せたい場合は、環境変数 DOCGEN_FAKE_SOFFICE_DELAY に秒数を指定する。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import openpyxl
+from openpyxl import load_workbook
+
+from converter import create_converter, find_soffice
+from database import DatabaseManager
+from document_engine import DOCUMENT_TYPES, DocumentGenerator, DocumentRequest, LineItem
+from metrics import MetricsRegistry
+from pdf_renderer import RENDERERS
+
+# 既定の計測条件（書類数の変化は明細10行、明細数の変化は書類1件で計測する）
+DOCUMENT_COUNTS = (1, 100, 10000)
+LINE_COUNTS = (10, 1000, 10000)
+QUICK_DOCUMENT_COUNTS = (1, 100)
+QUICK_LINE_COUNTS = (10, 1000)
+
+# 段階の名前は書類生成エンジンの stage_duration_seconds の stage ラベルと同じ（load_workbook と total を除く）
+STAGES = ("load_workbook", "template_copy", "fill", "save", "convert", "render", "publish", "total")
+
+# 擬似sofficeの本体。--convert-to 形式の引数を受け取り、入力ごとに --outdir へ1ページの空白PDFを書き出す。
+# 変換段階にPythonの起動時間以上の負荷をかけないよう、標準ライブラリだけで書いた独立したスクリプトにしている。
+FAKE_SOFFICE_SCRIPT = """import os, sys, time
+PDF = (b"%PDF-1.4\\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\\n"
+       b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\\n"
+       b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\\n"
+       b"trailer<</Root 1 0 R>>\\n%EOF\\n")
+args = sys.argv[1:]
+output_dir = args[args.index("--outdir") + 1] if "--outdir" in args else "."
+# 実際の変換時間を模擬したい場合の待ち時間（秒）
+time.sleep(float(os.environ.get("DOCGEN_FAKE_SOFFICE_DELAY", "0")))
+for argument in args:
+    if argument.lower().endswith((".xlsx", ".xls", ".ods")):
+        name = os.path.splitext(os.path.basename(argument))[0] + ".pdf"
+        with open(os.path.join(output_dir, name), "wb") as f:
+            f.write(PDF)
+"""
+
+BENCHMARK_COMPANY_INFO = {
+    "company_name": "ベンチマーク株式会社",
+    "postal_code": "100-0001",
+    "address": "東京都千代田区千代田1-1",
+    "address_detail": "ベンチマークビル",
+    "phone_number": "03-0000-0000",
+    "contact_person": "計測 太郎",
+    "account_type": "普通",
+    "bank_branch": "ベンチ銀行 本店",
+    "account_number": "1234567",
+    "account_name": "ベンチマーク（カ",
+}
+
+
+def write_fake_soffice(directory):
+    """擬似sofficeを directory に作成し、soffice の代わりに指定する実行ファイルのパスを返す。"""
+    script = os.path.join(directory, "fake_soffice.py")
+    with open(script, "w", encoding="utf-8") as f:
+        f.write(FAKE_SOFFICE_SCRIPT)
+    if os.name == "nt":
+        path = os.path.join(directory, "soffice.cmd")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f'@"{sys.executable}" -S "{script}" %*\n')
+    else:
+        path = os.path.join(directory, "soffice")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" -S "{script}" "$@"\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def make_request(index, lines):
+    """計測用の生成依頼を作成する（書類種別は順番に切り替える）。"""
+    items = tuple(
+        LineItem(
+            summary=f"品目{line + 1:05d}",
+            quantity=str(line % 9 + 1),
+            unit="個",
+            unit_price=str(1000 + line % 50 * 10),
+            discount="100" if line % 7 == 0 else "0",
+            tax_rate="8" if line % 3 == 0 else "10",
+        )
+        for line in range(lines)
+    )
+    issued_at = datetime(2025, 1, 1, 9, 0) + timedelta(minutes=index)
+    return DocumentRequest(
+        document_type=DOCUMENT_TYPES[index % len(DOCUMENT_TYPES)],
+        company_name=f"取引先{index % 100:02d}",
+        subject="ベンチマーク",
+        expiry_date=issued_at.date() + timedelta(days=30),
+        delivery_place="本社",
+        transaction_method="銀行振込",
+        remarks="ベンチマーク用の書類です。",
+        items=items,
+        issued_at=issued_at,
+    )
+
+
+class StageTimer:
+    def __init__(self):
+        """段階ごとの所要時間（秒）を記録する。"""
+        self.samples = {stage: [] for stage in STAGES}
+
+    def measure(self, stage, function, *args):
+        """function を実行して所要時間を記録し、戻り値を返す。"""
+        start = time.perf_counter()
+        result = function(*args)
+        self.samples[stage].append(time.perf_counter() - start)
+        return result
+
+    def record(self, metrics, name, stage=None):
+        """metrics に記録された name の所要時間を、stage ラベルごと（stage を指定した場合はその名前）に1件分として記録する。"""
+        durations = {}
+        for series in metrics.snapshot()["histograms"].get(name, ()):
+            key = stage or series["labels"].get("stage", name)
+            durations[key] = durations.get(key, 0.0) + series["sum"]
+        for key, duration in durations.items():
+            self.samples.setdefault(key, []).append(duration)
+
+    def summary(self):
+        """段階ごとの件数・合計・平均・中央値・95パーセンタイル・最小・最大（ミリ秒）を返す。"""
+        result = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            result[stage] = {
+                "count": len(ordered),
+                "total_ms": sum(ordered) * 1000,
+                "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p50_ms": _percentile(ordered, 0.5) * 1000,
+                "p95_ms": _percentile(ordered, 0.95) * 1000,
+                "min_ms": ordered[0] * 1000,
+                "max_ms": ordered[-1] * 1000,
+            }
+        return result
+
+
+def _percentile(ordered, fraction):
+    """並べ替え済みの値から百分位数を返す（最近傍法）。"""
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_document(generator, request, timer, measure_load):
+    """書類1件を書類生成エンジンで生成し、エンジンが記録した段階ごとの所要時間を timer に記録する。"""
+    if measure_load:
+        # テンプレートキャッシュを使わない場合の読み込み時間（比較用）
+        timer.measure("load_workbook", load_workbook, generator.get_template_path(request.document_type))
+    generator.metrics.reset()
+    generator.generate(request, BENCHMARK_COMPANY_INFO)
+    timer.record(generator.metrics, "stage_duration_seconds")
+    timer.record(generator.metrics, "document_duration_seconds", "total")
+
+
+def run_scenario(generator, documents, lines, max_load_samples):
+    """書類数・明細数の組み合わせ1つを計測し、結果を辞書で返す。"""
+    # 書類ごとのログが多いため、進捗はログレベルによらず標準エラー出力に表示する
+    print(f"Benchmark: {documents} documents x {lines} lines", file=sys.stderr)
+    timer = StageTimer()
+    started = time.perf_counter()
+    for index in range(documents):
+        request = make_request(index, lines)
+        run_document(generator, request, timer, index < max_load_samples)
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": documents,
+        "lines": lines,
+        "large_document_mode": lines > generator.get_fill_plan(DOCUMENT_TYPES[0]).capacity,
+        "elapsed_seconds": elapsed,
+        "documents_per_second": documents / elapsed if elapsed else None,
+        "stages": timer.summary(),
+    }
+
+
+def build_scenarios(args):
+    """計測する (書類数, 明細数) の組み合わせを返す。"""
+    if args.documents or args.lines:
+        documents = _parse_counts(args.documents) or [1]
+        lines = _parse_counts(args.lines) or [10]
+        return [(count, line_count) for count in documents for line_count in lines]
+    document_counts = QUICK_DOCUMENT_COUNTS if args.quick else DOCUMENT_COUNTS
+    line_counts = QUICK_LINE_COUNTS if args.quick else LINE_COUNTS
+    scenarios = [(count, line_counts[0]) for count in document_counts]
+    scenarios += [(document_counts[0], line_count) for line_count in line_counts if line_count != line_counts[0]]
+    return scenarios
+
+
+def _parse_counts(text):
+    """"1,100,10000" 形式の件数の指定をリストに変換する。"""
+    return [int(value) for value in text.split(",") if value.strip()] if text else []
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """前回の結果と比べて、平均所要時間が threshold 倍を超えて遅くなった段階の一覧を返す。"""
+    previous = {(scenario["documents"], scenario["lines"]): scenario for scenario in baseline.get("scenarios", ())}
+    regressions = []
+    for scenario in results["scenarios"]:
+        before = previous.get((scenario["documents"], scenario["lines"]))
+        if before is None:
+            continue
+        for stage, current in scenario["stages"].items():
+            old = before.get("stages", {}).get(stage)
+            if old and old["mean_ms"] > 0 and current["mean_ms"] > old["mean_ms"] * threshold:
+                regressions.append({
+                    "documents": scenario["documents"],
+                    "lines": scenario["lines"],
+                    "stage": stage,
+                    "baseline_mean_ms": old["mean_ms"],
+                    "mean_ms": current["mean_ms"],
+                    "ratio": current["mean_ms"] / old["mean_ms"],
+                })
+    return regressions
+
+
+def _git_revision():
+    """計測したソースのgitのリビジョンを返す（取得できなければ None）。"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    """ベンチマークを実行して結果をJSONで出力する。"""
+    work_dir = tempfile.mkdtemp(prefix="docgen_bench_")
+    try:
+        if args.real_soffice:
+            soffice_path = args.soffice or find_soffice()
+        else:
+            soffice_path = write_fake_soffice(work_dir)
+        generator = DocumentGenerator(
+            db_manager=DatabaseManager(os.path.join(work_dir, "benchmark.db")),
+            output_dir=os.path.join(work_dir, "output"),
+            converter=create_converter(soffice_path=soffice_path, pool_size=args.workers if args.real_soffice else 0),
+            record_ledger=False,
+            renderer=args.renderer,
+            metrics=MetricsRegistry(),
+        )
+        # 同じ内容の書類を繰り返し生成するため、出力キャッシュ（DOCGEN_OUTPUT_CACHE）は使わない
+        generator.output_cache = None
+        results = {
+            "benchmark": "document_pipeline",
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "environment": {
+                "revision": _git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "openpyxl": openpyxl.__version__,
+                "converter": "soffice" if args.real_soffice else "fake",
+                "soffice": soffice_path if args.real_soffice else None,
+                "workers": args.workers if args.real_soffice else 0,
+                "renderer": generator.renderer,
+            },
+            "scenarios": [],
+        }
+        try:
+            for documents, lines in build_scenarios(args):
+                results["scenarios"].append(run_scenario(generator, documents, lines, args.max_load_samples))
+        finally:
+            generator.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.threshold)
+        results["regressions"] = regressions
+        for regression in regressions:
+            logging.warning(
+                f"Regression: {regression['stage']} ({regression['documents']} docs x {regression['lines']} lines) "
+                f"{regression['baseline_mean_ms']:.2f} ms -> {regression['mean_ms']:.2f} ms")
+        exit_code = 1 if regressions else 0
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Benchmark results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return exit_code
+
+
+def build_parser():
+    """コマンドライン引数の定義を作成する。"""
+    parser = argparse.ArgumentParser(description="書類生成パイプラインのベンチマーク")
+    parser.add_argument("--log-level", default="WARNING", help="ログレベル（DEBUG / INFO / WARNING / ERROR）")
+    parser.add_argument("--output", default=None, help="結果のJSONの出力先（既定: 標準出力）")
+    parser.add_argument("--quick", action="store_true", help="件数を減らして短時間で計測する")
+    parser.add_argument("--documents", default=None, help="書類数の一覧（例: 1,100）。--lines と組み合わせたすべての条件を計測する")
+    parser.add_argument("--lines", default=None, help="明細数の一覧（例: 10,1000）")
+    parser.add_argument("--max-load-samples", type=int, default=100, help="load_workbook を計測する書類数の上限（各条件の先頭から）")
+    parser.add_argument("--real-soffice", action="store_true", help="擬似sofficeではなく実際のLibreOfficeで変換する")
+    parser.add_argument("--soffice", default=None, help="--real-soffice で使う soffice のパス（既定: DOCGEN_SOFFICE / PATH から検索）")
+    parser.add_argument("--workers", type=int, default=0, help="--real-soffice で使う常駐LibreOfficeワーカー数")
+    parser.add_argument("--renderer", choices=RENDERERS, default="libreoffice", help="PDFの作成方法")
+    parser.add_argument("--baseline", default=None, help="比較する前回の結果のJSON")
+    parser.add_argument("--threshold", type=float, default=1.2, help="平均所要時間が何倍を超えたら遅くなったとみなすか")
+    return parser
+
+
+def main(argv=None):
+    """ベンチマークのエントリーポイント。"""
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING),
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    return run_benchmark(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,483 @@
+import argparse
+import asyncio
+import calendar
+import csv
+import dataclasses
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from converter import BatchConversionStage, create_converter, get_pool_size
+from database import DatabaseManager
+from dead_letter import create_dead_letter_queue
+from document_engine import DEFAULT_ISSUER_ID, DOCUMENT_TYPES, DocumentGenerator, DocumentRequest
+from fill_pool import FillProcessPool, get_fill_processes
+from metrics import METRIC_FORMATS, get_log_level
+from output_cache import create_output_cache
+from pdf_bundle import BUNDLE_TYPES, bundle_documents, entry_from_request, is_available as bundling_available
+from pdf_renderer import RENDERERS
+from server import DEFAULT_HOST, DEFAULT_PORT, serve
+from workspace import remove_stale_temp_dirs
+
+# CSVの明細列（1行 = 明細1行。同じ document_id の連続した行を1件の書類としてまとめる）
+CSV_ITEM_COLUMNS = ("summary", "quantity", "unit", "unit_price", "discount", "tax_rate")
+
+
+def iter_jsonl_requests(path):
+    """JSONLファイルから生成依頼を1件ずつ、(行番号, 行の文字列) として読み出す。"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            yield line_number, line
+
+
+def iter_csv_requests(path):
+    """CSVファイルから生成依頼を1件ずつ、(document_id, 依頼の辞書) として読み出す。"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        for document_id, rows in itertools.groupby(reader, key=lambda row: row.get("document_id") or str(reader.line_num)):
+            rows = list(rows)
+            data = {key: value for key, value in rows[0].items() if key not in CSV_ITEM_COLUMNS}
+            data["items"] = [
+                {column: row.get(column) for column in CSV_ITEM_COLUMNS}
+                for row in rows if row.get("summary")
+            ]
+            yield document_id, data
+
+
+def iter_requests(path):
+    """拡張子に応じてJSONL / CSV のどちらかとして生成依頼を読み出す。"""
+    if os.path.splitext(path)[1].lower() == ".csv":
+        return iter_csv_requests(path)
+    return iter_jsonl_requests(path)
+
+
+def iter_all_requests(paths):
+    """複数の生成依頼ファイルを順に読み出し、(ファイル, キー, 読み出した1件分) を返す。
+
+    生成依頼への変換は parse_request で1件ずつ行い、不正な1件で残りの依頼を止めない。
+    """
+    for source in paths:
+        for key, record in iter_requests(source):
+            yield source, key, record
+
+
+def parse_request(record):
+    """読み出した1件分（JSONLの1行の文字列、またはCSVから組み立てた辞書）を生成依頼に変換する。"""
+    data = json.loads(record) if isinstance(record, str) else record
+    if not isinstance(data, dict):
+        raise ValueError(f"Request must be a JSON object, got {type(data).__name__}")
+    return DocumentRequest.from_dict(data)
+
+
+def select_issuer(request, profiles, default_issuer=None):
+    """生成依頼の発行元を決め、(発行元を設定した依頼, 発行元の自社情報) を返す。
+
+    発行元のない依頼には一括生成で指定した発行元（なければ既定の発行元）を設定する。
+    自社情報は一括生成の開始時に読み込んだ profiles から引き、書類ごとにデータベースを引かない。
+    """
+    if not request.issuer:
+        request = dataclasses.replace(request, issuer=default_issuer or DEFAULT_ISSUER_ID)
+    company_info = profiles.get(request.issuer)
+    if company_info is None:
+        raise ValueError(f"Unknown issuer profile: {request.issuer}")
+    return request, company_info
+
+
+def create_generator(args, workers):
+    """コマンドライン引数から書類生成エンジンを作成する。"""
+    # 前回の異常終了などで残った一時ディレクトリを掃除する
+    remove_stale_temp_dirs()
+    generator = DocumentGenerator(
+        db_manager=DatabaseManager(args.db),
+        output_dir=args.output_dir,
+        converter=create_converter(soffice_path=args.soffice, pool_size=workers, timeout=args.convert_timeout,
+                                   retries=args.convert_retries),
+        renderer=args.renderer,
+        pdf_font=args.pdf_font,
+        output_cache=create_output_cache(args.cache_dir, args.cache_max_mb, args.cache_max_age_days),
+        dead_letter=create_dead_letter_queue(args.dead_letter),
+    )
+    fill_processes = get_fill_processes(args.fill_processes)
+    if fill_processes > 0:
+        generator.fill_pool = FillProcessPool(generator, fill_processes)
+        logging.info(f"Filling workbooks in {fill_processes} processes.")
+    return generator
+
+
+def run_generate(args):
+    """生成依頼ファイルを読み込み、すべての書類を生成する。"""
+    if args.bundle_dir and not bundling_available():
+        logging.error("pypdf がインストールされていないため、まとめPDFを作成できません。")
+        return 1
+    workers = get_pool_size(args.workers)
+    generator = create_generator(args, workers)
+    # 一括生成で使う発行元の自社情報は、最初にまとめて読み込んでおく
+    profiles = generator.db_manager.get_issuer_profiles()
+    if not profiles:
+        logging.error("自社情報が見つかりませんでした。GUIから自社情報を登録してください。")
+        generator.close()
+        return 1
+
+    counts = {"ok": 0, "error": 0}
+    # まとめPDFは、ディレクトリを探し直さずにこの実行で生成した書類の一覧から作る
+    bundle_entries = [] if args.bundle_dir else None
+
+    def report(source, key, pdf_path=None, error=None, request=None):
+        """1件分の結果を標準出力に書き出す。"""
+        if error is None:
+            counts["ok"] += 1
+            if bundle_entries is not None:
+                bundle_entries.append(entry_from_request(request, pdf_path))
+            result = {"source": source, "key": key, "status": "ok", "path": pdf_path}
+        else:
+            counts["error"] += 1
+            logging.error(f"Failed to generate document ({source}:{key}): {error}")
+            result = {"source": source, "key": key, "status": "error", "error": str(error)}
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    try:
+        if args.chunk_size > 0:
+            _run_staged(args, generator, profiles, report)
+        else:
+            _run_concurrent(args, generator, profiles, report, max(1, workers))
+        if bundle_entries:
+            counts["error"] += write_bundles(bundle_entries, args.bundle_dir, args.bundle_types, generator.metrics)
+    except _FailFast:
+        return 1
+    finally:
+        generator.close()
+        write_metrics(args, generator.metrics)
+
+    logging.info(f"Batch finished: {counts['ok']} succeeded, {counts['error']} failed.")
+    logging.info(f"Template cache: {generator.template_cache.stats()}")
+    if generator.output_cache is not None:
+        logging.info(f"Output cache: {generator.output_cache.stats()}")
+    return 0 if counts["error"] == 0 else 1
+
+
+def write_bundles(entries, bundle_dir, document_types, metrics=None):
+    """書類を取引先・月ごとのまとめPDFに結合して結果を1件ごとにJSON形式で書き出し、失敗したまとめPDFの数を返す。"""
+    errors = 0
+    for bundle_path, documents, pages, error in bundle_documents(entries, bundle_dir, tuple(document_types), metrics):
+        result = {"bundle": bundle_path, "documents": documents, "status": "ok", "pages": pages}
+        if error is not None:
+            errors += 1
+            result.update(status="error", error=str(error))
+            del result["pages"]
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+    return errors
+
+
+def write_metrics(args, metrics):
+    """--metrics-file が指定されていれば、処理時間などの集計をファイルに書き出す。"""
+    metrics_file = args.metrics_file or os.environ.get("DOCGEN_METRICS_FILE")
+    if not metrics_file:
+        return
+    try:
+        metrics.write(metrics_file, args.metrics_format)
+        logging.info(f"Metrics written to {metrics_file}")
+    except OSError as e:
+        logging.error(f"Could not write metrics to {metrics_file}: {e}")
+
+
+class _FailFast(Exception):
+    """--fail-fast 指定時に最初のエラーで処理を打ち切るための例外。"""
+
+
+def _drain(pending, report, fail_fast, limit=0):
+    """未完了のジョブが limit 件以下になるまで待ち、完了したものを報告する。"""
+    while len(pending) > limit:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if not _collect(future, pending.pop(future), report) and fail_fast:
+                raise _FailFast()
+
+
+def _prepare(args, generator, profiles, source, key, record, report):
+    """読み出した1件を生成依頼に変換して発行元を決め、(依頼, 自社情報) を返す。
+
+    変換できない依頼・発行元の見つからない依頼は失敗として報告し（dead_letter にも書き留める）、None を返して次の依頼に進む。
+    """
+    try:
+        request = parse_request(record)
+    except Exception as e:
+        generator.reject(record, e)
+        report(source, key, error=e)
+        if args.fail_fast:
+            raise _FailFast()
+        return None
+    try:
+        return select_issuer(request, profiles, args.issuer)
+    except ValueError as e:
+        # 生成エンジンで失敗した書類と同じく、失敗として数えて書き留める
+        generator.fail(request, e, time.perf_counter())
+        report(source, key, error=e)
+        if args.fail_fast:
+            raise _FailFast()
+        return None
+
+
+def _run_concurrent(args, generator, profiles, report, concurrency):
+    """変換ワーカー数と同じだけ並行に、書類を1件ずつ生成する。"""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        for source, key, record in iter_all_requests(args.inputs):
+            # 未処理の依頼を溜め込まないよう件数を制限する
+            _drain(pending, report, args.fail_fast, limit=concurrency * 2)
+            prepared = _prepare(args, generator, profiles, source, key, record, report)
+            if prepared is None:
+                continue
+            request, company_info = prepared
+            pending[executor.submit(generator.generate, request, company_info)] = (source, key, request)
+        _drain(pending, report, args.fail_fast)
+
+
+def _run_staged(args, generator, profiles, report):
+    """ブックを作成してバッチ変換ステージに溜め、chunk_size 件ずつまとめて変換する。"""
+    with BatchConversionStage(
+        soffice_path=args.soffice,
+        chunk_size=args.chunk_size,
+        flush_interval=args.flush_interval,
+        parallel=max(1, args.parallel_chunks),
+        timeout=args.convert_timeout,
+        metrics=generator.metrics,
+        publisher=generator.publisher,
+    ) as stage:
+        pending = {}
+        for source, key, record in iter_all_requests(args.inputs):
+            # ブックの作成を子プロセスで行う場合は、作成中の分も先に受け付ける
+            fill_processes = generator.fill_pool.processes if generator.fill_pool is not None else 0
+            _drain(pending, report, args.fail_fast, limit=args.chunk_size * (stage.parallel + 1) + fill_processes * 2)
+            prepared = _prepare(args, generator, profiles, source, key, record, report)
+            if prepared is None:
+                continue
+            request, company_info = prepared
+            try:
+                pending[generator.generate_staged(request, stage, company_info)] = (source, key, request)
+            except Exception as e:
+                report(source, key, error=e)
+                if args.fail_fast:
+                    raise _FailFast()
+        stage.flush()
+        _drain(pending, report, args.fail_fast)
+
+
+def _collect(future, origin, report):
+    """完了したジョブの結果を報告し、成功したかどうかを返す。"""
+    source, key, request = origin
+    try:
+        report(source, key, pdf_path=future.result(), request=request)
+        return True
+    except Exception as e:
+        report(source, key, error=e)
+        return False
+
+
+def run_serve(args):
+    """生成依頼をHTTP/JSONで受け付けるサーバーを起動する。"""
+    workers = get_pool_size(args.workers)
+    generator = create_generator(args, workers)
+    # 発行元の自社情報はキャッシュに読み込んでおき、依頼ごとにデータベースを引かない
+    if not generator.db_manager.get_issuer_profiles():
+        logging.error("自社情報が見つかりませんでした。GUIから自社情報を登録してください。")
+        generator.close()
+        return 1
+    try:
+        asyncio.run(serve(generator, args.host, args.port, workers=max(1, workers), queue_size=args.queue_size))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generator.close()
+        write_metrics(args, generator.metrics)
+    logging.info("Document server stopped.")
+    return 0
+
+
+def run_ledger(args):
+    """発行台帳を検索し、該当する書類を1件ごとにJSON形式で書き出す。"""
+    db_manager = DatabaseManager(args.db)
+    db_manager.connect()
+    started = time.perf_counter()
+    rows = db_manager.search_documents(
+        document_type=args.type,
+        customer_name=args.customer,
+        date_from=args.date_from,
+        date_to=args.date_to,
+        min_total=args.min_total,
+        max_total=args.max_total,
+        subject=args.subject,
+        limit=args.limit,
+        issuer_id=args.issuer,
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+    logging.info(f"{len(rows)} documents found in {elapsed_ms:.1f} ms.")
+    db_manager.close()
+    return 0
+
+
+def run_bundle(args):
+    """発行台帳から指定した月の書類を探し、取引先ごとのまとめPDFに結合する。"""
+    if not bundling_available():
+        logging.error("pypdf がインストールされていないため、まとめPDFを作成できません。")
+        return 1
+    try:
+        year, month = (int(part) for part in args.month.split("-"))
+        last_day = calendar.monthrange(year, month)[1]
+    except ValueError:
+        logging.error(f"--month は yyyy-MM 形式で指定してください: {args.month}")
+        return 1
+    db_manager = DatabaseManager(args.db)
+    db_manager.connect()
+    rows = db_manager.search_documents(
+        customer_name=args.customer,
+        date_from=f"{year:04d}-{month:02d}-01",
+        date_to=f"{year:04d}-{month:02d}-{last_day:02d}",
+        issuer_id=args.issuer,
+        limit=0,
+    )
+    db_manager.close()
+    errors = write_bundles(rows, args.bundle_dir, args.types)
+    logging.info(f"{len(rows)} documents found in the ledger for {args.month}.")
+    return 0 if errors == 0 else 1
+
+
+def run_master(args):
+    """取引先マスタ・品目マスタにCSVから登録し、または入力補完と同じ方法で検索する。"""
+    db_manager = DatabaseManager(args.db)
+    db_manager.connect()
+    if args.import_file:
+        with open(args.import_file, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        started = time.perf_counter()
+        if args.table == "customers":
+            count = db_manager.import_customers(row.get("name") or row.get("company_name") for row in rows)
+        else:
+            count = db_manager.import_items(rows)
+        logging.info(f"{count} of {len(rows)} {args.table} imported in {time.perf_counter() - started:.2f} s.")
+    if args.search is not None:
+        search = db_manager.search_customers if args.table == "customers" else db_manager.search_items
+        started = time.perf_counter()
+        results = search(args.search, limit=args.limit)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for result in results:
+            print(json.dumps(result, ensure_ascii=False))
+        logging.info(f"{len(results)} {args.table} found in {elapsed_ms:.1f} ms.")
+    db_manager.close()
+    return 0
+
+
+def run_issuer(args):
+    """発行元プロファイル（自社情報）をCSVから登録し、登録済みの発行元を1件ごとにJSON形式で書き出す。"""
+    db_manager = DatabaseManager(args.db)
+    db_manager.connect()
+    if args.import_file:
+        with open(args.import_file, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        for row in rows:
+            db_manager.update_company_info(row, row.get("issuer_id"))
+        logging.info(f"{len(rows)} issuer profiles imported.")
+    for profile in db_manager.get_issuer_profiles().values():
+        print(json.dumps(profile, ensure_ascii=False))
+    db_manager.close()
+    return 0
+
+
+def add_generator_arguments(parser):
+    """書類の生成に関する引数（generate / serve 共通）を追加する。"""
+    parser.add_argument("--db", default="documents.db", help="自社情報・発行台帳・書類番号を保存するデータベースファイル")
+    parser.add_argument("--output-dir", default=None, help="PDFの保存先の基準ディレクトリ（既定: アプリケーションのディレクトリ）")
+    parser.add_argument("--soffice", default=None, help="LibreOffice（soffice）の実行ファイルのパス（既定: DOCGEN_SOFFICE / PATH から検索）")
+    parser.add_argument("--workers", type=int, default=None, help="常駐LibreOfficeワーカー数（0なら書類ごとに起動。既定: DOCGEN_CONVERTER_WORKERS）")
+    parser.add_argument("--renderer", choices=RENDERERS, default=None, help="PDFの作成方法（native はLibreOfficeを使わず直接描画。既定: DOCGEN_RENDERER / libreoffice）")
+    parser.add_argument("--pdf-font", default=None, help="native で埋め込む日本語TrueTypeフォント（既定: DOCGEN_PDF_FONT / 既知の場所から検索）")
+    parser.add_argument("--cache-dir", default=None, help="出力キャッシュのディレクトリ。同じ内容の書類はPDFを再利用する（既定: DOCGEN_OUTPUT_CACHE。未設定なら使わない）")
+    parser.add_argument("--cache-max-mb", type=float, default=None, help="出力キャッシュの容量の上限（MB、既定1024）")
+    parser.add_argument("--cache-max-age-days", type=float, default=None, help="出力キャッシュの保持日数（既定30）")
+    parser.add_argument("--convert-timeout", type=float, default=None, help="PDF変換1件の制限時間（秒）。過ぎたら soffice を強制終了する（0なら無制限。既定: DOCGEN_CONVERT_TIMEOUT / 120）")
+    parser.add_argument("--convert-retries", type=int, default=None, help="PDF変換に失敗したときの再試行回数（既定: DOCGEN_CONVERT_RETRIES / 2）")
+    parser.add_argument("--dead-letter", default=None, help="生成に失敗した依頼を書き留めるJSONLファイル。そのまま generate で再実行できる（既定: DOCGEN_DEAD_LETTER。未設定なら書き留めない）")
+    parser.add_argument("--fill-processes", default=None, help="ブックの作成に使うプロセス数（auto でCPUのコア数。0なら使わない。既定: DOCGEN_FILL_PROCESSES / 0）")
+    parser.add_argument("--metrics-file", default=None, help="段階ごとの処理時間・件数の集計の書き出し先（既定: DOCGEN_METRICS_FILE。未設定なら書き出さない）")
+    parser.add_argument("--metrics-format", choices=METRIC_FORMATS, default=None, help="集計の形式（既定: 拡張子が .json ならJSON、それ以外は Prometheus のテキスト形式）")
+
+
+def build_parser():
+    """コマンドライン引数の定義を作成する。"""
+    parser = argparse.ArgumentParser(description="見積書・請求書・領収書をGUIを使わずに一括生成する。")
+    parser.add_argument("--log-level", default=None, help="ログレベル（DEBUG / INFO / WARNING / ERROR。既定: DOCGEN_LOG_LEVEL / INFO）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="JSONL / CSV の生成依頼からPDFを一括生成する")
+    generate_parser.add_argument("inputs", nargs="+", help="生成依頼ファイル（.jsonl / .csv）")
+    generate_parser.add_argument("--fail-fast", action="store_true", help="最初のエラーで処理を中断する")
+    generate_parser.add_argument("--issuer", default=None, help=f"発行元（issuer）を指定していない依頼に使う発行元プロファイルのID（既定: {DEFAULT_ISSUER_ID}）")
+    add_generator_arguments(generate_parser)
+    generate_parser.add_argument("--chunk-size", type=int, default=0, help="1回のsoffice起動でまとめて変換する件数（0ならまとめない）")
+    generate_parser.add_argument("--flush-interval", type=float, default=5.0, help="まとめ変換の待ち時間の上限（秒）")
+    generate_parser.add_argument("--parallel-chunks", type=int, default=1, help="同時に実行するまとめ変換の数")
+    generate_parser.add_argument("--bundle-dir", default=None, help="生成後に、生成した書類を取引先・月ごとに1つのPDF（しおり付き）にまとめる保存先")
+    generate_parser.add_argument("--bundle-types", nargs="+", choices=DOCUMENT_TYPES, default=BUNDLE_TYPES, help=f"まとめる書類の種別（既定: {' '.join(BUNDLE_TYPES)}）")
+    generate_parser.set_defaults(func=run_generate)
+
+    serve_parser = subparsers.add_parser("serve", help="生成依頼をHTTP/JSONで受け付けるサーバーを起動する")
+    add_generator_arguments(serve_parser)
+    serve_parser.add_argument("--host", default=DEFAULT_HOST, help=f"待ち受けるアドレス（既定: {DEFAULT_HOST}）")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"待ち受けるポート（既定: {DEFAULT_PORT}）")
+    serve_parser.add_argument("--queue-size", type=int, default=16, help="生成待ちの依頼の上限。超えた依頼には429を返す")
+    serve_parser.set_defaults(func=run_serve)
+
+    ledger_parser = subparsers.add_parser("ledger", help="発行台帳を検索する")
+    ledger_parser.add_argument("--db", default="documents.db", help="データベースファイル")
+    ledger_parser.add_argument("--type", choices=["見積書", "請求書", "領収書"], help="書類の種別")
+    ledger_parser.add_argument("--customer", help="取引先企業名（完全一致）")
+    ledger_parser.add_argument("--from", dest="date_from", help="発行日の開始（yyyy-MM-dd）")
+    ledger_parser.add_argument("--to", dest="date_to", help="発行日の終了（yyyy-MM-dd）")
+    ledger_parser.add_argument("--min-total", type=int, help="税込合計の下限（円）")
+    ledger_parser.add_argument("--max-total", type=int, help="税込合計の上限（円）")
+    ledger_parser.add_argument("--subject", help="件名（部分一致）")
+    ledger_parser.add_argument("--issuer", help="発行元プロファイルのID")
+    ledger_parser.add_argument("--limit", type=int, default=100, help="最大件数（0なら無制限）")
+    ledger_parser.set_defaults(func=run_ledger)
+
+    bundle_parser = subparsers.add_parser("bundle", help="発行台帳の書類を取引先・月ごとに1つのPDF（しおり付き）にまとめる")
+    bundle_parser.add_argument("--db", default="documents.db", help="データベースファイル")
+    bundle_parser.add_argument("--month", required=True, help="発行年月（yyyy-MM）")
+    bundle_parser.add_argument("--bundle-dir", required=True, help="まとめPDFの保存先（<保存先>/<yyyy>/<MM>/<取引先>.pdf）")
+    bundle_parser.add_argument("--customer", help="取引先企業名（完全一致。省略時はすべての取引先）")
+    bundle_parser.add_argument("--issuer", help="発行元プロファイルのID")
+    bundle_parser.add_argument("--types", nargs="+", choices=DOCUMENT_TYPES, default=BUNDLE_TYPES, help=f"まとめる書類の種別（既定: {' '.join(BUNDLE_TYPES)}）")
+    bundle_parser.set_defaults(func=run_bundle)
+
+    master_parser = subparsers.add_parser("master", help="取引先マスタ・品目マスタに登録・検索する")
+    master_parser.add_argument("table", choices=["customers", "items"], help="対象のマスタ（customers: 取引先 / items: 品目）")
+    master_parser.add_argument("--db", default="documents.db", help="データベースファイル")
+    master_parser.add_argument("--import", dest="import_file", help="登録するCSV（customers: name 列 / items: summary, unit, unit_price, tax_rate 列）")
+    master_parser.add_argument("--search", help="入力補完と同じ方法で検索する文字列（部分一致、よく使う順）")
+    master_parser.add_argument("--limit", type=int, default=10, help="検索結果の最大件数")
+    master_parser.set_defaults(func=run_master)
+
+    issuer_parser = subparsers.add_parser("issuer", help="発行元プロファイル（自社情報）を登録・一覧表示する")
+    issuer_parser.add_argument("--db", default="documents.db", help="データベースファイル")
+    issuer_parser.add_argument("--import", dest="import_file", help=f"登録するCSV（issuer_id 列と自社情報の列。issuer_id が空なら {DEFAULT_ISSUER_ID}）")
+    issuer_parser.set_defaults(func=run_issuer)
+    return parser
+
+
+def main(argv=None):
+    """コマンドラインのエントリーポイント。"""
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=get_log_level(args.log_level), format='%(asctime)s - %(levelname)s - %(message)s')
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,624 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import get_registry
+from workspace import OutputPublisher, get_scratch_root, temp_prefix
+
+# Windows の既定インストール先
+DEFAULT_WINDOWS_SOFFICE = r"C:\Program Files\LibreOffice\program\soffice.exe"
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "soffice_worker.py")
+
+# 変換1件の制限時間の既定値（秒）。soffice の初回起動（プロファイルの作成）を含めても十分な長さにする
+DEFAULT_CONVERT_TIMEOUT = 120.0
+
+# まとめ変換の制限時間は、1件分の制限時間にブック1冊あたりこの秒数を加えた時間とする（通常は1冊1秒未満で変換できる）
+BATCH_SECONDS_PER_FILE = 2.0
+
+# 変換に失敗したときの再試行回数と、再試行までの待ち時間（秒。失敗のたびに倍にし、上限で止める）
+DEFAULT_CONVERT_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 1.0
+MAX_RETRY_BACKOFF = 30.0
+
+# 連続してこの回数失敗したらコンバーターへの投入を止め、RESET_TIMEOUT 秒後に1件だけ試す
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60.0
+
+
+class ConversionError(Exception):
+    """PDF変換に失敗したことを表す例外。"""
+
+
+class WorkerCrashed(ConversionError):
+    """常駐ワーカー（またはその soffice）が異常終了したことを表す例外。"""
+
+
+class ConversionTimeout(ConversionError):
+    """制限時間内に変換が終わらず、soffice を強制終了したことを表す例外。"""
+
+
+class ConverterUnavailable(ConversionError):
+    """変換の失敗が続いたため、コンバーターへの投入を一時的に止めていることを表す例外。"""
+
+
+def find_soffice():
+    """LibreOffice（soffice）の実行ファイルを探す。環境変数 DOCGEN_SOFFICE を優先する。"""
+    configured = os.environ.get("DOCGEN_SOFFICE")
+    if configured:
+        return configured
+    for name in ("soffice", "libreoffice"):
+        found = shutil.which(name)
+        if found:
+            return found
+    return DEFAULT_WINDOWS_SOFFICE
+
+
+def find_uno_python(soffice_path):
+    """UNOを利用できるPythonを探す。環境変数 DOCGEN_UNO_PYTHON を優先する。"""
+    configured = os.environ.get("DOCGEN_UNO_PYTHON")
+    if configured:
+        return configured
+    try:
+        import uno  # noqa: F401
+        return sys.executable
+    except ImportError:
+        pass
+    # LibreOffice 同梱のPython（soffice と同じ program ディレクトリにある）
+    program_dir = os.path.dirname(os.path.realpath(soffice_path))
+    for name in ("python.exe", "python", "python3"):
+        candidate = os.path.join(program_dir, name)
+        if os.path.exists(candidate):
+            return candidate
+    raise ConversionError("Python with the 'uno' module was not found. Set DOCGEN_UNO_PYTHON.")
+
+
+def get_convert_timeout(timeout=None):
+    """変換1件の制限時間（秒）を決める。未指定なら環境変数 DOCGEN_CONVERT_TIMEOUT（既定120）を使う。0なら無制限。"""
+    if timeout is None:
+        timeout = os.environ.get("DOCGEN_CONVERT_TIMEOUT", DEFAULT_CONVERT_TIMEOUT)
+    return max(0.0, float(timeout))
+
+
+def get_convert_retries(retries=None):
+    """変換に失敗したときの再試行回数を決める。未指定なら環境変数 DOCGEN_CONVERT_RETRIES（既定2）を使う。"""
+    if retries is None:
+        retries = int(os.environ.get("DOCGEN_CONVERT_RETRIES", DEFAULT_CONVERT_RETRIES))
+    return max(0, retries)
+
+
+def _process_group_options():
+    """子プロセスを別のプロセスグループで起動する Popen の引数を返す（soffice.bin まで含めて強制終了できるようにする）。"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def kill_process_tree(process):
+    """Popen で起動したプロセスを、そこから起動された soffice.bin などの子プロセスごと強制終了する。"""
+    if sys.platform == "win32":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+def run_soffice(command, timeout=None):
+    """soffice を実行して終了を待つ。制限時間を過ぎたら子プロセスごと強制終了して ConversionTimeout を送出する。"""
+    process = subprocess.Popen(command, **_process_group_options())
+    try:
+        returncode = process.wait(timeout=timeout or None)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(process)
+        raise ConversionTimeout(f"LibreOffice did not finish within {timeout:g} seconds and was killed.")
+    except BaseException:
+        # 中断（Ctrl+C など）された場合も、別グループの soffice を残さない
+        kill_process_tree(process)
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def convert_sheet_to_pdf_with_libreoffice(input_file, output_dir, sheet_name, libreoffice_path=None, timeout=None):
+    """LibreOfficeを使用して指定シートのみをPDFに変換する。timeout（秒）を過ぎたら強制終了する。"""
+    libreoffice_path = libreoffice_path or find_soffice()
+    try:
+        # LibreOfficeで指定シートをPDFに変換
+        run_soffice([
+            libreoffice_path, "--headless", "--convert-to", "pdf:calc_pdf_Export", input_file,
+            "--outdir", output_dir, f"--infilter=calc:sheet={sheet_name}"
+        ], timeout)
+        logging.info(f"Successfully converted sheet '{sheet_name}' in {input_file} to PDF using LibreOffice.")
+    except (subprocess.CalledProcessError, ConversionTimeout) as e:
+        logging.error(f"Error converting sheet '{sheet_name}' in {input_file} to PDF: {e}")
+        raise
+    except FileNotFoundError:
+        logging.error("LibreOffice executable not found. Please check the path.")
+        raise
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + ".pdf")
+
+
+class LibreOfficeConverter:
+    def __init__(self, soffice_path=None, timeout=None):
+        """書類1件ごとに soffice を起動してPDFに変換するコンバーター。"""
+        self.soffice_path = soffice_path or find_soffice()
+        self.timeout = get_convert_timeout(timeout)
+
+    def convert(self, input_file, output_dir, sheet_name):
+        """指定シートをPDFに変換し、出力したPDFのパスを返す。"""
+        return convert_sheet_to_pdf_with_libreoffice(input_file, output_dir, sheet_name, self.soffice_path, self.timeout)
+
+    def close(self):
+        """解放するリソースはない。"""
+
+
+def convert_files_with_libreoffice(input_files, output_dir, libreoffice_path=None, profile_dir=None, timeout=None,
+                                   sheet_name=None):
+    """1回の soffice 起動で複数のブックをまとめてPDFに変換する。timeout（秒）を過ぎたら強制終了する。
+
+    sheet_name を指定すると、1件ずつの変換（convert_sheet_to_pdf_with_libreoffice）と同じく各ブックのそのシートだけを変換する。
+    """
+    libreoffice_path = libreoffice_path or find_soffice()
+    command = [libreoffice_path, "--headless"]
+    if profile_dir:
+        # 同時に複数の soffice を起動できるよう、起動ごとに別のプロファイルを使う
+        command.append(f"-env:UserInstallation=file:///{os.path.abspath(profile_dir).replace(os.sep, '/').lstrip('/')}")
+    command += ["--convert-to", "pdf:calc_pdf_Export", "--outdir", output_dir]
+    if sheet_name:
+        command.append(f"--infilter=calc:sheet={sheet_name}")
+    command += list(input_files)
+    try:
+        run_soffice(command, timeout)
+        logging.info(f"Successfully converted {len(input_files)} workbooks to PDF using LibreOffice.")
+    except (subprocess.CalledProcessError, ConversionTimeout) as e:
+        logging.error(f"Error converting {len(input_files)} workbooks to PDF: {e}")
+        raise
+    except FileNotFoundError:
+        logging.error("LibreOffice executable not found. Please check the path.")
+        raise
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        """連続した失敗を数え、しきい値に達したら一定時間は変換を受け付けないサーキットブレーカー。
+
+        止めてから reset_timeout 秒後に1件だけ試し、成功すれば再開、失敗すればまた止める。
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # "closed"（通常） / "open"（停止中） / "half_open"（1件だけ試行中）
+        self.failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """変換を投入してよいかどうかを返す。"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                logging.info("Circuit breaker half-open: trying one conversion.")
+                return True
+            return False
+
+    def record_success(self):
+        """変換の成功を記録する。"""
+        with self._lock:
+            if self.state != "closed":
+                logging.info("Circuit breaker closed: conversions resumed.")
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        """変換の失敗を記録し、失敗が続いていれば変換を止める。"""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                logging.error(f"Circuit breaker open after {self.failures} consecutive conversion failures; "
+                              f"pausing conversions for {self.reset_timeout:g} seconds.")
+
+
+class BatchConversionStage:
+    def __init__(self, soffice_path=None, chunk_size=50, flush_interval=5.0, parallel=1, staging_dir=None, timeout=None,
+                 breaker=None, metrics=None, publisher=None):
+        """Excelファイルをステージングディレクトリに溜め、N件ずつまとめてPDFに変換するステージ。
+
+        まとめ変換が失敗・タイムアウトしたチャンクは1件ずつ変換し直し、原因の書類だけを失敗にする。
+        ステージングディレクトリは既定で作業領域（get_scratch_root）に作り、PDFは publisher で保存先に配置する。
+        """
+        self.soffice_path = soffice_path or find_soffice()
+        self.chunk_size = max(1, chunk_size)
+        self.flush_interval = flush_interval
+        self.timeout = get_convert_timeout(timeout)
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or get_registry()
+        self.publisher = publisher or OutputPublisher()
+        self._owns_staging_dir = staging_dir is None
+        self.staging_dir = staging_dir or tempfile.mkdtemp(prefix=temp_prefix("staging"), dir=get_scratch_root())
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self._pending = []
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._closed = False
+        # 同時に実行する soffice の数だけプロファイルを用意する
+        self.parallel = max(1, parallel)
+        self._executor = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="BatchConversion")
+        self._profiles = queue.Queue()
+        for index in range(self.parallel):
+            self._profiles.put(os.path.join(self.staging_dir, f"profile{index}"))
+        self._flusher = threading.Thread(target=self._flush_loop, name="BatchConversionFlusher", daemon=True)
+        self._flusher.start()
+
+    def new_staging_path(self):
+        """ステージングディレクトリ内の重複しないExcelファイルのパスを返す。"""
+        return os.path.join(self.staging_dir, f"{uuid.uuid4().hex}.xlsx")
+
+    def submit(self, input_file, destination, sheet_name=None):
+        """変換待ちのブックを登録する。PDFの保存先パスを結果とする Future を返す。
+
+        sheet_name を指定すると、そのシートだけを変換する（書類生成エンジンでは書類の種別と同じ名前のシート）。
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise ConversionError("Batch conversion stage is closed.")
+            self._pending.append((input_file, destination, future, sheet_name))
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._condition.notify_all()
+            chunk = self._take_chunk() if len(self._pending) >= self.chunk_size else None
+        if chunk:
+            self._dispatch(chunk)
+        return future
+
+    def flush(self):
+        """変換待ちのブックをすべて変換に回す。"""
+        while True:
+            with self._condition:
+                chunk = self._take_chunk()
+            if not chunk:
+                return
+            self._dispatch(chunk)
+
+    def _dispatch(self, chunk):
+        """チャンクの変換をバックグラウンドで開始する（ブックの作成と変換を並行させる）。"""
+        self._executor.submit(self._convert_chunk, chunk)
+
+    def _take_chunk(self):
+        """変換待ちの先頭から最大 chunk_size 件を取り出す。ロックを保持した状態で呼ぶこと。"""
+        chunk = self._pending[:self.chunk_size]
+        del self._pending[:self.chunk_size]
+        self._oldest = time.monotonic() if self._pending else None
+        return chunk
+
+    def _flush_loop(self):
+        """最も古い変換待ちが flush_interval を過ぎたらチャンクを変換する。"""
+        while True:
+            with self._condition:
+                while not self._closed and (self._oldest is None or time.monotonic() - self._oldest < self.flush_interval):
+                    timeout = None if self._oldest is None else self.flush_interval - (time.monotonic() - self._oldest)
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+                chunk = self._take_chunk()
+            if chunk:
+                self._dispatch(chunk)
+
+    def _run_soffice(self, chunk, output_dir, profile_dir):
+        """サーキットブレーカーを通して、変換するシートごとに1回の soffice 起動でチャンクを変換する。"""
+        # 読み込みフィルタのシート名は起動ごとに1つのため、種別の混ざったチャンクはシート名ごとに分けて変換する
+        groups = {}
+        for entry in chunk:
+            groups.setdefault(entry[3], []).append(entry[0])
+        for sheet_name, input_files in groups.items():
+            self._run_soffice_once(input_files, output_dir, profile_dir, sheet_name)
+
+    def _run_soffice_once(self, input_files, output_dir, profile_dir, sheet_name):
+        """サーキットブレーカーを通して、1回の soffice 起動で同じシート名のブックをまとめて変換する。"""
+        if not self.breaker.allow():
+            self.metrics.increment("conversion_rejections_total")
+            raise ConverterUnavailable("LibreOffice is failing repeatedly; batch conversion is paused.")
+        timeout = self.timeout + BATCH_SECONDS_PER_FILE * len(input_files) if self.timeout else None
+        try:
+            convert_files_with_libreoffice(input_files, output_dir, self.soffice_path, profile_dir, timeout, sheet_name)
+        except ConversionTimeout:
+            self.breaker.record_failure()
+            self.metrics.increment("conversion_timeouts_total")
+            raise
+        except (subprocess.CalledProcessError, OSError) as e:
+            self.breaker.record_failure()
+            raise ConversionError(f"Batch conversion failed: {e}")
+        self.breaker.record_success()
+
+    def _convert_chunk(self, chunk):
+        """1回の soffice 起動でチャンクを変換し、PDFをそれぞれの保存先へ振り分ける。"""
+        profile_dir = self._profiles.get()
+        output_dir = tempfile.mkdtemp(prefix="out_", dir=self.staging_dir)
+        try:
+            try:
+                self._run_soffice(chunk, output_dir, profile_dir)
+            except ConversionError as e:
+                if len(chunk) == 1 or isinstance(e, ConverterUnavailable):
+                    for _, _, future, _ in chunk:
+                        future.set_exception(e)
+                    return
+                # 1冊の不正なブックでチャンク全体を失敗にしないよう、1件ずつ変換し直す
+                logging.warning(f"Batch conversion of {len(chunk)} workbooks failed, converting them one by one: {e}")
+                for entry in chunk:
+                    try:
+                        self._run_soffice([entry], output_dir, profile_dir)
+                    except ConversionError as error:
+                        entry[2].set_exception(error)
+            for input_file, destination, future, _ in chunk:
+                if future.done():
+                    continue
+                pdf_file = os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + ".pdf")
+                if not os.path.exists(pdf_file):
+                    future.set_exception(ConversionError(f"LibreOffice did not produce a PDF for {input_file}"))
+                    continue
+                try:
+                    self.publisher.publish(pdf_file, destination)
+                    future.set_result(destination)
+                except OSError as e:
+                    future.set_exception(e)
+        finally:
+            self._profiles.put(profile_dir)
+            shutil.rmtree(output_dir, ignore_errors=True)
+            for input_file, _, _, _ in chunk:
+                if os.path.exists(input_file):
+                    os.remove(input_file)
+
+    def close(self):
+        """残りの変換待ちを変換し、ステージを終了する。"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._flusher.join()
+        self.flush()
+        self._executor.shutdown(wait=True)
+        if self._owns_staging_dir:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LibreOfficeWorker:
+    def __init__(self, soffice_path, uno_python, profile_dir, startup_timeout=60.0, timeout=None):
+        """専用プロファイルを持つ常駐 soffice 1つ分を管理する。
+
+        timeout（秒、0なら無制限）以内に変換の応答がなければ、ワーカーを soffice ごと強制終了する。
+        """
+        self.soffice_path = soffice_path
+        self.uno_python = uno_python
+        self.profile_dir = profile_dir
+        self.startup_timeout = startup_timeout
+        self.timeout = get_convert_timeout(timeout)
+        self.process = None
+        self._replies = None
+
+    def is_alive(self):
+        """ワーカープロセスが動作中かどうかを返す。"""
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """ワーカープロセスを起動し、soffice への接続完了を待つ。"""
+        self.stop()
+        self.process = subprocess.Popen([
+            self.uno_python, WORKER_SCRIPT,
+            "--soffice", self.soffice_path,
+            "--profile", self.profile_dir,
+            "--pipe-name", f"docgen_{uuid.uuid4().hex}",
+            "--startup-timeout", str(self.startup_timeout),
+        ], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding="utf-8", bufsize=1,
+            **_process_group_options())
+        # 応答を制限時間付きで待てるよう、標準出力は別スレッドで読み取る
+        self._replies = queue.Queue()
+        threading.Thread(target=self._read_replies, args=(self.process.stdout, self._replies),
+                         name="LibreOfficeWorkerReader", daemon=True).start()
+        # startup_timeout は soffice への接続を待つ時間のため、ワーカー自体の起動の分だけ余裕を持たせる
+        reply = self._read_reply(self.startup_timeout + 30)
+        if not reply.get("ready"):
+            raise WorkerCrashed(f"LibreOffice worker failed to start: {reply}")
+        logging.info(f"LibreOffice worker started (pid {self.process.pid}, profile {self.profile_dir}).")
+
+    def _read_replies(self, stream, replies):
+        """ワーカーの標準出力を1行ずつキューに入れる。ワーカーが終了したら None を入れる。"""
+        for line in stream:
+            replies.put(line)
+        replies.put(None)
+
+    def _read_reply(self, timeout=None):
+        """ワーカーからの応答を1行読み取る。timeout 秒以内に応答がなければ強制終了して ConversionTimeout を送出する。"""
+        try:
+            line = self._replies.get(timeout=timeout or None)
+        except queue.Empty:
+            self.kill()
+            raise ConversionTimeout(f"LibreOffice worker did not respond within {timeout:g} seconds and was killed.")
+        if line is None:
+            self.stop()
+            raise WorkerCrashed("LibreOffice worker exited unexpectedly.")
+        return json.loads(line)
+
+    def convert(self, input_file, output_dir, sheet_name):
+        """ワーカーに変換ジョブを送り、出力したPDFのパスを返す。"""
+        job = {"input": os.path.abspath(input_file), "output_dir": os.path.abspath(output_dir), "sheet": sheet_name}
+        try:
+            self.process.stdin.write(json.dumps(job, ensure_ascii=False) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            self.stop()
+            raise WorkerCrashed(f"LibreOffice worker is not accepting jobs: {e}")
+        reply = self._read_reply(self.timeout)
+        if reply.get("crashed"):
+            self.stop()
+            raise WorkerCrashed(reply.get("error", "soffice crashed"))
+        if not reply.get("ok"):
+            raise ConversionError(reply.get("error", "conversion failed"))
+        return reply["output"]
+
+    def stop(self):
+        """ワーカープロセスを終了する。"""
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.stdin.close()
+                self.process.wait(timeout=15)
+        except (OSError, subprocess.TimeoutExpired):
+            kill_process_tree(self.process)
+        finally:
+            self.process = None
+
+    def kill(self):
+        """応答しないワーカーを soffice ごと強制終了する（次の変換で起動し直す）。"""
+        if self.process is None:
+            return
+        try:
+            kill_process_tree(self.process)
+        finally:
+            self.process = None
+
+
+class LibreOfficePool:
+    def __init__(self, size=None, soffice_path=None, uno_python=None, profile_root=None, max_restarts=1, metrics=None,
+                 timeout=None):
+        """常駐 soffice ワーカーのプール。変換ジョブを並列に処理する。"""
+        self.size = size or os.cpu_count() or 1
+        self.metrics = metrics or get_registry()
+        self.soffice_path = soffice_path or find_soffice()
+        self.uno_python = uno_python or find_uno_python(self.soffice_path)
+        self.max_restarts = max_restarts
+        self.timeout = get_convert_timeout(timeout)
+        self._owns_profile_root = profile_root is None
+        self.profile_root = profile_root or tempfile.mkdtemp(prefix=temp_prefix("profiles"))
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        for index in range(self.size):
+            worker = LibreOfficeWorker(self.soffice_path, self.uno_python, os.path.join(self.profile_root, f"worker{index}"),
+                                       timeout=self.timeout)
+            self._workers.append(worker)
+            self._idle.put(worker)
+
+    def convert(self, input_file, output_dir, sheet_name):
+        """空いているワーカーで変換する。ワーカーが落ちていれば再起動して再試行する。"""
+        worker = self._idle.get()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    if not worker.is_alive():
+                        worker.start()
+                    return worker.convert(input_file, output_dir, sheet_name)
+                except WorkerCrashed as e:
+                    attempt += 1
+                    if attempt > self.max_restarts:
+                        raise
+                    self.metrics.increment("conversion_retries_total")
+                    logging.warning(f"LibreOffice worker crashed, restarting ({attempt}/{self.max_restarts}): {e}")
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        """すべてのワーカーを終了し、一時プロファイルを削除する。"""
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+            if self._owns_profile_root:
+                shutil.rmtree(self.profile_root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SupervisedConverter:
+    def __init__(self, converter, retries=None, backoff=DEFAULT_RETRY_BACKOFF, breaker=None, metrics=None):
+        """コンバーターを監視し、失敗・タイムアウトした変換を待ち時間を空けて再試行する。
+
+        失敗が続いた場合はサーキットブレーカーで投入を止め、動かないコンバーターに書類を送り続けない。
+        """
+        self.converter = converter
+        self.retries = get_convert_retries(retries)
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or get_registry()
+
+    def convert(self, input_file, output_dir, sheet_name):
+        """指定シートをPDFに変換し、出力したPDFのパスを返す。再試行しても失敗した場合は最後の例外を送出する。"""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.metrics.increment("conversion_rejections_total")
+                raise ConverterUnavailable("LibreOffice is failing repeatedly; conversions are paused.")
+            try:
+                pdf_file = self.converter.convert(input_file, output_dir, sheet_name)
+            except (ConversionError, subprocess.CalledProcessError) as e:
+                self.breaker.record_failure()
+                if isinstance(e, ConversionTimeout):
+                    self.metrics.increment("conversion_timeouts_total")
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                delay = min(MAX_RETRY_BACKOFF, self.backoff * 2 ** (attempt - 1))
+                self.metrics.increment("conversion_retries_total")
+                logging.warning(f"Conversion failed, retrying in {delay:g} seconds ({attempt}/{self.retries}): {e}")
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            return pdf_file
+
+    def close(self):
+        """監視しているコンバーターを解放する。"""
+        self.converter.close()
+
+
+def get_pool_size(pool_size=None):
+    """常駐ワーカー数を決める。未指定なら環境変数 DOCGEN_CONVERTER_WORKERS（既定0）を使う。"""
+    if pool_size is None:
+        pool_size = int(os.environ.get("DOCGEN_CONVERTER_WORKERS", "0"))
+    return pool_size
+
+
+def create_converter(soffice_path=None, pool_size=None, timeout=None, retries=None):
+    """設定に応じてコンバーターを作成する。pool_size が0なら書類ごとに soffice を起動する。
+
+    作成したコンバーターは SupervisedConverter で包み、タイムアウト・再試行・サーキットブレーカーを効かせる。
+    """
+    pool_size = get_pool_size(pool_size)
+    timeout = get_convert_timeout(timeout)
+    if pool_size > 0:
+        converter = LibreOfficePool(size=pool_size, soffice_path=soffice_path, timeout=timeout)
+    else:
+        converter = LibreOfficeConverter(soffice_path, timeout)
+    return SupervisedConverter(converter, retries)
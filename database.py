@@ -0,0 +1,606 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from document_request import DEFAULT_ISSUER_ID, format_document_number
+from metrics import get_registry
+
+# 自社情報（発行元プロファイル）の列（id・発行元IDを除く）。output_dir は発行元ごとのPDFの保存先
+COMPANY_INFO_COLUMNS = (
+    "company_name", "postal_code", "address", "address_detail", "phone_number",
+    "contact_person", "account_type", "bank_branch", "account_number", "account_name", "output_dir",
+)
+
+# 品目マスタの列（摘要で引き当て、単位・単価・税率を補完する）
+ITEM_COLUMNS = ("summary", "unit", "unit_price", "tax_rate")
+
+# 入力補完の候補数の既定値
+DEFAULT_SUGGESTION_LIMIT = 10
+
+# FTS5 の trigram トークナイザは3文字未満の語を索引から引けないため、それより短い入力は前方一致で探す
+TRIGRAM_MIN_LENGTH = 3
+
+# 入力補完の検索で使用回数順に並べ替える候補の上限（1〜2文字の入力で数万件に一致しても数ミリ秒で返すため）
+SUGGESTION_CANDIDATES = 500
+
+# 発行台帳の金額列
+LEDGER_AMOUNT_COLUMNS = (
+    "total_excluding_tax", "tax_10_total", "tax_10_tax", "tax_8_total", "tax_8_tax",
+    "tax_0_total", "total_tax", "total_including_tax",
+)
+
+
+class DatabaseManager:
+    def __init__(self, db_name="documents.db", metrics=None):
+        # データベースマネージャの初期化。データベースファイルのパスを設定。
+        self.db_path = os.path.abspath(db_name)
+        # 操作ごとの所要時間・エラー数の集計先
+        self.metrics = metrics or get_registry()
+        self.conn = None
+        # 接続はアプリケーション全体で1本を使い回すため、スレッド間の排他に使う
+        self.lock = threading.RLock()
+        # 発行元ID → 自社情報（登録されていない発行元は None）
+        self._company_info_cache = {}
+        # 取引先・品目マスタの全文検索索引を使えるか（接続時に判定する）
+        self.fts_enabled = False
+
+    @contextmanager
+    def _measure(self, operation):
+        """データベース操作の所要時間（ロック待ちを含む）とエラー数を記録する。"""
+        started = time.perf_counter()
+        try:
+            yield
+        except sqlite3.Error:
+            self.metrics.increment("database_errors_total", {"operation": operation})
+            raise
+        finally:
+            self.metrics.observe("database_duration_seconds", time.perf_counter() - started, {"operation": operation})
+
+    def connect(self):
+        """データベースへ接続し、必要ならテーブルを作成する。接続済みなら何もしない。"""
+        with self.lock:
+            if self.conn is not None:
+                return self.conn
+            try:
+                with self._measure("connect"):
+                    # データベースファイルが存在しない場合は新規作成
+                    self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+                    # 読み取りが書き込みを待たないようWALモードで運用する
+                    self.conn.execute("PRAGMA journal_mode=WAL")
+                    self.conn.execute("PRAGMA synchronous=NORMAL")
+                    self.create_tables()
+                logging.info("Database connected successfully.")
+            except sqlite3.Error as e:
+                logging.error(f"Error connecting to database: {e}")
+                self.conn = None
+                raise
+            return self.conn
+
+    def create_tables(self):
+        """テーブルが存在しない場合は作成する（接続時に1度だけ実行）。"""
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS company_info (
+                    id INTEGER PRIMARY KEY,
+                    company_name TEXT,
+                    postal_code TEXT,
+                    address TEXT,
+                    address_detail TEXT,
+                    phone_number TEXT,
+                    contact_person TEXT,
+                    account_type TEXT,
+                    bank_branch TEXT,
+                    account_number TEXT,
+                    account_name TEXT,
+                    issuer_id TEXT,
+                    output_dir TEXT
+                )
+            ''')
+            # 発行台帳（生成した書類1件につき1行）
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS document_ledger (
+                    id INTEGER PRIMARY KEY,
+                    document_type TEXT NOT NULL,
+                    customer_name TEXT NOT NULL,
+                    issue_date TEXT NOT NULL,
+                    expiry_date TEXT,
+                    subject TEXT,
+                    total_excluding_tax INTEGER,
+                    tax_10_total INTEGER,
+                    tax_10_tax INTEGER,
+                    tax_8_total INTEGER,
+                    tax_8_tax INTEGER,
+                    tax_0_total INTEGER,
+                    total_tax INTEGER,
+                    total_including_tax INTEGER,
+                    output_path TEXT NOT NULL,
+                    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    issuer_id TEXT,
+                    document_number TEXT
+                )
+            ''')
+            self.add_missing_columns()
+            # 自社情報は発行元IDで引く（発行元プロファイルを追加する前の1件だけの自社情報は既定の発行元にする）
+            self.conn.execute("UPDATE company_info SET issuer_id = CASE id WHEN 1 THEN ? ELSE CAST(id AS TEXT) END "
+                              "WHERE issuer_id IS NULL", (DEFAULT_ISSUER_ID,))
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_company_info_issuer ON company_info (issuer_id)")
+            # 取引先・種別での検索は発行日の範囲指定と組み合わせることが多いため複合索引にする
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_customer_type_date ON document_ledger (customer_name, document_type, issue_date)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_type_date ON document_ledger (document_type, issue_date)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_date ON document_ledger (issue_date)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_number ON document_ledger (document_number)")
+            # 保存先のPDFを置き換えてよいか（別の書類のPDFでないか）を確かめるときに引く
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_output_path ON document_ledger (output_path)")
+            # 書類番号の採番。document_sequences は発行元・種別・年ごとの次の番号、
+            # document_number_reservations は予約済みで台帳に記録されていない番号（owner_pid が NULL なら返却済み）
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS document_sequences (
+                    issuer_id TEXT NOT NULL,
+                    document_type TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    next_number INTEGER NOT NULL,
+                    PRIMARY KEY (issuer_id, document_type, year)
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS document_number_reservations (
+                    issuer_id TEXT NOT NULL,
+                    document_type TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    number INTEGER NOT NULL,
+                    document_number TEXT NOT NULL,
+                    owner_pid INTEGER,
+                    PRIMARY KEY (issuer_id, document_type, year, number)
+                )
+            ''')
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_number "
+                              "ON document_number_reservations (issuer_id, document_type, document_number)")
+            # 取引先マスタ・品目マスタ（入力補完に使う。書類を発行するたびに使用回数を数える）
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS customers (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    use_count INTEGER NOT NULL DEFAULT 0,
+                    last_used_at TEXT
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY,
+                    summary TEXT NOT NULL UNIQUE,
+                    unit TEXT,
+                    unit_price TEXT,
+                    tax_rate TEXT,
+                    use_count INTEGER NOT NULL DEFAULT 0,
+                    last_used_at TEXT
+                )
+            ''')
+        self.fts_enabled = self.create_master_indexes()
+        with self.conn:
+            # マスタを追加する前から使っているデータベースでは、発行台帳の取引先を取引先マスタに取り込む
+            if self.conn.execute("SELECT 1 FROM customers LIMIT 1").fetchone() is None:
+                self.conn.execute('''
+                    INSERT INTO customers (name, use_count, last_used_at)
+                    SELECT customer_name, COUNT(*), MAX(issue_date) FROM document_ledger
+                    WHERE customer_name <> '' GROUP BY customer_name
+                ''')
+
+    def add_missing_columns(self):
+        """以前のバージョンで作成したデータベースに、発行元ID・保存先・書類番号の列を追加する。"""
+        for table, column in (("company_info", "issuer_id"), ("company_info", "output_dir"),
+                              ("document_ledger", "issuer_id"), ("document_ledger", "document_number")):
+            columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            if column not in columns:
+                try:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+                except sqlite3.OperationalError as e:
+                    # 同時に起動した別のプロセスが先に追加した場合
+                    if "duplicate column" not in str(e):
+                        raise
+
+    def create_master_indexes(self):
+        """取引先名・摘要の部分一致検索用の FTS5 索引を作成し、使えるかどうかを返す。
+
+        日本語は単語の区切りがないため trigram トークナイザ（SQLite 3.34以降）を使う。
+        FTS5 を使えない SQLite では索引を作らず、検索は LIKE で行う。
+        """
+        try:
+            with self.conn:
+                for table, column in (("customers", "name"), ("items", "summary")):
+                    exists = self.conn.execute(
+                        "SELECT 1 FROM sqlite_master WHERE name = ?", (f"{table}_fts",)).fetchone() is not None
+                    self.conn.execute(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5("
+                        f"{column}, content='{table}', content_rowid='id', tokenize='trigram')")
+                    if not exists:
+                        # 索引を作る前に登録されていた行を索引に取り込む
+                        self.conn.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+                    # マスタの変更に合わせて索引を更新する（使用回数の更新では索引を書き換えない）
+                    self.conn.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                            INSERT INTO {table}_fts (rowid, {column}) VALUES (new.id, new.{column});
+                        END
+                    ''')
+                    self.conn.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                            INSERT INTO {table}_fts ({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                        END
+                    ''')
+                    self.conn.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {column} ON {table} BEGIN
+                            INSERT INTO {table}_fts ({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                            INSERT INTO {table}_fts (rowid, {column}) VALUES (new.id, new.{column});
+                        END
+                    ''')
+            return True
+        except sqlite3.OperationalError as e:
+            logging.warning(f"SQLite FTS5 (trigram) is not available, master search falls back to LIKE: {e}")
+            return False
+
+    def close(self):
+        """データベース接続を安全に閉じる。"""
+        with self.lock:
+            try:
+                if self.conn:
+                    # 索引の統計情報を必要に応じて更新し、検索時に適切な索引が選ばれるようにする
+                    self.conn.execute("PRAGMA optimize")
+                    self.conn.close()
+                    self.conn = None
+                    logging.info("Database connection closed.")
+            except sqlite3.Error as e:
+                logging.error(f"Error closing database connection: {e}")
+                raise
+
+    def invalidate_cache(self):
+        """メモリ上の自社情報キャッシュを破棄する。"""
+        with self.lock:
+            self._company_info_cache = {}
+
+    def get_company_info(self, issuer_id=None):
+        """発行元の自社情報を辞書形式で返す。issuer_id を省略すると既定の発行元。2回目以降はメモリ上のキャッシュを返す。"""
+        issuer_id = issuer_id or DEFAULT_ISSUER_ID
+        with self.lock:
+            if issuer_id not in self._company_info_cache:
+                self._company_info_cache[issuer_id] = self._load_company_info(issuer_id)
+            info = self._company_info_cache[issuer_id]
+            if info is None:
+                return None
+            # 呼び出し側で書き換えられてもキャッシュに影響しないよう複製を返す
+            return dict(info)
+
+    def get_issuer_profiles(self):
+        """登録されているすべての発行元の自社情報を1回の問い合わせで読み込み、発行元IDをキーにした辞書で返す。
+
+        一括生成の開始時に呼び、書類ごとにデータベースを引かずに済むようにする。読み込んだ内容はキャッシュにも入れる。
+        """
+        with self._measure("get_issuer_profiles"), self.lock:
+            try:
+                cursor = self.connect().execute("SELECT * FROM company_info ORDER BY id")
+                columns = [column[0] for column in cursor.description]
+                profiles = {}
+                for row in cursor.fetchall():
+                    info = dict(zip(columns, row))
+                    profiles[info["issuer_id"]] = info
+                    self._company_info_cache[info["issuer_id"]] = info
+            except sqlite3.Error as e:
+                logging.error(f"Error getting issuer profiles: {e}")
+                raise
+        return {issuer_id: dict(info) for issuer_id, info in profiles.items()}
+
+    def _load_company_info(self, issuer_id):
+        """発行元の自社情報をデータベースから読み込む。"""
+        try:
+            with self._measure("get_company_info"):
+                cursor = self.connect().execute("SELECT * FROM company_info WHERE issuer_id = ?", (issuer_id,))
+                row = cursor.fetchone()
+            if row:
+                # カラム名と値をペアにした辞書として返す
+                columns = [column[0] for column in cursor.description]
+                return dict(zip(columns, row))
+            else:
+                logging.warning(f"Company info not found (issuer {issuer_id}).")
+                return None  # None を返すように修正
+        except sqlite3.Error as e:
+            logging.error(f"Error getting company info: {e}")
+            raise
+
+    def update_company_info(self, info, issuer_id=None):
+        """発行元の自社情報をデータベースに更新または新規挿入する。issuer_id を省略すると既定の発行元。"""
+        issuer_id = issuer_id or DEFAULT_ISSUER_ID
+        values = tuple(info.get(column) for column in COMPANY_INFO_COLUMNS)
+        with self._measure("update_company_info"), self.lock:
+            try:
+                conn = self.connect()
+                with conn:
+                    conn.execute(f'''
+                        INSERT INTO company_info (issuer_id, {", ".join(COMPANY_INFO_COLUMNS)})
+                        VALUES (?, {", ".join("?" * len(COMPANY_INFO_COLUMNS))})
+                        ON CONFLICT (issuer_id) DO UPDATE SET
+                            {", ".join(f"{column} = excluded.{column}" for column in COMPANY_INFO_COLUMNS)}
+                    ''', (issuer_id,) + values)
+                logging.info(f"Company info saved (issuer {issuer_id}).")
+            except sqlite3.Error as e:
+                logging.error(f"Error updating company info: {e}")
+                raise
+            finally:
+                # 書き込んだときだけキャッシュを破棄する
+                self.invalidate_cache()
+
+    def delete_company_info(self, issuer_id=None):
+        """発行元の自社情報をデータベースから削除する（通常は使用しない）。"""
+        issuer_id = issuer_id or DEFAULT_ISSUER_ID
+        with self._measure("delete_company_info"), self.lock:
+            try:
+                conn = self.connect()
+                with conn:
+                    conn.execute("DELETE FROM company_info WHERE issuer_id = ?", (issuer_id,))
+                logging.warning(f"Company info deleted (issuer {issuer_id}).")
+            except sqlite3.Error as e:
+                logging.error(f"Error deleting company info: {e}")
+                raise
+            finally:
+                self.invalidate_cache()
+
+    def record_document(self, request, totals, output_path):
+        """生成した書類を発行台帳に記録する。"""
+        amounts = tuple(int(round(totals.get(column) or 0)) for column in LEDGER_AMOUNT_COLUMNS)
+        with self._measure("record_document"), self.lock:
+            try:
+                conn = self.connect()
+                with conn:
+                    conn.execute(f'''
+                        INSERT INTO document_ledger (
+                            document_type, customer_name, issue_date, expiry_date, subject,
+                            {", ".join(LEDGER_AMOUNT_COLUMNS)}, output_path, issuer_id, document_number
+                        ) VALUES (?, ?, ?, ?, ?, {", ".join("?" * len(LEDGER_AMOUNT_COLUMNS))}, ?, ?, ?)
+                    ''', (
+                        request.document_type, request.company_name, request.issued_at.date().isoformat(),
+                        request.expiry_date.isoformat() if request.expiry_date else None, request.subject,
+                    ) + amounts + (os.path.abspath(output_path), request.issuer or DEFAULT_ISSUER_ID,
+                                   request.document_number or None))
+                    if request.document_number:
+                        # 台帳に記録した番号は予約から外す（同じトランザクションで行い、追加の書き込みを増やさない）
+                        conn.execute(
+                            "DELETE FROM document_number_reservations "
+                            "WHERE issuer_id = ? AND document_type = ? AND document_number = ?",
+                            (request.issuer or DEFAULT_ISSUER_ID, request.document_type, request.document_number))
+                    self._learn_masters(conn, request)
+            except sqlite3.Error as e:
+                logging.error(f"Error recording document: {e}")
+                raise
+
+    def get_document_owners(self, output_path):
+        """保存先が output_path の書類の (発行元ID, 種別, 書類番号) を、台帳から重複なしで返す。"""
+        with self._measure("get_document_owners"), self.lock:
+            try:
+                return [tuple(row) for row in self.connect().execute(
+                    "SELECT DISTINCT issuer_id, document_type, document_number FROM document_ledger "
+                    "WHERE output_path = ?", (os.path.abspath(output_path),))]
+            except sqlite3.Error as e:
+                logging.error(f"Error looking up documents by output path: {e}")
+                raise
+
+    def reserve_document_numbers(self, issuer_id, document_type, year, count):
+        """発行元・種別・年の書類番号を count 件予約し、番号（整数）のリストを昇順で返す。
+
+        返却された番号（欠番になるはずだった番号）を先に使い、足りない分を連番の続きから取る。
+        BEGIN IMMEDIATE で書き込みロックを取ってから読むため、複数のプロセスから同時に予約しても重複しない。
+        """
+        pid = os.getpid()
+        with self._measure("reserve_document_numbers"), self.lock:
+            conn = self.connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                numbers = [row[0] for row in conn.execute(
+                    "SELECT number FROM document_number_reservations "
+                    "WHERE issuer_id = ? AND document_type = ? AND year = ? AND owner_pid IS NULL "
+                    "ORDER BY number LIMIT ?", (issuer_id, document_type, year, count))]
+                conn.executemany(
+                    "UPDATE document_number_reservations SET owner_pid = ? "
+                    "WHERE issuer_id = ? AND document_type = ? AND year = ? AND number = ?",
+                    [(pid, issuer_id, document_type, year, number) for number in numbers])
+                remaining = count - len(numbers)
+                if remaining > 0:
+                    conn.execute("INSERT OR IGNORE INTO document_sequences VALUES (?, ?, ?, 1)",
+                                 (issuer_id, document_type, year))
+                    first = conn.execute(
+                        "SELECT next_number FROM document_sequences "
+                        "WHERE issuer_id = ? AND document_type = ? AND year = ?",
+                        (issuer_id, document_type, year)).fetchone()[0]
+                    conn.execute(
+                        "UPDATE document_sequences SET next_number = ? "
+                        "WHERE issuer_id = ? AND document_type = ? AND year = ?",
+                        (first + remaining, issuer_id, document_type, year))
+                    added = list(range(first, first + remaining))
+                    conn.executemany(
+                        "INSERT INTO document_number_reservations VALUES (?, ?, ?, ?, ?, ?)",
+                        [(issuer_id, document_type, year, number, format_document_number(year, number), pid)
+                         for number in added])
+                    numbers += added
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logging.error(f"Error reserving document numbers: {e}")
+                raise
+        return numbers
+
+    def release_document_numbers(self, issuer_id, document_type, year, numbers):
+        """予約したが使わなかった書類番号を返却し、次の予約で使えるようにする。"""
+        with self._measure("release_document_numbers"), self.lock:
+            try:
+                conn = self.connect()
+                with conn:
+                    conn.executemany(
+                        "UPDATE document_number_reservations SET owner_pid = NULL "
+                        "WHERE issuer_id = ? AND document_type = ? AND year = ? AND number = ?",
+                        [(issuer_id, document_type, year, number) for number in numbers])
+            except sqlite3.Error as e:
+                logging.error(f"Error releasing document numbers: {e}")
+                raise
+
+    def reclaim_document_numbers(self, is_alive):
+        """終了したプロセス（is_alive(pid) が False）が予約したままの書類番号を返却し、返却した件数を返す。"""
+        with self._measure("reclaim_document_numbers"), self.lock:
+            try:
+                conn = self.connect()
+                owners = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT owner_pid FROM document_number_reservations WHERE owner_pid IS NOT NULL")]
+                dead = [pid for pid in owners if pid != os.getpid() and not is_alive(pid)]
+                with conn:
+                    reclaimed = sum(
+                        conn.execute("UPDATE document_number_reservations SET owner_pid = NULL WHERE owner_pid = ?",
+                                     (pid,)).rowcount
+                        for pid in dead)
+            except sqlite3.Error as e:
+                logging.error(f"Error reclaiming document numbers: {e}")
+                raise
+        if reclaimed:
+            logging.info(f"Reclaimed {reclaimed} document numbers reserved by processes that have exited.")
+        return reclaimed
+
+    def _learn_masters(self, conn, request):
+        """発行した書類の取引先・品目をマスタに登録し、使用回数を数える（最後に使った単価・税率を覚える）。"""
+        used_at = request.issued_at.isoformat(timespec="seconds")
+        if request.company_name:
+            conn.execute('''
+                INSERT INTO customers (name, use_count, last_used_at) VALUES (?, 1, ?)
+                ON CONFLICT (name) DO UPDATE SET use_count = use_count + 1, last_used_at = excluded.last_used_at
+            ''', (request.company_name, used_at))
+        conn.executemany('''
+            INSERT INTO items (summary, unit, unit_price, tax_rate, use_count, last_used_at) VALUES (?, ?, ?, ?, 1, ?)
+            ON CONFLICT (summary) DO UPDATE SET
+                unit = excluded.unit, unit_price = excluded.unit_price, tax_rate = excluded.tax_rate,
+                use_count = use_count + 1, last_used_at = excluded.last_used_at
+        ''', [(item.summary, item.unit, str(item.unit_price), str(item.tax_rate), used_at)
+              for item in request.items if item.summary])
+
+    def import_customers(self, names):
+        """取引先名の一覧を取引先マスタに登録する（登録済みの名前は無視する）。登録した件数を返す。"""
+        rows = [(name.strip(),) for name in names if name and name.strip()]
+        with self._measure("import_customers"), self.lock:
+            try:
+                conn = self.connect()
+                with conn:
+                    cursor = conn.executemany(
+                        "INSERT INTO customers (name) VALUES (?) ON CONFLICT (name) DO NOTHING", rows)
+                    return cursor.rowcount
+            except sqlite3.Error as e:
+                logging.error(f"Error importing customers: {e}")
+                raise
+
+    def import_items(self, items):
+        """品目（摘要・単位・単価・税率の辞書）の一覧を品目マスタに登録する。登録済みの摘要は単位・単価・税率を更新する。"""
+        rows = [tuple(str(item.get(column) or "").strip() for column in ITEM_COLUMNS)
+                for item in items if str(item.get("summary") or "").strip()]
+        with self._measure("import_items"), self.lock:
+            try:
+                conn = self.connect()
+                with conn:
+                    cursor = conn.executemany('''
+                        INSERT INTO items (summary, unit, unit_price, tax_rate) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (summary) DO UPDATE SET
+                            unit = excluded.unit, unit_price = excluded.unit_price, tax_rate = excluded.tax_rate
+                    ''', rows)
+                    return cursor.rowcount
+            except sqlite3.Error as e:
+                logging.error(f"Error importing items: {e}")
+                raise
+
+    def _search_master(self, table, column, text, limit):
+        """マスタを部分一致で検索し、使用回数の多い順に行を返す（ロックを取得した状態で呼ぶ）。
+
+        一致した行のうち先頭の SUGGESTION_CANDIDATES 件だけを候補にして並べ替える。
+        """
+        conn = self.connect()
+        if self.fts_enabled and len(text) >= TRIGRAM_MIN_LENGTH:
+            # 語句全体を1つのフレーズとして検索する（" は2つ重ねてエスケープ）
+            candidates = f"SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ? LIMIT ?"
+            parameters = ('"' + text.replace('"', '""') + '"', SUGGESTION_CANDIDATES)
+        elif len(text) < TRIGRAM_MIN_LENGTH:
+            # trigram で扱えない短い入力は、一意索引の範囲検索による前方一致で探す
+            candidates = f"SELECT id FROM {table} WHERE {column} >= ? AND {column} < ? ORDER BY {column} LIMIT ?"
+            parameters = (text, text + "\U0010ffff", SUGGESTION_CANDIDATES)
+        else:
+            escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            candidates = f"SELECT id FROM {table} WHERE {column} LIKE ? ESCAPE '\\' LIMIT ?"
+            parameters = (f"%{escaped}%", SUGGESTION_CANDIDATES)
+        cursor = conn.execute(f'''
+            SELECT * FROM {table} WHERE id IN ({candidates})
+            ORDER BY use_count DESC, last_used_at DESC, {column} LIMIT ?
+        ''', parameters + (limit,))
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def search_customers(self, text, limit=DEFAULT_SUGGESTION_LIMIT):
+        """入力中の文字列を含む取引先名を、よく使う順に返す。"""
+        text = (text or "").strip()
+        if not text:
+            return []
+        with self._measure("search_customers"), self.lock:
+            try:
+                return [row["name"] for row in self._search_master("customers", "name", text, limit)]
+            except sqlite3.Error as e:
+                logging.error(f"Error searching customers: {e}")
+                raise
+
+    def search_items(self, text, limit=DEFAULT_SUGGESTION_LIMIT):
+        """入力中の文字列を摘要に含む品目を、よく使う順に辞書（摘要・単位・単価・税率）のリストで返す。"""
+        text = (text or "").strip()
+        if not text:
+            return []
+        with self._measure("search_items"), self.lock:
+            try:
+                rows = self._search_master("items", "summary", text, limit)
+                return [{column: row[column] or "" for column in ITEM_COLUMNS} for row in rows]
+            except sqlite3.Error as e:
+                logging.error(f"Error searching items: {e}")
+                raise
+
+    def search_documents(self, document_type=None, customer_name=None, date_from=None, date_to=None,
+                         min_total=None, max_total=None, subject=None, limit=100, issuer_id=None):
+        """発行台帳を条件で検索し、発行日の新しい順に辞書のリストで返す。
+
+        日付は "yyyy-MM-dd" 形式（date_from / date_to は両端を含む）。金額は税込合計で絞り込む。
+        """
+        conditions = []
+        params = []
+        if document_type:
+            conditions.append("document_type = ?")
+            params.append(document_type)
+        if customer_name:
+            conditions.append("customer_name = ?")
+            params.append(customer_name)
+        if date_from:
+            conditions.append("issue_date >= ?")
+            params.append(str(date_from))
+        if date_to:
+            conditions.append("issue_date <= ?")
+            params.append(str(date_to))
+        if min_total is not None:
+            conditions.append("total_including_tax >= ?")
+            params.append(min_total)
+        if max_total is not None:
+            conditions.append("total_including_tax <= ?")
+            params.append(max_total)
+        if subject:
+            conditions.append("subject LIKE ?")
+            params.append(f"%{subject}%")
+        if issuer_id:
+            conditions.append("issuer_id = ?")
+            params.append(issuer_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"SELECT * FROM document_ledger {where} ORDER BY issue_date DESC, id DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._measure("search_documents"), self.lock:
+            try:
+                cursor = self.connect().execute(query, params)
+                columns = [column[0] for column in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            except sqlite3.Error as e:
+                logging.error(f"Error searching documents: {e}")
+                raise
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from metrics import get_registry
+
+
+class DeadLetterQueue:
+    def __init__(self, path, metrics=None):
+        """生成に失敗した依頼を書き留める JSONL ファイル。
+
+        1行が生成依頼1件分の辞書（失敗の内容は "dead_letter" キー）のため、原因を取り除いた後に
+        そのまま cli.py generate に渡して再実行できる。
+        """
+        self.path = os.path.abspath(path)
+        self.metrics = metrics or get_registry()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def put(self, request, error):
+        """失敗した生成依頼を1件追記する。書き込めなかった場合はログに残して処理を続ける。"""
+        self._append(request.to_dict(), error, request.document_type)
+
+    def put_record(self, record, error):
+        """生成依頼に変換できなかった入力（JSONLの1行、またはCSVの辞書）を1件追記する。
+
+        JSONのオブジェクトとして読めない行は "raw" キーに元の文字列を残す。
+        """
+        if isinstance(record, str):
+            try:
+                record = json.loads(record)
+            except ValueError:
+                pass
+        if isinstance(record, dict):
+            record = dict(record)
+            document_type = str(record.get("document_type") or "")
+        else:
+            record = {"raw": record}
+            document_type = ""
+        self._append(record, error, document_type)
+
+    def _append(self, record, error, document_type):
+        """失敗の内容を添えて1行追記する。"""
+        record["dead_letter"] = {
+            "error": str(error),
+            "error_type": type(error).__name__,
+            "failed_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        try:
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            logging.error(f"Could not write failed request to dead-letter queue {self.path}: {e}")
+            return
+        self.metrics.increment("dead_letters_total", {"document_type": document_type})
+        logging.warning(f"Failed request written to dead-letter queue: {self.path}")
+
+
+def create_dead_letter_queue(path=None, metrics=None):
+    """書き留め先のファイルを決めて DeadLetterQueue を作成する。未指定なら環境変数 DOCGEN_DEAD_LETTER。未設定なら None。"""
+    path = path or os.environ.get("DOCGEN_DEAD_LETTER")
+    if not path:
+        return None
+    return DeadLetterQueue(path, metrics)
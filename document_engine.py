@@ -0,0 +1,438 @@
+import dataclasses
+import logging
+import os
+import time
+from concurrent.futures import Future
+
+from converter import create_converter
+from database import DatabaseManager
+from document_numbering import DocumentNumberAllocator
+# 生成依頼の型は GUI の起動時に openpyxl を読み込まずに使えるよう document_request に分けている（ここからも使える）
+from document_request import DEFAULT_ISSUER_ID, DOCUMENT_TYPES, DocumentRequest, LineItem, get_base_dir  # noqa: F401
+from large_document import LargeDocumentWriter
+from metrics import get_registry
+from output_cache import create_output_cache
+from pdf_renderer import NativePdfRenderer, RenderError, get_renderer_name, is_available
+from tax_calculator import calculate_totals
+from template_cache import TemplateCache
+from template_layout import FillPlanCache, document_values
+from workspace import OutputPublisher, ScratchWorkspace
+
+
+class OutputPathConflict(FileExistsError):
+    """保存先に台帳の別の書類のPDFがあり、置き換えられない。"""
+
+
+def _copy_future_result(source, destination):
+    """完了した Future の結果（または例外）を別の Future に設定する。"""
+    error = source.exception()
+    if error is not None:
+        destination.set_exception(error)
+    else:
+        destination.set_result(source.result())
+
+
+class DocumentGenerator:
+    def __init__(self, db_manager=None, base_dir=None, output_dir=None, converter=None, template_cache=None,
+                 record_ledger=True, tax_rounding=None, renderer=None, pdf_font=None, output_cache=None, metrics=None,
+                 fill_pool=None, dead_letter=None, numbering=None, workspace=None, publisher=None):
+        """書類生成エンジンの初期化。GUIに依存せず、生成依頼からPDFを作成する。
+
+        tax_rounding は消費税額の端数処理（"down" / "half_up" / "up"、または税率ごとの辞書）。既定は切り捨て。
+        renderer は PDF の作成方法（"libreoffice" / "native"）。既定は環境変数 DOCGEN_RENDERER。
+        output_cache を渡す（または環境変数 DOCGEN_OUTPUT_CACHE を設定する）と、同じ内容の書類はPDFを再利用する。
+        metrics は段階ごとの所要時間・件数の集計先。既定はプロセス全体で共有する集計先。
+        fill_pool（FillProcessPool）を設定すると、ブックの作成を子プロセスで行う。
+        dead_letter（DeadLetterQueue）を設定すると、生成に失敗した依頼を書き留める。
+        numbering は書類番号の採番（DocumentNumberAllocator）。既定では台帳に記録する場合のみ採番する。
+        workspace（ScratchWorkspace）は作業用の一時ファイルの置き場所、publisher（OutputPublisher）はPDFの保存先への配置。
+        """
+        self.metrics = metrics or get_registry()
+        self.db_manager = db_manager or DatabaseManager(metrics=self.metrics)
+        self.record_ledger = record_ledger
+        self.tax_rounding = tax_rounding
+        self.converter = converter or create_converter(pool_size=0)
+        self.template_cache = template_cache or TemplateCache()
+        self.fill_plans = FillPlanCache()
+        self.base_dir = base_dir or get_base_dir()
+        self.output_dir = output_dir or self.base_dir
+        self.output_cache = output_cache if output_cache is not None else create_output_cache()
+        self.fill_pool = fill_pool
+        self.dead_letter = dead_letter
+        self.workspace = workspace or ScratchWorkspace()
+        self.publisher = publisher or OutputPublisher()
+        if numbering is None and record_ledger:
+            numbering = DocumentNumberAllocator(self.db_manager)
+        self.numbering = numbering
+        self.renderer = get_renderer_name(renderer)
+        self.native_renderer = None
+        if self.renderer == "native":
+            if is_available():
+                self.native_renderer = NativePdfRenderer(pdf_font)
+            else:
+                logging.warning("reportlab is not installed; PDFs are converted with LibreOffice instead.")
+
+    def get_template_path(self, document_type):
+        """書類種別に対応するテンプレートファイルのパスを返す。"""
+        return os.path.join(self.base_dir, "Templates", f"{document_type}_テンプレート.xlsx")
+
+    def get_output_path(self, request, company_info=None):
+        """生成したPDFの保存先パス（<種別>/<取引先>/<yyyy>/<MM>/<書類番号>.pdf）を返す。
+
+        書類番号がなければ（採番しない場合）ファイル名は yyyyMMddhhmm.pdf にする。
+        発行元の自社情報に保存先（output_dir）があれば、そこを基準にする（相対パスは output_dir からの相対）。
+        保存先のない既定以外の発行元は <発行元ID>/ の下に保存する（書類番号は発行元ごとの連番のため、分けないと重なる）。
+        """
+        issued_at = request.issued_at
+        output_dir = self.output_dir
+        if company_info and company_info.get("output_dir"):
+            output_dir = os.path.join(self.output_dir, company_info["output_dir"])
+        elif request.issuer and request.issuer != DEFAULT_ISSUER_ID:
+            output_dir = os.path.join(self.output_dir, request.issuer)
+        company_dir = os.path.join(
+            output_dir, request.document_type, request.company_name,
+            issued_at.strftime("%Y"), issued_at.strftime("%m")
+        )
+        if request.document_number:
+            return os.path.join(company_dir, f"{request.document_number}.pdf")
+        return os.path.join(company_dir, f"{issued_at.strftime('%Y%m%d%H%M')}.pdf")
+
+    def get_layout_path(self, document_type):
+        """書類種別に対応するレイアウト定義（記入するセル・書式）のパスを返す。"""
+        return os.path.join(self.base_dir, "Templates", f"{document_type}_レイアウト.json")
+
+    def get_fill_plan(self, document_type):
+        """書類種別のレイアウト定義を変換した記入プランを返す（1度だけ読み込んで使い回す）。"""
+        return self.fill_plans.get(self.get_layout_path(document_type))
+
+    def fill_sheet(self, sheet, request, company_info):
+        """生成依頼と自社情報をテンプレートのシートに書き込み、合計金額を辞書で返す。"""
+        plan = self.get_fill_plan(request.document_type)
+
+        # 明細金額・税率別集計・合計を1回の走査で計算する（シートからは読み戻さない）
+        totals = calculate_totals(request.items, self.tax_rounding)
+
+        style_ids = plan.resolve_styles(sheet.parent)
+        plan.fill_fields(sheet, document_values(request, company_info, totals), style_ids)
+        plan.fill_line_items(sheet, request.items, totals.line_amounts, style_ids)
+        return totals.as_dict()
+
+    def resolve_company_info(self, company_info=None, issuer_id=None):
+        """渡された自社情報、なければデータベースから発行元（issuer_id）の自社情報を返す。"""
+        if company_info is None:
+            company_info = self.db_manager.get_company_info(issuer_id)
+        if not company_info:
+            raise ValueError(f"Company info is not configured for issuer {issuer_id or DEFAULT_ISSUER_ID!r}.")
+        return company_info
+
+    def assign_number(self, request):
+        """書類番号のない生成依頼に書類番号を採番し、番号を設定した生成依頼を返す。"""
+        if request.document_number or self.numbering is None:
+            return request
+        return dataclasses.replace(request, document_number=self.numbering.allocate(request))
+
+    def fill_workbook(self, request, company_info, output_file):
+        """キャッシュしたテンプレートの複製に生成依頼を書き込んでExcelファイルとして保存し、合計金額を返す。"""
+        document_type = request.document_type
+        with self.metrics.stage("template_copy", document_type):
+            workbook_openpyxl = self.template_cache.get_workbook(self.get_template_path(document_type))
+        plan = self.get_fill_plan(document_type)
+        if len(request.items) > plan.capacity:
+            return self.fill_large_workbook(workbook_openpyxl.active, request, company_info, output_file, plan)
+        with self.metrics.stage("fill", document_type):
+            totals = self.fill_sheet(workbook_openpyxl.active, request, company_info)
+
+        # 保存
+        with self.metrics.stage("save", document_type):
+            workbook_openpyxl.save(output_file)
+        logging.debug(f"Excelファイルが正常に保存されました: {output_file}")
+        return totals
+
+    def fill_large_workbook(self, sheet, request, company_info, output_file, plan):
+        """明細がテンプレートに収まらない書類を、繰越ページ付きで書き込み専用ブックに保存し、合計金額を返す。"""
+        with self.metrics.stage("fill", request.document_type):
+            totals = calculate_totals(request.items, self.tax_rounding)
+            plan.fill_fields(sheet, document_values(request, company_info, totals))
+            # 見出しの合計欄は合計欄を参照する数式のため、書き出し後の位置に合わせず値で埋める
+            if plan.grand_total_cell:
+                sheet[plan.grand_total_cell].value = totals.total_including_tax
+
+        # 明細は保存しながら書き出すため、明細の記入時間は保存の段階に含まれる
+        with self.metrics.stage("save", request.document_type):
+            pages = LargeDocumentWriter(sheet, plan).write(request.items, totals.line_amounts, output_file)
+        logging.info(f"明細 {len(request.items)} 行を {pages} ページに分けて出力しました: {output_file}")
+        return totals.as_dict()
+
+    def can_render_natively(self, request):
+        """LibreOfficeを使わずにPDFを描画できるかを返す（明細がテンプレートの1ページに収まる場合のみ）。"""
+        return (self.native_renderer is not None
+                and len(request.items) <= self.get_fill_plan(request.document_type).capacity)
+
+    def render_native(self, request, company_info, pdf_file, progress=None):
+        """テンプレートの複製に記入し、LibreOfficeを使わずにPDFを描画して合計金額を返す。"""
+        document_type = request.document_type
+        if progress:
+            progress("fill")
+        with self.metrics.stage("template_copy", document_type):
+            workbook_openpyxl = self.template_cache.get_workbook(self.get_template_path(document_type))
+        with self.metrics.stage("fill", document_type):
+            totals = self.fill_sheet(workbook_openpyxl.active, request, company_info)
+        if progress:
+            progress("convert")
+        with self.metrics.stage("render", document_type):
+            self.native_renderer.render(workbook_openpyxl.active, pdf_file, request.issued_at)
+        return totals
+
+    def get_cache_key(self, request, company_info):
+        """出力キャッシュのキーを返す。キャッシュを使わない場合は None。"""
+        if self.output_cache is None:
+            return None
+        options = {
+            "renderer": self.renderer,
+            "tax_rounding": self.tax_rounding,
+            # セルの位置・書式を変えたときに古いPDFを使わないよう、レイアウト定義の内容もキーに含める
+            "layout": self.output_cache.template_digest(self.get_layout_path(request.document_type)),
+        }
+        return self.output_cache.make_key(request, self.get_template_path(request.document_type), company_info, options)
+
+    def reuse_cached(self, request, cache_key, company_info=None):
+        """キャッシュ済みのPDFを保存先に配置して台帳に記録し、保存先のパスと生成依頼を返す。キャッシュになければパスは None。
+
+        キャッシュのPDFには作成時の書類番号が記入されているため、同じ内容の書類は採番せずにその番号で記録する。
+        """
+        if cache_key is None:
+            return None, request
+        with self.metrics.stage("cache_fetch", request.document_type):
+            document_number = self.output_cache.lookup(cache_key, request.document_number)
+            if document_number is None:
+                return None, request
+            cached_request = dataclasses.replace(request, document_number=document_number)
+            final_pdf_path = self.get_output_path(cached_request, company_info)
+            self.check_output_path(cached_request, final_pdf_path)
+            found = self.output_cache.fetch(cache_key, final_pdf_path)
+        if not found:
+            return None, request
+        self.record(cached_request, calculate_totals(request.items, self.tax_rounding).as_dict(), final_pdf_path)
+        return final_pdf_path, cached_request
+
+    def check_output_path(self, request, final_pdf_path):
+        """保存先に台帳の別の書類（発行元・種別・書類番号の違うもの）のPDFがあれば OutputPathConflict を送出する。
+
+        同じ書類の再発行は置き換えてよい。台帳に記録しない場合は確かめない。
+        """
+        if not self.record_ledger or not os.path.exists(final_pdf_path):
+            return
+        owner = (request.issuer or DEFAULT_ISSUER_ID, request.document_type, request.document_number or None)
+        others = [other for other in self.db_manager.get_document_owners(final_pdf_path) if other != owner]
+        if others:
+            issuer_id, document_type, document_number = others[0]
+            raise OutputPathConflict(
+                f"{final_pdf_path} belongs to another document (issuer {issuer_id}, {document_type} "
+                f"{document_number or 'without number'}); refusing to replace it.")
+
+    def publish(self, pdf_file, request, company_info=None):
+        """変換済みのPDFを保存先へ移動し、保存先のパスを返す。"""
+        final_pdf_path = self.get_output_path(request, company_info)
+        with self.metrics.stage("publish", request.document_type):
+            self.check_output_path(request, final_pdf_path)
+            self.publisher.publish(pdf_file, final_pdf_path)
+        logging.info(f"PDFが正常に保存されました: {final_pdf_path}")
+        return final_pdf_path
+
+    def generate(self, request, company_info=None, progress=None):
+        """生成依頼からExcelファイルを作成し、PDFに変換して保存先のパスを返す。
+
+        progress を渡すと、各段階（"fill" / "convert" / "publish"）の開始時に段階名を引数に呼び出す。
+        """
+        started = time.perf_counter()
+        try:
+            company_info = self.resolve_company_info(company_info, request.issuer)
+            # 書類番号はキャッシュのキーに含まれないため、キャッシュにない場合だけ採番する
+            cache_key = self.get_cache_key(request, company_info)
+            cached_pdf_path, request = self.reuse_cached(request, cache_key, company_info)
+            if cached_pdf_path:
+                final_pdf_path = cached_pdf_path
+            else:
+                request = self.assign_number(request)
+                final_pdf_path = self.build(request, company_info, cache_key, progress)
+        except Exception as e:
+            self.fail(request, e, started, company_info)
+            raise
+        except BaseException:
+            # 取り消し（GUIの JobCancelled など）は失敗として数えず、書き留めもしない。番号だけは返却する
+            self.release_number(request, company_info)
+            raise
+        self.count_document(request, "cached" if cached_pdf_path else "generated", started)
+        return final_pdf_path
+
+    def count_document(self, request, result, started):
+        """書類1件の結果（"generated" / "cached" / "failed"）と、生成依頼の受付からの所要時間を記録する。"""
+        labels = {"document_type": request.document_type, "result": result}
+        self.metrics.increment("documents_total", labels)
+        self.metrics.observe("document_duration_seconds", time.perf_counter() - started, labels)
+
+    def fail(self, request, error, started, company_info=None):
+        """書類1件の失敗を記録し、dead_letter が設定されていれば依頼を書き留める。
+
+        採番した書類番号は、PDFを保存先に配置する前に失敗した場合のみ返却し、次の書類に使う。
+        返却した番号は書き留める依頼からも外し、再実行時に改めて採番させる。
+        """
+        self.count_document(request, "failed", started)
+        # 別の書類のPDFと保存先が重なった場合、保存先のPDFはこの書類のものではないため番号を返却する
+        request = self.release_number(request, company_info, published=not isinstance(error, OutputPathConflict))
+        if self.dead_letter is not None:
+            self.dead_letter.put(request, error)
+
+    def release_number(self, request, company_info=None, published=None):
+        """PDFを保存先に配置する前に中断した書類の番号を返却し、書類番号を外した生成依頼を返す。
+
+        published を False にすると、保存先にPDFがあってもこの書類のものではないとして返却する。
+        """
+        if (self.numbering is not None and request.document_number
+                and not (published is not False and os.path.exists(self.get_output_path(request, company_info)))
+                and self.numbering.release(request)):
+            request = dataclasses.replace(request, document_number="")
+        return request
+
+    def reject(self, record, error):
+        """生成依頼に変換できなかった入力を失敗として数え、dead_letter が設定されていれば書き留める。"""
+        document_type = record.get("document_type") if isinstance(record, dict) else None
+        labels = {"document_type": document_type if document_type in DOCUMENT_TYPES else "", "result": "failed"}
+        self.metrics.increment("documents_total", labels)
+        if self.dead_letter is not None:
+            self.dead_letter.put_record(record, error)
+
+    def build(self, request, company_info, cache_key=None, progress=None):
+        """キャッシュを使わずにPDFを作成して保存先へ配置し、キャッシュと台帳に登録する。"""
+        document_type = request.document_type
+        # 作業ディレクトリは使い回し、抜けるときに中のブック・PDFだけを削除する
+        with self.workspace.job() as temp_dir:
+            totals = None
+            if self.can_render_natively(request):
+                pdf_file = os.path.join(temp_dir, f"{document_type}.pdf")
+                try:
+                    totals = self.render_native(request, company_info, pdf_file, progress)
+                except RenderError as e:
+                    self.metrics.increment("render_fallbacks_total", {"document_type": document_type})
+                    logging.warning(f"Native PDF rendering failed, falling back to LibreOffice: {e}")
+
+            if totals is None:
+                temp_file = os.path.join(temp_dir, f"{document_type}.xlsx")
+                if progress:
+                    progress("fill")
+                if self.fill_pool is not None:
+                    totals = self.fill_pool.fill(request, company_info, temp_file)
+                else:
+                    totals = self.fill_workbook(request, company_info, temp_file)
+
+                # PDF変換
+                if progress:
+                    progress("convert")
+                with self.metrics.stage("convert", document_type):
+                    pdf_file = self.converter.convert(temp_file, temp_dir, document_type)
+            if progress:
+                progress("publish")
+            final_pdf_path = self.publish(pdf_file, request, company_info)
+
+        if cache_key is not None:
+            with self.metrics.stage("cache_store", document_type):
+                self.output_cache.store(cache_key, final_pdf_path, request.document_number)
+        self.record(request, totals, final_pdf_path)
+        return final_pdf_path
+
+    def record(self, request, totals, final_pdf_path):
+        """発行した書類を台帳に記録する。"""
+        if self.record_ledger:
+            with self.metrics.stage("ledger", request.document_type):
+                self.db_manager.record_document(request, totals, final_pdf_path)
+        if self.numbering is not None and request.document_number:
+            self.numbering.confirm(request)
+
+    def generate_staged(self, request, stage, company_info=None):
+        """Excelファイルをバッチ変換ステージに投入し、保存先パスを返す Future を返す。"""
+        started = time.perf_counter()
+        try:
+            company_info = self.resolve_company_info(company_info, request.issuer)
+            cache_key = self.get_cache_key(request, company_info)
+            cached_pdf_path, request = self.reuse_cached(request, cache_key, company_info)
+            if not cached_pdf_path:
+                request = self.assign_number(request)
+            if cached_pdf_path or self.can_render_natively(request):
+                # キャッシュ済み・直接描画できる書類はステージを通さずにその場で作成する
+                future = Future()
+                future.set_result(cached_pdf_path or self.build(request, company_info, cache_key))
+                self.count_document(request, "cached" if cached_pdf_path else "generated", started)
+                return future
+            staged_file = stage.new_staging_path()
+            if self.fill_pool is not None:
+                return self._fill_in_pool_and_stage(request, stage, company_info, staged_file, cache_key, started)
+            try:
+                totals = self.fill_workbook(request, company_info, staged_file)
+                return self._submit_to_stage(request, stage, company_info, staged_file, totals, cache_key, started)
+            except Exception:
+                if os.path.exists(staged_file):
+                    os.remove(staged_file)
+                raise
+        except Exception as e:
+            self.fail(request, e, started, company_info)
+            raise
+        except BaseException:
+            self.release_number(request, company_info)
+            raise
+
+    def _fill_in_pool_and_stage(self, request, stage, company_info, staged_file, cache_key, started):
+        """ブックの作成を子プロセスに依頼し、完成したものから順にバッチ変換ステージへ投入する。"""
+        result = Future()
+
+        def on_filled(done):
+            """作成に成功したらステージへ投入し、変換の結果を result に引き継ぐ。"""
+            try:
+                totals = done.result()
+                converted = self._submit_to_stage(request, stage, company_info, staged_file, totals, cache_key, started)
+            except Exception as e:
+                if os.path.exists(staged_file):
+                    os.remove(staged_file)
+                self.fail(request, e, started, company_info)
+                result.set_exception(e)
+                return
+            converted.add_done_callback(lambda finished: _copy_future_result(finished, result))
+
+        self.fill_pool.submit(request, company_info, staged_file).add_done_callback(on_filled)
+        return result
+
+    def _submit_to_stage(self, request, stage, company_info, staged_file, totals, cache_key, started):
+        """作成済みのブックをバッチ変換ステージに投入し、変換後にキャッシュと台帳へ登録する。"""
+        submitted = time.perf_counter()
+        final_pdf_path = self.get_output_path(request, company_info)
+        self.check_output_path(request, final_pdf_path)
+        future = stage.submit(staged_file, final_pdf_path, request.document_type)
+
+        def record_when_converted(done):
+            """変換に成功したらキャッシュと台帳に登録する。"""
+            # まとめ変換では変換待ちの時間も変換の段階に含める
+            self.metrics.observe("stage_duration_seconds", time.perf_counter() - submitted,
+                                 {"stage": "convert", "document_type": request.document_type})
+            if done.exception() is not None:
+                self.metrics.increment("failures_total", {"stage": "convert"})
+                self.fail(request, done.exception(), started, company_info)
+                return
+            try:
+                if cache_key is not None:
+                    self.output_cache.store(cache_key, done.result(), request.document_number)
+                self.record(request, totals, done.result())
+            except Exception as e:
+                self.fail(request, e, started, company_info)
+                raise
+            self.count_document(request, "generated", started)
+
+        future.add_done_callback(record_when_converted)
+        return future
+
+    def close(self):
+        """コンバーター・ブック作成用の子プロセス・作業領域を解放し、使わなかった書類番号を返却する。"""
+        if self.numbering is not None:
+            self.numbering.close()
+        if self.fill_pool is not None:
+            self.fill_pool.close()
+        self.converter.close()
+        self.workspace.close()
@@ -0,0 +1,87 @@
+import heapq
+import logging
+import os
+import threading
+
+from document_request import DEFAULT_ISSUER_ID, format_document_number
+from workspace import process_exists
+
+# データベースから1度に予約する書類番号の件数の既定値
+DEFAULT_BLOCK_SIZE = 20
+
+
+def get_block_size(block_size=None):
+    """1度に予約する書類番号の件数を決める。未指定なら環境変数 DOCGEN_NUMBER_BLOCK_SIZE（既定20）を使う。"""
+    if block_size is None:
+        block_size = int(os.environ.get("DOCGEN_NUMBER_BLOCK_SIZE", DEFAULT_BLOCK_SIZE))
+    return max(1, block_size)
+
+
+class DocumentNumberAllocator:
+    def __init__(self, db_manager, block_size=None):
+        """書類番号（発行元・種別・年ごとの連番）を払い出す。
+
+        番号はデータベースから block_size 件ずつまとめて予約し、書類ごとに書き込みのトランザクションを使わない。
+        生成に失敗した書類の番号と、終了時に使わなかった番号はデータベースに返却して次の予約で使うため、欠番にならない。
+        """
+        self.db_manager = db_manager
+        self.block_size = get_block_size(block_size)
+        self._reserved = {}  # (発行元, 種別, 年) → 予約済みで未使用の番号（ヒープ）
+        self._outstanding = {}  # (発行元, 種別, 書類番号) → (年, 番号)。払い出して台帳に記録されていないもの
+        self._lock = threading.Lock()
+        self._reclaimed = False
+
+    def allocate(self, request):
+        """生成依頼の発行元・種別・発行年の次の書類番号を払い出し、書類番号の文字列を返す。"""
+        issuer_id = request.issuer or DEFAULT_ISSUER_ID
+        year = request.issued_at.year
+        key = (issuer_id, request.document_type, year)
+        with self._lock:
+            if not self._reclaimed:
+                # 前回異常終了したプロセスが予約したままの番号を、最初の払い出しの前に返却させる
+                self.db_manager.reclaim_document_numbers(process_exists)
+                self._reclaimed = True
+            numbers = self._reserved.get(key)
+            if not numbers:
+                numbers = self._reserved[key] = self.db_manager.reserve_document_numbers(*key, self.block_size)
+                heapq.heapify(numbers)
+            number = heapq.heappop(numbers)
+            document_number = format_document_number(year, number)
+            self._outstanding[(issuer_id, request.document_type, document_number)] = (year, number)
+        return document_number
+
+    def _pop_outstanding(self, request):
+        """払い出し中の番号なら (発行元, 年, 番号) を返して払い出し中から外す。払い出した番号でなければ None。"""
+        issuer_id = request.issuer or DEFAULT_ISSUER_ID
+        entry = self._outstanding.pop((issuer_id, request.document_type, request.document_number), None)
+        if entry is None:
+            return None
+        return (issuer_id,) + entry
+
+    def confirm(self, request):
+        """書類が台帳に記録され、番号が使われたことを記録する。"""
+        with self._lock:
+            self._pop_outstanding(request)
+
+    def release(self, request):
+        """生成に失敗した書類の番号を予約に戻し、次の書類に使う。払い出した番号なら True を返す。"""
+        with self._lock:
+            entry = self._pop_outstanding(request)
+            if entry is None:
+                return False
+            issuer_id, year, number = entry
+            heapq.heappush(self._reserved.setdefault((issuer_id, request.document_type, year), []), number)
+        return True
+
+    def close(self):
+        """予約したまま使わなかった番号をデータベースに返却する。"""
+        with self._lock:
+            reserved, self._reserved = self._reserved, {}
+            for (issuer_id, document_type, year), numbers in reserved.items():
+                if not numbers:
+                    continue
+                try:
+                    self.db_manager.release_document_numbers(issuer_id, document_type, year, numbers)
+                except Exception as e:
+                    # 返却できなかった番号は、次回の起動時に reclaim_document_numbers で返却される
+                    logging.error(f"Could not release {len(numbers)} unused document numbers: {e}")
@@ -0,0 +1,156 @@
+import os
+import sys
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+DOCUMENT_TYPES = ("見積書", "請求書", "領収書")
+
+# 発行元を指定しない生成依頼で使う発行元プロファイルのID
+DEFAULT_ISSUER_ID = "default"
+
+
+# Windows で予約されているファイル名（拡張子を付けても使えない）
+RESERVED_FILE_NAMES = frozenset(
+    ["CON", "PRN", "AUX", "NUL"] + [f"COM{n}" for n in range(1, 10)] + [f"LPT{n}" for n in range(1, 10)]
+)
+
+# ファイル名に使えない文字（パスの区切り・ドライブ指定・Windows で使えない記号）
+INVALID_PATH_CHARACTERS = frozenset('/\\:*?"<>|')
+
+
+def check_path_component(field_name, value):
+    """保存先のパスの1階層になる値（取引先名・書類番号・発行元ID）を確かめ、使えなければ ValueError を送出する。
+
+    空の値・区切り文字・".."・制御文字（NUL など）・Windows の予約名を含むと、保存先の外に書き込んだり
+    階層が抜け落ちたりするため受け付けない。
+    """
+    if not value or not value.strip():
+        raise ValueError(f"{field_name} must not be empty.")
+    if value.strip() in (".", ".."):
+        raise ValueError(f"{field_name} must not be '.' or '..': {value!r}")
+    if any(character in INVALID_PATH_CHARACTERS or ord(character) < 32 for character in value):
+        raise ValueError(f"{field_name} must not contain path separators or control characters: {value!r}")
+    if value.split(".")[0].strip().upper() in RESERVED_FILE_NAMES:
+        raise ValueError(f"{field_name} must not be a reserved file name: {value!r}")
+
+
+def format_document_number(year, number):
+    """書類番号（種別・発行元・年ごとの連番）を表示・ファイル名用の文字列（"2025-000123"）に変換する。"""
+    return f"{year}-{number:06d}"
+
+
+def get_base_dir():
+    """実行形態（.exe / .py）に応じたアプリケーションの基準ディレクトリを返す。"""
+    if getattr(sys, "frozen", False):
+        # .exe
+        return os.path.dirname(sys.executable)
+    # .py
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def _parse_date(value):
+    """日付を表す値（date / datetime / "yyyy-MM-dd" / "yyyy/MM/dd"）を date に変換する。"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value).replace("/", "-"), "%Y-%m-%d").date()
+
+
+@dataclass(frozen=True)
+class LineItem:
+    """明細1行分の入力値。GUIのテーブルと同じ列構成を持つ。
+
+    数値の列は文字列のほか Decimal も受け付ける（GUIの明細表からは Decimal で渡される）。
+    """
+    summary: str = ""
+    quantity: str = "0"
+    unit: str = ""
+    unit_price: str = "0"
+    discount: str = "0"
+    tax_rate: str = ""  # パーセント表記（例: "10"）
+
+    @classmethod
+    def from_dict(cls, data):
+        """辞書から明細行を作成する。未指定の列は既定値で補う。"""
+        return cls(
+            summary=str(data.get("summary") or ""),
+            quantity=str(data.get("quantity") or "0"),
+            unit=str(data.get("unit") or ""),
+            unit_price=str(data.get("unit_price") or "0"),
+            discount=str(data.get("discount") or "0"),
+            tax_rate=str(data.get("tax_rate") if data.get("tax_rate") is not None else ""),
+        )
+
+
+@dataclass(frozen=True)
+class DocumentRequest:
+    """書類1件の生成依頼。GUIの入力画面1枚分の内容を保持する。"""
+    document_type: str
+    company_name: str
+    subject: str = ""
+    expiry_date: date = None  # 領収書では法定保存期限
+    delivery_date: str = ""
+    delivery_place: str = ""
+    transaction_method: str = ""
+    remarks: str = ""
+    items: tuple = ()
+    issued_at: datetime = field(default_factory=datetime.now)
+    issuer: str = ""  # 発行元プロファイルのID（空なら既定の発行元）
+    document_number: str = ""  # 見積番号・請求番号など（空なら生成時に採番する）
+
+    def __post_init__(self):
+        if self.document_type not in DOCUMENT_TYPES:
+            raise ValueError(f"Unknown document type: {self.document_type}")
+        # 取引先名・書類番号・発行元IDは保存先のパスの一部になる
+        check_path_component("company_name", self.company_name)
+        if self.document_number:
+            check_path_component("document_number", self.document_number)
+        if self.issuer:
+            check_path_component("issuer", self.issuer)
+
+    @classmethod
+    def from_dict(cls, data):
+        """JSON等から読み込んだ辞書を生成依頼に変換する。"""
+        issued_at = data.get("issued_at")
+        if issued_at:
+            issued_at = datetime.fromisoformat(str(issued_at))
+        else:
+            issued_at = datetime.now()
+        return cls(
+            document_type=data.get("document_type", "見積書"),
+            company_name=str(data.get("company_name") or ""),
+            subject=str(data.get("subject") or ""),
+            expiry_date=_parse_date(data.get("expiry_date")) or issued_at.date(),
+            delivery_date=str(data.get("delivery_date") or ""),
+            delivery_place=str(data.get("delivery_place") or ""),
+            transaction_method=str(data.get("transaction_method") or ""),
+            remarks=str(data.get("remarks") or ""),
+            items=tuple(LineItem.from_dict(item) for item in data.get("items") or ()),
+            issued_at=issued_at,
+            issuer=str(data.get("issuer") or ""),
+            document_number=str(data.get("document_number") or ""),
+        )
+
+    def to_dict(self):
+        """from_dict で元に戻せる、JSONにできる辞書に変換する。"""
+        return {
+            "document_type": self.document_type,
+            "company_name": self.company_name,
+            "subject": self.subject,
+            "expiry_date": self.expiry_date.isoformat() if self.expiry_date else None,
+            "delivery_date": self.delivery_date,
+            "delivery_place": self.delivery_place,
+            "transaction_method": self.transaction_method,
+            "remarks": self.remarks,
+            "items": [
+                {"summary": item.summary, "quantity": str(item.quantity), "unit": item.unit,
+                 "unit_price": str(item.unit_price), "discount": str(item.discount), "tax_rate": str(item.tax_rate)}
+                for item in self.items
+            ],
+            "issued_at": self.issued_at.isoformat(),
+            "issuer": self.issuer,
+            "document_number": self.document_number,
+        }
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from document_engine import DocumentGenerator
+from metrics import MetricsRegistry
+
+# 子プロセスごとに1つだけ作る書類生成エンジン（テンプレートのキャッシュを子プロセス内で使い回す）
+_worker_generator = None
+
+
+def get_fill_processes(processes=None):
+    """ブックを作成するプロセス数を決める。未指定なら環境変数 DOCGEN_FILL_PROCESSES（既定0 = 使わない）。
+
+    "auto" を指定するとCPUのコア数に合わせる。
+    """
+    if processes is None:
+        processes = os.environ.get("DOCGEN_FILL_PROCESSES", "0")
+    if str(processes).lower() == "auto":
+        return os.cpu_count() or 1
+    return max(0, int(processes))
+
+
+def _init_worker(base_dir, tax_rounding, log_level):
+    """子プロセスの初期化。ブックの作成だけを行う書類生成エンジンを用意する。"""
+    global _worker_generator
+    # spawn で起動した子プロセスには親のログ設定が引き継がれない
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    _worker_generator = DocumentGenerator(base_dir=base_dir, record_ledger=False, tax_rounding=tax_rounding,
+                                          renderer="libreoffice")
+
+
+def _fill_document(request, company_info, output_file):
+    """子プロセスでブックを作成して保存し、合計金額と段階ごとの所要時間の集計を返す。"""
+    metrics = MetricsRegistry()
+    _worker_generator.metrics = metrics
+    totals = _worker_generator.fill_workbook(request, company_info, output_file)
+    return totals, metrics.dump()
+
+
+class FillProcessPool:
+    def __init__(self, generator, processes=None, max_retries=2):
+        """テンプレートへの記入とブックの保存を複数のプロセスで並列に行うプール。
+
+        openpyxl の処理はPythonのコードで実行されるため、スレッドでは1コアしか使えない。
+        月末の一括生成などで、ブックの作成をCPUのコア数だけ並列にする。
+        """
+        self.generator = generator
+        self.processes = processes or os.cpu_count() or 1
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        """子プロセスのプールを作成する。"""
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=_init_worker,
+            initargs=(self.generator.base_dir, self.generator.tax_rounding, logging.getLogger().getEffectiveLevel()),
+        )
+
+    def _restart(self, broken):
+        """子プロセスが異常終了して使えなくなったプールを作り直す（同時に呼ばれても1度だけ）。"""
+        with self._lock:
+            if self._executor is broken:
+                logging.warning("A fill process terminated abruptly; restarting the process pool.")
+                broken.shutdown(wait=False)
+                self._executor = self._create_executor()
+            return self._executor
+
+    def submit(self, request, company_info, output_file):
+        """ブックの作成を子プロセスに依頼し、合計金額を結果とする Future を返す。
+
+        子プロセスが異常終了するとその時点で待機・実行中だった書類もすべて失敗するため、プールを作り直して
+        max_retries 回まで依頼し直す。異常終了の原因になった書類だけが最終的に失敗として扱われる。
+        """
+        result = Future()
+        self._submit(result, (request, company_info, output_file), self.max_retries)
+        return result
+
+    def _submit(self, result, arguments, retries):
+        """子プロセスに依頼し、結果を result に設定する。"""
+        executor = self._executor
+        try:
+            future = executor.submit(_fill_document, *arguments)
+        except BrokenProcessPool:
+            executor = self._restart(executor)
+            future = executor.submit(_fill_document, *arguments)
+
+        def on_done(done):
+            """子プロセスの集計を取り込み、結果を渡す。"""
+            error = done.exception()
+            if error is None:
+                totals, dumped = done.result()
+                self.generator.metrics.merge(dumped)
+                result.set_result(totals)
+                return
+            if isinstance(error, BrokenProcessPool):
+                self._restart(executor)
+                if retries > 0:
+                    self._submit(result, arguments, retries - 1)
+                    return
+            result.set_exception(error)
+
+        future.add_done_callback(on_done)
+
+    def fill(self, request, company_info, output_file):
+        """ブックの作成を子プロセスで行い、完了を待って合計金額を返す。"""
+        return self.submit(request, company_info, output_file).result()
+
+    def close(self):
+        """子プロセスを終了する。"""
+        with self._lock:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
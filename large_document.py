@@ -0,0 +1,205 @@
+import logging
+from copy import copy
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter, range_boundaries
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.pagebreak import Break
+
+# 繰越行の見出し
+CARRY_OUT_LABEL = "次頁へ繰越"
+CARRY_IN_LABEL = "前頁より繰越"
+
+
+def get_print_bounds(sheet):
+    """テンプレートの印刷範囲の (最初の列, 最初の行, 最後の列, 最終行) を返す。印刷範囲がなければ使用中の範囲を返す。"""
+    if sheet.print_area:
+        # "'見積書'!$A$1:$I$37" の形式
+        return range_boundaries(sheet.print_area.split("!")[-1])
+    return 1, 1, sheet.max_column, sheet.max_row
+
+
+class LargeDocumentWriter:
+    """明細がテンプレートに収まらない書類を、書き込み専用ブックへ逐次書き出す。
+
+    1ページ目はテンプレートの見出し部分、2ページ目以降は明細の表題行と前頁からの繰越を繰り返し、
+    合計欄・備考欄は最終ページにだけ出力する。行はその場でファイルへ書き出されるため、
+    明細の件数によらずメモリ使用量はほぼ一定になる。
+    """
+
+    def __init__(self, template_sheet, plan):
+        self.template = template_sheet
+        self.plan = plan
+        self.doc_row = plan.first_line_row
+        self.header_row = self.doc_row - 1
+        self.footer_first_row = plan.last_line_row + 1
+        print_first_column, _, print_last_column, self.footer_last_row = get_print_bounds(template_sheet)
+        # 出力の印刷範囲の列はテンプレートの印刷範囲に合わせる
+        self.print_columns = f"{get_column_letter(print_first_column)}1:{get_column_letter(print_last_column)}"
+        # 1ページあたりの行数はテンプレートの印刷範囲に合わせる
+        self.rows_per_page = self.footer_last_row
+        self.columns = range(1, template_sheet.max_column + 1)
+        # 複製したテンプレートの row_dimensions は未設定の行を引くと KeyError になるため、先に取り出しておく
+        self.row_heights = {index: dimension.height for index, dimension in template_sheet.row_dimensions.items()
+                            if dimension.height}
+        # 明細行はレイアウト定義の最も右の列まで書き出す（値のない列もテンプレートの書式で埋める）
+        self.line_columns = range(1, max(column for column, _, _ in plan.line_columns) + 1)
+        self.line_getters = {column: getter for column, getter, _ in plan.line_columns}
+        self.line_overrides = {column: self._overrides(plan.line_style(column)) for column in self.line_columns}
+        self.amount_column = plan.line_column_fields.get("amount", self.line_columns[-1])
+
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(template_sheet.title)
+        self._styles = {}
+        self.row = 0  # 書き込み済みの最終行
+        self.page_row = 0  # 現在のページで書き込み済みの行数
+        self.pages = 1
+
+    @staticmethod
+    def _overrides(style):
+        """レイアウト定義の書式を、テンプレートの書式に上書きする属性の辞書に変換する。"""
+        if style is None:
+            return None
+        overrides = {}
+        if style.alignment is not None:
+            overrides["alignment"] = style.alignment
+        if style.number_format is not None:
+            overrides["number_format"] = style.number_format
+        return overrides or None
+
+    def _style_of(self, source, overrides=None):
+        """テンプレートのセルと同じ書式の WriteOnlyCell の書式を返す（書式は1度だけ登録する）。"""
+        key = (source.row, source.column, overrides is not None)
+        style = self._styles.get(key)
+        if style is None:
+            prototype = WriteOnlyCell(self.sheet)
+            if source.has_style:
+                prototype.font = copy(source.font)
+                prototype.border = copy(source.border)
+                prototype.fill = copy(source.fill)
+                prototype.number_format = source.number_format
+                prototype.protection = copy(source.protection)
+                prototype.alignment = copy(source.alignment)
+            if overrides:
+                for name, value in overrides.items():
+                    setattr(prototype, name, value)
+            style = self._styles[key] = prototype._style
+        return style
+
+    def _cell(self, value, source, overrides=None):
+        """テンプレートのセルの書式で値を持つセルを作成する。"""
+        cell = WriteOnlyCell(self.sheet, value)
+        cell._style = copy(self._style_of(source, overrides))
+        return cell
+
+    def _append(self, source_row, cells):
+        """テンプレートの source_row 行の高さで1行を書き出す。"""
+        self.row += 1
+        self.page_row += 1
+        height = self.row_heights.get(source_row)
+        if height:
+            self.sheet.row_dimensions[self.row].height = height
+        self.sheet.append(cells)
+
+    def _copy_row(self, source_row, merge_offset=None):
+        """テンプレートの1行を値・書式ごと書き出す。"""
+        cells = [self._cell(self.template.cell(source_row, column).value, self.template.cell(source_row, column))
+                 for column in self.columns]
+        self._append(source_row, cells)
+        if merge_offset is not None:
+            self._copy_merges(source_row, source_row, merge_offset)
+
+    def _copy_merges(self, first_row, last_row, offset):
+        """テンプレートの first_row〜last_row 行内のセル結合を offset 行ずらして登録する。"""
+        for merged in self.template.merged_cells.ranges:
+            if first_row <= merged.min_row and merged.max_row <= last_row:
+                self._merge(merged.min_col, merged.min_row + offset, merged.max_col, merged.max_row + offset)
+
+    def _merge(self, min_col, min_row, max_col, max_row):
+        """セル結合を登録する。
+
+        MultiCellRange.add は既存の結合範囲を毎回走査するため、行数が多いと時間がかかる。
+        ここで登録する範囲は重ならないので、集合へ直接追加する。
+        """
+        self.sheet.merged_cells.ranges.add(
+            CellRange(min_col=min_col, min_row=min_row, max_col=max_col, max_row=max_row))
+
+    def _carry_row(self, label, subtotal):
+        """繰越行（見出しと、そこまでの明細金額の小計）を書き出す。"""
+        template_row = self.template[self.doc_row]
+        cells = [self._cell(None, template_row[column - 1]) for column in self.line_columns]
+        cells[0].value = label
+        column = self.amount_column
+        cells[column - 1] = self._cell(subtotal, template_row[column - 1], self.line_overrides.get(column))
+        self._append(self.doc_row, cells)
+
+    def _break_page(self, subtotal):
+        """繰越行を出して改ページし、次のページに表題行と繰越行を書き出す。"""
+        self._carry_row(CARRY_OUT_LABEL, subtotal)
+        self.sheet.row_breaks.append(Break(id=self.row))
+        self.pages += 1
+        self.page_row = 0
+        self._copy_row(self.header_row, self.row + 1 - self.header_row)
+        self._carry_row(CARRY_IN_LABEL, subtotal)
+
+    def _line_row(self, item, amount):
+        """明細1行を書き出す。
+
+        テンプレートの摘要欄（A〜C列）はセル結合だが、B・C列は罫線が外枠だけで左寄せの文字は
+        そのまま右へはみ出して表示されるため、明細行ごとの結合は行わない（結合範囲はブックを
+        保存するまでメモリに残るため）。
+        """
+        template_row = self.template[self.doc_row]
+        cells = []
+        for column in self.line_columns:
+            getter = self.line_getters.get(column)
+            value = getter(item, amount) if getter else None
+            cells.append(self._cell(value, template_row[column - 1], self.line_overrides[column]))
+        self._append(self.doc_row, cells)
+
+    def _setup_sheet(self):
+        """列幅・印刷設定をテンプレートから引き継ぐ（行を書き出す前に設定する）。"""
+        for key, dimension in self.template.column_dimensions.items():
+            target = self.sheet.column_dimensions[key]
+            target.width = dimension.width
+            target.hidden = dimension.hidden
+        self.sheet.page_margins = copy(self.template.page_margins)
+        self.sheet.print_options = copy(self.template.print_options)
+        self.sheet.page_setup.orientation = self.template.page_setup.orientation
+        self.sheet.page_setup.paperSize = self.template.page_setup.paperSize
+        # 横幅だけをページに合わせ、縦方向は改ページ位置で区切る
+        self.sheet.sheet_properties.pageSetUpPr.fitToPage = True
+        self.sheet.page_setup.fitToWidth = 1
+        self.sheet.page_setup.fitToHeight = 0
+
+    def write(self, items, line_amounts, output_file):
+        """明細を逐次書き出して保存し、ページ数を返す。"""
+        self._setup_sheet()
+
+        # 1ページ目の見出し部分（明細の表題行まで）
+        for source_row in range(1, self.doc_row):
+            self._copy_row(source_row)
+        self._copy_merges(1, self.header_row, 0)
+
+        # 明細（ページの最終行は繰越行のために空けておく）
+        subtotal = 0
+        for item, amount in zip(items, line_amounts):
+            if self.page_row >= self.rows_per_page - 1:
+                self._break_page(subtotal)
+            self._line_row(item, amount)
+            subtotal += amount
+
+        # 合計欄・備考欄が収まらなければ改ページしてから書き出す
+        footer_rows = self.footer_last_row - self.footer_first_row + 1
+        if self.page_row + footer_rows > self.rows_per_page:
+            self._break_page(subtotal)
+        offset = self.row + 1 - self.footer_first_row
+        for source_row in range(self.footer_first_row, self.footer_last_row + 1):
+            self._copy_row(source_row)
+        self._copy_merges(self.footer_first_row, self.footer_last_row, offset)
+
+        self.sheet.print_area = f"{self.print_columns}{self.row}"
+        self.workbook.save(output_file)
+        logging.debug(f"大量明細の書類を {self.pages} ページで書き出しました: {output_file}")
+        return self.pages
@@ -0,0 +1,178 @@
+import csv
+import io
+import math
+from array import array
+from decimal import Decimal
+
+from document_request import LineItem
+from tax_calculator import RunningTotals
+
+# 明細表の列（GUIのテーブルと同じ並び）
+COLUMNS = ("summary", "quantity", "unit", "unit_price", "discount", "tax_rate")
+
+# 数値として保持する列（空欄は NaN で表し、生成時は0として扱う）
+NUMERIC_COLUMNS = frozenset(("quantity", "unit_price", "discount", "tax_rate"))
+
+# CSV・クリップボードの見出し行として認識する列名（英語の列名とGUIの見出しの両方）
+HEADER_ALIASES = {
+    "summary": "summary", "摘要": "summary",
+    "quantity": "quantity", "数量": "quantity",
+    "unit": "unit", "単位": "unit",
+    "unit_price": "unit_price", "単価": "unit_price",
+    "discount": "discount", "値引": "discount",
+    "tax_rate": "tax_rate", "税率": "tax_rate", "税率 (%)": "tax_rate",
+}
+
+_EMPTY = float("nan")
+
+
+def parse_number(text):
+    """入力された数値（"1,200" / "10%" / 空欄）を float に変換する。空欄は NaN を返す。"""
+    if isinstance(text, (int, float)):
+        return float(text)
+    text = str(text or "").strip().replace(",", "").rstrip("%").strip()
+    if not text:
+        return _EMPTY
+    value = float(text)
+    if math.isinf(value) or math.isnan(value):
+        raise ValueError(f"Invalid number: {text!r}")
+    return value
+
+
+def format_number(value):
+    """保持している数値を表示用の文字列に変換する（整数は小数点なし、空欄は空文字）。"""
+    if math.isnan(value):
+        return ""
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def as_decimal(value):
+    """保持している数値を Decimal に変換する（空欄は0）。
+
+    入力された小数は repr で入力時と同じ桁に戻るため、2進小数の誤差は持ち込まない。
+    """
+    if math.isnan(value):
+        return Decimal(0)
+    if value.is_integer():
+        return Decimal(int(value))
+    return Decimal(repr(value))
+
+
+def parse_delimited(text):
+    """CSV・タブ区切り（表計算ソフトからのコピー）の文字列を行のリストに変換する。"""
+    text = text.rstrip("\r\n")
+    if not text:
+        return []
+    delimiter = "\t" if "\t" in text.split("\n", 1)[0] else ","
+    return [row for row in csv.reader(io.StringIO(text), delimiter=delimiter)]
+
+
+def split_header(rows):
+    """先頭行が見出し行なら取り除き、(列名のリスト, 残りの行) を返す。見出しがなければ列名は None。"""
+    if rows and any(cell.strip() in HEADER_ALIASES for cell in rows[0]):
+        return [HEADER_ALIASES.get(cell.strip()) for cell in rows[0]], rows[1:]
+    return None, rows
+
+
+class LineItemStore:
+    def __init__(self, tax_rounding=None):
+        """明細を列ごとの配列で保持するストア。
+
+        数値の列は array('d') に保持し、セルごとにオブジェクトを作らずに数千行の明細を扱えるようにする。
+        合計金額は running_totals で編集のたびに差分で更新する。
+        """
+        self.columns = {}
+        self.running_totals = RunningTotals(tax_rounding)
+        self.clear()
+
+    def __len__(self):
+        return len(self.columns["summary"])
+
+    def clear(self):
+        """すべての行を削除する。"""
+        self.columns = {name: array("d") if name in NUMERIC_COLUMNS else [] for name in COLUMNS}
+        self.running_totals.clear()
+
+    def insert_rows(self, position, count):
+        """position の位置に空の行を count 行挿入する。"""
+        for name, values in self.columns.items():
+            values[position:position] = (array("d", [_EMPTY]) * count if name in NUMERIC_COLUMNS
+                                         else [""] * count)
+        self.running_totals.insert_rows(position, count)
+
+    def remove_rows(self, position, count):
+        """position から count 行を削除する。"""
+        for values in self.columns.values():
+            del values[position:position + count]
+        self.running_totals.remove_rows(position, count)
+
+    def value(self, row, column):
+        """セルの値を返す（数値の列は float、空欄は NaN）。"""
+        return self.columns[COLUMNS[column]][row]
+
+    def text(self, row, column):
+        """セルの値を表示用の文字列で返す。"""
+        value = self.value(row, column)
+        return format_number(value) if COLUMNS[column] in NUMERIC_COLUMNS else value
+
+    def set_text(self, row, column, text):
+        """入力された文字列をセルに設定する。数値の列に数値以外を入力した場合は ValueError を送出する。"""
+        name = COLUMNS[column]
+        if name not in NUMERIC_COLUMNS:
+            self.columns[name][row] = str(text or "")
+            return
+        value = parse_number(text)
+        columns = self.columns
+        quantity, unit_price, discount, tax_rate = (
+            value if other == name else columns[other][row]
+            for other in ("quantity", "unit_price", "discount", "tax_rate"))
+        # 集計を先に更新する（失敗した場合はセルも変更しない）
+        self.running_totals.set_line(row, as_decimal(quantity), as_decimal(unit_price), as_decimal(discount),
+                                     as_decimal(tax_rate))
+        columns[name][row] = value
+
+    def paste(self, row, column, rows):
+        """row, column を左上として行のリストを貼り付け、足りない行は追加する。
+
+        数値として読めないセルは貼り付けずに (行, 列) のリストで返す。
+        """
+        shortage = row + len(rows) - len(self)
+        if shortage > 0:
+            self.insert_rows(len(self), shortage)
+        invalid = []
+        for row_offset, cells in enumerate(rows):
+            for column_offset, cell in enumerate(cells[:len(COLUMNS) - column]):
+                try:
+                    self.set_text(row + row_offset, column + column_offset, cell)
+                except ValueError:
+                    invalid.append((row + row_offset, column + column_offset))
+        return invalid
+
+    def append_records(self, records):
+        """列名をキーにした辞書（CSVの1行など）を行として末尾に追加する。不正なセルを (行, 列) のリストで返す。"""
+        rows = [[record.get(name) or "" for name in COLUMNS] for record in records]
+        return self.paste(len(self), 0, rows)
+
+    def import_text(self, text, row=None, column=0):
+        """CSV・タブ区切りの文字列を取り込む。見出し行があれば列名で対応付けて末尾に追加し、
+        なければ row, column（省略時は末尾の行の先頭列）から貼り付ける。不正なセルを (行, 列) のリストで返す。
+        """
+        header, rows = split_header(parse_delimited(text))
+        if header is not None:
+            return self.append_records({name: cell for name, cell in zip(header, cells) if name} for cells in rows)
+        return self.paste(len(self) if row is None else row, column, rows)
+
+    def totals(self):
+        """現在の明細の税率別集計と合計を返す（行数によらず一定の時間で返る）。"""
+        return self.running_totals.totals()
+
+    def items(self):
+        """生成依頼に渡す明細行を返す。数値の列は Decimal のまま渡し、文字列への変換を挟まない。"""
+        columns = self.columns
+        return tuple(
+            LineItem(summary=summary, quantity=as_decimal(quantity), unit=unit, unit_price=as_decimal(unit_price),
+                     discount=as_decimal(discount), tax_rate=as_decimal(tax_rate))
+            for summary, quantity, unit, unit_price, discount, tax_rate in zip(*(columns[name] for name in COLUMNS))
+        )
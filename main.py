@@ -1,154 +1,365 @@
 import sys
+import itertools
 import logging
-from PyQt5.QtWidgets import QApplication, QMainWindow, QStackedWidget, QWidget, QVBoxLayout, QPushButton, QLineEdit, QFormLayout, QTableWidget, QTextEdit, QDateEdit, QDialog
-from PyQt5.QtCore import QDate, QTime
-import sqlite3
 import os
-import tempfile
-import shutil
-import subprocess
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment
-import openpyxl
-import openpyxl.styles.alignment
-import openpyxl.styles
-
-# ログ設定
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-class DatabaseManager:
-    def __init__(self, db_name="documents.db"):
-        # データベースマネージャの初期化。データベースファイルのパスを設定。
-        self.db_path = os.path.abspath(db_name)
-        self.conn = None
-        self.cursor = None
-
-    def connect(self):
-        """データベースへ接続し、必要ならテーブルを作成する。"""
+import time
+
+# 起動時間の計測の基準（PyQt5 などを読み込む前の時点）
+STARTUP_STARTED = time.perf_counter()
+
+from PyQt5.QtWidgets import QApplication, QMainWindow, QStackedWidget, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QFormLayout, QTableWidget, QTableWidgetItem, QTableView, QTextEdit, QDateEdit, QDialog, QDockWidget, QProgressBar, QComboBox, QAbstractItemView, QCompleter, QStyledItemDelegate, QFileDialog, QMessageBox, QLabel
+from PyQt5.QtCore import QAbstractTableModel, QDate, QModelIndex, Qt, QObject, QPersistentModelIndex, QRunnable, QStringListModel, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtGui import QKeySequence
+from converter import create_converter, get_pool_size
+from database import DatabaseManager
+# openpyxl などを読み込む document_engine は、起動を速くするため最初に書類を生成するときに読み込む
+from document_request import DEFAULT_ISSUER_ID, DocumentRequest, get_base_dir
+from line_item_store import COLUMNS, NUMERIC_COLUMNS, LineItemStore
+from metrics import get_log_level, get_registry
+from workspace import remove_stale_temp_dirs
+
+# ログ設定（DEBUG は生成処理のたびに大量に出力されるため、必要なときだけ環境変数 DOCGEN_LOG_LEVEL で指定する）
+logging.basicConfig(level=get_log_level(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 最初のウィンドウを表示するまでの目標時間（ミリ秒）。環境変数 DOCGEN_STARTUP_TARGET_MS で変更できる
+STARTUP_TARGET_MS = 1000
+
+# 書類種別ごとの入力画面を作成するメソッド（画面は最初に表示するときに作成する）
+DOCUMENT_SCREEN_BUILDERS = {
+    "見積書": "create_estimate_screen",
+    "請求書": "create_invoice_screen",
+    "領収書": "create_receipt_screen",
+}
+
+# 生成ジョブの段階ごとの表示名と進捗（%）
+JOB_STAGES = {
+    "queued": ("待機中", 0),
+    "fill": ("Excel作成中", 20),
+    "convert": ("PDF変換中", 50),
+    "publish": ("保存中", 90),
+    "finished": ("完了", 100),
+    "failed": ("失敗", 100),
+    "cancelled": ("キャンセル", 0),
+}
+
+
+class StartupTimer:
+    def __init__(self, started):
+        """起動から最初のウィンドウを表示するまでの段階ごとの所要時間を記録する。"""
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def mark(self, phase):
+        """直前の段階からの所要時間を記録する。"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        get_registry().observe("startup_duration_seconds", now - self.last, {"phase": phase})
+        self.last = now
+
+    def report(self, target_ms):
+        """最初のウィンドウを表示するまでの時間をログに出力し、目標時間以内だったかを返す。"""
+        total_ms = (self.last - self.started) * 1000
+        detail = ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases)
+        message = f"Startup: first window in {total_ms:.0f} ms ({detail}; target {target_ms} ms)"
+        if total_ms > target_ms:
+            logging.warning(message)
+            return False
+        logging.info(message)
+        return True
+
+
+# 明細表の見出し（line_item_store.COLUMNS と同じ並び）
+LINE_ITEM_HEADERS = ["摘要", "数量", "単位", "単価", "値引", "税率 (%)"]
+
+# 品目を選んだときに明細表へ転記する列（列番号 → 品目マスタの項目）
+ITEM_COMPLETION_COLUMNS = {2: "unit", 3: "unit_price", 5: "tax_rate"}
+
+
+class MasterCompleter(QCompleter):
+    def __init__(self, search, key=None, parent=None):
+        """入力のたびにマスタを検索し、よく使う順に候補を表示する入力補完。
+
+        search は入力中の文字列を受け取って候補のリストを返す関数、key は候補から表示する文字列を取り出す関数。
+        """
+        super().__init__(parent)
+        self.search = search
+        self.key = key or str
+        self.entries = {}
+        self.setModel(QStringListModel(self))
+        # 候補はデータベース側で絞り込み済みのため、QCompleter では絞り込まずにそのまま表示する
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.setCaseSensitivity(Qt.CaseInsensitive)
+
+    def attach(self, line_edit):
+        """入力欄に補完を設定する。"""
+        line_edit.setCompleter(self)
+        line_edit.textEdited.connect(self.refresh)
+
+    def refresh(self, text):
+        """入力中の文字列で候補を更新する。"""
         try:
-            # データベースファイルが存在しない場合は新規作成
-            self.conn = sqlite3.connect(self.db_path)
-            self.cursor = self.conn.cursor()
-
-            # テーブルが存在しない場合は作成
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS company_info (
-                    id INTEGER PRIMARY KEY,
-                    company_name TEXT,
-                    postal_code TEXT,
-                    address TEXT,
-                    address_detail TEXT,
-                    phone_number TEXT,
-                    contact_person TEXT,
-                    account_type TEXT,
-                    bank_branch TEXT,
-                    account_number TEXT,
-                    account_name TEXT
-                )
-            ''')
-            self.conn.commit()
-            logging.info("Database connected successfully.")
-        except sqlite3.Error as e:
-            logging.error(f"Error connecting to database: {e}")
-            raise
-
-    def close(self):
-        """データベース接続を安全に閉じる。"""
+            results = self.search(text)
+        except Exception as e:
+            logging.error(f"Failed to search suggestions: {e}")
+            results = []
+        self.entries = {self.key(result): result for result in results}
+        self.model().setStringList(list(self.entries))
+
+
+class ItemSummaryDelegate(QStyledItemDelegate):
+    def __init__(self, db_manager, parent=None):
+        """明細表の摘要列の編集欄に品目マスタの入力補完を付け、選んだ品目の単位・単価・税率を転記する。"""
+        super().__init__(parent)
+        self.db_manager = db_manager
+
+    def createEditor(self, parent, option, index):
+        """摘要の編集欄を作成する。"""
+        editor = super().createEditor(parent, option, index)
+        completer = MasterCompleter(self.db_manager.search_items, key=lambda item: item["summary"], parent=editor)
+        completer.attach(editor)
+        row_index = QPersistentModelIndex(index)
+        completer.activated[str].connect(lambda text: self.fill_item(row_index, completer.entries.get(text)))
+        return editor
+
+    def fill_item(self, index, item):
+        """選んだ品目の単位・単価・税率を同じ行に転記する（品目マスタに値がない項目は変更しない）。"""
+        if item is None or not index.isValid():
+            return
+        model = index.model()
+        for column, key in ITEM_COMPLETION_COLUMNS.items():
+            if item.get(key):
+                model.setData(model.index(index.row(), column), item[key])
+
+
+def format_totals(totals):
+    """合計欄の表示内容（税抜合計・税率ごとの消費税・総合計）を作成する。"""
+    parts = [f"税抜合計 ¥{totals.total_excluding_tax:,}"]
+    for rate, bucket in totals.buckets.items():
+        if bucket.taxable or bucket.tax:
+            parts.append(f"{rate.normalize():f}%対象 ¥{bucket.taxable:,}（消費税 ¥{bucket.tax:,}）")
+    parts.append(f"総合計 ¥{totals.total_including_tax:,}")
+    return "　".join(parts)
+
+
+class LineItemTableModel(QAbstractTableModel):
+    # 明細の数値が変わり、合計を表示し直す必要があることを知らせる
+    totals_changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        """明細表のモデル。セルの値は LineItemStore に列ごとに保持し、セルごとの QTableWidgetItem は作らない。"""
+        super().__init__(parent)
+        self.store = LineItemStore()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.store)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """セルの表示内容を返す。数値の列は右寄せにする。"""
+        if not index.isValid():
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.store.text(index.row(), index.column())
+        if role == Qt.TextAlignmentRole and COLUMNS[index.column()] in NUMERIC_COLUMNS:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        """編集されたセルの値を設定する。数値の列に数値以外が入力された場合は変更しない。"""
+        if not index.isValid() or role != Qt.EditRole:
+            return False
         try:
-            if self.conn:
-                self.cursor.close()
-                self.conn.close()
-                self.conn = None
-                logging.info("Database connection closed.")
-        except sqlite3.Error as e:
-            logging.error(f"Error closing database connection: {e}")
-            raise
-
-    def get_company_info(self):
-        """自社情報をデータベースから取得し、辞書形式で返す。"""
+            self.store.set_text(index.row(), index.column(), value)
+        except ValueError:
+            logging.warning(f"Invalid {LINE_ITEM_HEADERS[index.column()]} on line {index.row() + 1}: {value!r}")
+            return False
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        if COLUMNS[index.column()] in NUMERIC_COLUMNS:
+            self.totals_changed.emit()
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return LINE_ITEM_HEADERS[section]
+        return str(section + 1)
+
+    def insertRows(self, row, count, parent=QModelIndex()):
+        self.beginInsertRows(parent, row, row + count - 1)
+        self.store.insert_rows(row, count)
+        self.endInsertRows()
+        self.totals_changed.emit()
+        return True
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        self.beginRemoveRows(parent, row, row + count - 1)
+        self.store.remove_rows(row, count)
+        self.endRemoveRows()
+        self.totals_changed.emit()
+        return True
+
+    def clear(self):
+        """すべての行を削除する。"""
+        self.beginResetModel()
+        self.store.clear()
+        self.endResetModel()
+        self.totals_changed.emit()
+
+    def import_text(self, text, row=None, column=0):
+        """CSV・タブ区切りの文字列を取り込み、数値として読めなかったセルの (行, 列) のリストを返す。
+
+        数千行を1行ずつ通知すると遅いため、取り込み全体を1回のリセットとして通知する。
+        """
+        self.beginResetModel()
         try:
-            self.connect()
-            self.cursor.execute("SELECT * FROM company_info WHERE id = 1")
-            row = self.cursor.fetchone()
-            if row:
-                # カラム名と値をペアにした辞書として返す
-                columns = [column[0] for column in self.cursor.description]
-                return dict(zip(columns, row))
-            else:
-                logging.warning("Company info not found.")
-                return None  # None を返すように修正 
-        except sqlite3.Error as e:
-            logging.error(f"Error getting company info: {e}")
-            raise
+            return self.store.import_text(text, row, column)
         finally:
-            self.close()
-
-    def update_company_info(self, info):
-        """自社情報をデータベースに更新または新規挿入する。"""
+            self.endResetModel()
+            self.totals_changed.emit()
+
+    def items(self):
+        """生成依頼に渡す明細行を返す。"""
+        return self.store.items()
+
+
+class LineItemTableView(QTableView):
+    def __init__(self, parent=None):
+        """明細表。表計算ソフトからコピーした範囲を Ctrl+V で選択中のセルを左上として貼り付けられる。"""
+        super().__init__(parent)
+        self.setModel(LineItemTableModel(self))
+        self.setSelectionBehavior(QAbstractItemView.SelectItems)
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.Paste):
+            self.paste_clipboard()
+            return
+        super().keyPressEvent(event)
+
+    def paste_clipboard(self):
+        """クリップボードの内容を貼り付ける。"""
+        current = self.currentIndex()
+        row, column = (current.row(), current.column()) if current.isValid() else (None, 0)
+        self.report_invalid(self.model().import_text(QApplication.clipboard().text(), row, column))
+
+    def import_csv(self):
+        """CSVファイルを選んで明細を末尾に追加する。"""
+        path, _ = QFileDialog.getOpenFileName(self, "明細をCSVから読み込む", "", "CSV (*.csv *.txt);;すべてのファイル (*)")
+        if not path:
+            return
         try:
-            self.connect()
-            self.cursor.execute("SELECT * FROM company_info WHERE id = 1")  # id = 1 のレコードを検索 
-            existing_data = self.cursor.fetchone()
-
-            if existing_data:
-                self.cursor.execute('''
-                    UPDATE company_info SET
-                        company_name = ?, postal_code = ?, address = ?, address_detail = ?,
-                        phone_number = ?, contact_person = ?, account_type = ?, bank_branch = ?,
-                        account_number = ?, account_name = ?
-                    WHERE id = 1
-                ''', (info.get("company_name"), info.get("postal_code"), info.get("address"),
-                      info.get("address_detail"), info.get("phone_number"), info.get("contact_person"),
-                      info.get("account_type"), info.get("bank_branch"), info.get("account_number"),
-                      info.get("account_name")))
-                self.conn.commit()
-                logging.info("Company info updated.")
-            else:
-                self.cursor.execute('''
-                    INSERT INTO company_info (
-                        id, company_name, postal_code, address, address_detail,
-                        phone_number, contact_person, account_type, bank_branch,
-                        account_number, account_name
-                    ) VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (info.get("company_name"), info.get("postal_code"), info.get("address"),
-                      info.get("address_detail"), info.get("phone_number"), info.get("contact_person"),
-                      info.get("account_type"), info.get("bank_branch"), info.get("account_number"),
-                      info.get("account_name")))
-                self.conn.commit()
-                logging.info("Company info inserted.")
-        except sqlite3.Error as e:
-            logging.error(f"Error updating company info: {e}")
-            raise
-        finally:
-            self.close()
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            QMessageBox.warning(self, "読み込みエラー", f"CSVを読み込めませんでした: {e}")
+            return
+        self.report_invalid(self.model().import_text(text))
+
+    def report_invalid(self, invalid):
+        """数値として読めずに取り込まなかったセルを知らせる。"""
+        if not invalid:
+            return
+        cells = ", ".join(f"{row + 1}行目の{LINE_ITEM_HEADERS[column]}" for row, column in invalid[:5])
+        more = f" ほか{len(invalid) - 5}件" if len(invalid) > 5 else ""
+        QMessageBox.warning(self, "取り込めない値", f"数値として読めない値は取り込みませんでした: {cells}{more}")
+
+
+class JobCancelled(BaseException):
+    """キャンセルされた生成ジョブを中断するための例外。
 
-    def delete_company_info(self):
-        """自社情報をデータベースから削除する（通常は使用しない）。"""
+    書類生成エンジンが失敗として数えたり dead_letter に書き留めたりしないよう、Exception を継承しない。
+    """
+
+
+class GenerationJobSignals(QObject):
+    """生成ジョブからGUIスレッドへ状態を通知するシグナル。"""
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(int, str)
+    failed = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+
+
+class GenerationJob(QRunnable):
+    def __init__(self, job_id, generator, request, company_info):
+        """入力内容のスナップショットから書類を1件生成するバックグラウンドジョブ。"""
+        super().__init__()
+        self.setAutoDelete(False)
+        self.job_id = job_id
+        self.generator = generator
+        self.request = request
+        self.company_info = company_info
+        self.cancel_requested = False
+        self.signals = GenerationJobSignals()
+
+    def cancel(self):
+        """ジョブのキャンセルを要求する。保存を始める前の段階であれば中断される。"""
+        self.cancel_requested = True
+
+    def report_progress(self, stage):
+        """段階の切り替わりを通知し、キャンセルが要求されていれば中断する。"""
+        if self.cancel_requested:
+            raise JobCancelled()
+        self.signals.progress.emit(self.job_id, stage)
+
+    def run(self):
+        """ワーカースレッドで書類を生成する。"""
         try:
-            self.connect()
-            self.cursor.execute("DELETE FROM company_info WHERE id = 1")
-            self.conn.commit()
-            logging.warning("Company info deleted.")
-        except sqlite3.Error as e:
-            logging.error(f"Error deleting company info: {e}")
-            raise
-        finally:
-            self.close()
+            final_pdf_path = self.generator.generate(self.request, self.company_info, progress=self.report_progress)
+            self.signals.finished.emit(self.job_id, final_pdf_path)
+        except JobCancelled:
+            self.signals.cancelled.emit(self.job_id)
+        except Exception as e:
+            logging.exception(f"Document generation failed (job {self.job_id})")
+            self.signals.failed.emit(self.job_id, str(e))
+
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, db_manager=None):
         """メインウィンドウの初期化とUI構築。"""
         super().__init__()
         self.setWindowTitle("書類作成アプリケーション")
         self.setGeometry(100, 100, 640, 560)
-        self.db_manager = DatabaseManager()
+        self.db_manager = db_manager or DatabaseManager()
+        self._generator = None
+        self.document_screens = {}
+        # 書類種別 → 入力画面の発行元の選択欄
+        self.issuer_fields = {}
         self.stack = QStackedWidget()
         self.setCentralWidget(self.stack)
         self.create_top_menu()
-        self.create_estimate_screen()
-        self.create_invoice_screen()
-        self.create_receipt_screen()
         self.remarks_text = ""
+        self.create_job_queue_panel()
+
+    @property
+    def generator(self):
+        """書類生成エンジン。openpyxl などの読み込みに時間がかかるため、最初に使うときに作成する。"""
+        if self._generator is None:
+            started = time.perf_counter()
+            from document_engine import DocumentGenerator
+            remove_stale_temp_dirs()
+            self._generator = DocumentGenerator(self.db_manager, converter=create_converter())
+            logging.info(f"Generation engine ready in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return self._generator
+
+    def warm_up(self):
+        """ウィンドウの表示後、操作の合間に書類生成エンジンを用意しておく（最初の生成を待たせないため）。"""
+        self.generator
+
+    def show_document_screen(self, document_type):
+        """入力画面を表示する。画面は最初に表示するときに作成する。"""
+        screen = self.document_screens.get(document_type)
+        if screen is None:
+            screen = getattr(self, DOCUMENT_SCREEN_BUILDERS[document_type])()
+            self.document_screens[document_type] = screen
+        self.stack.setCurrentWidget(screen)
 
     def create_top_menu(self):
         """トップメニュー画面を作成し、スタックに追加する。"""
@@ -161,9 +372,9 @@ class MainWindow(QMainWindow):
         settings_button = QPushButton("自社情報変更")
         exit_button = QPushButton("終了")
         # ボタンクリック時の処理
-        estimate_button.clicked.connect(lambda: self.stack.setCurrentWidget(self.estimate_screen))
-        invoice_button.clicked.connect(lambda: self.stack.setCurrentWidget(self.invoice_screen))
-        receipt_button.clicked.connect(lambda: self.stack.setCurrentWidget(self.receipt_screen))
+        estimate_button.clicked.connect(lambda: self.show_document_screen("見積書"))
+        invoice_button.clicked.connect(lambda: self.show_document_screen("請求書"))
+        receipt_button.clicked.connect(lambda: self.show_document_screen("領収書"))
         settings_button.clicked.connect(self.open_settings_dialog)
         exit_button.clicked.connect(self.exit_process)
         # レイアウトにボタン追加
@@ -180,18 +391,32 @@ class MainWindow(QMainWindow):
         screen = QWidget()
         layout = QVBoxLayout()
         input_layout = QFormLayout()
+        # 発行元（自社情報）を複数登録している場合は、書類ごとに選べる
+        issuer_field = QComboBox()
+        self.issuer_fields[document_type] = issuer_field
+        self.refresh_issuer_field(issuer_field)
+        input_layout.addRow("発行元:", issuer_field)
         company_name_field = QLineEdit()
+        # 取引先名・摘要は、取引先マスタ・品目マスタから入力補完する
+        MasterCompleter(self.db_manager.search_customers, parent=company_name_field).attach(company_name_field)
         layout.addLayout(input_layout)
         remarks_button = QPushButton("備考を入力")
         remarks_button.clicked.connect(self.open_remarks_dialog)
         layout.addWidget(remarks_button)
-        table = QTableWidget()
-        table.setColumnCount(6)  # 列数を修正
-        table.setHorizontalHeaderLabels(["摘要", "数量", "単位", "単価", "値引", "税率 (%)"])  # ヘッダーラベルを修正
+        table = LineItemTableView()
+        table.setItemDelegateForColumn(0, ItemSummaryDelegate(self.db_manager, table))
         layout.addWidget(table)
         add_row_button = QPushButton("行を追加")
         add_row_button.clicked.connect(lambda: self.add_table_row(table))
         layout.addWidget(add_row_button)
+        import_button = QPushButton("CSVから読み込み")
+        import_button.clicked.connect(table.import_csv)
+        layout.addWidget(import_button)
+        # 明細を編集するたびに合計を表示し直す（変更されたセルの分だけ差分で集計する）
+        totals_label = QLabel(format_totals(table.model().store.totals()))
+        totals_label.setWordWrap(True)
+        table.model().totals_changed.connect(lambda: totals_label.setText(format_totals(table.model().store.totals())))
+        layout.addWidget(totals_label)
         delete_row_button = QPushButton("選択した行を削除")
         delete_row_button.clicked.connect(lambda: self.delete_table_row(table))
         layout.addWidget(delete_row_button)
@@ -203,8 +428,17 @@ class MainWindow(QMainWindow):
         screen.setLayout(layout)
         return screen, input_layout, company_name_field, table, generate_button
 
+    def refresh_issuer_field(self, issuer_field):
+        """発行元の選択欄を、登録されている発行元プロファイルの一覧で作り直す（選択中の発行元は維持する）。"""
+        selected = issuer_field.currentData() or DEFAULT_ISSUER_ID
+        issuer_field.clear()
+        for issuer_id, profile in self.db_manager.get_issuer_profiles().items():
+            issuer_field.addItem(f"{profile.get('company_name') or ''} ({issuer_id})", issuer_id)
+        index = issuer_field.findData(selected)
+        issuer_field.setCurrentIndex(index if index >= 0 else 0)
+
     def create_estimate_screen(self):
-        """見積書作成画面を初期化し、スタックに追加する。"""
+        """見積書作成画面を作成してスタックに追加し、画面を返す。"""
         self.estimate_screen, estimate_input_layout, self.estimate_company_name, self.estimate_table, generate_button = self.create_document_screen("見積書")
         self.estimate_subject = QLineEdit()
         self.estimate_expiry_date = QDateEdit()
@@ -221,9 +455,10 @@ class MainWindow(QMainWindow):
         estimate_input_layout.addRow("取引方法:", self.estimate_transaction_method)
         generate_button.clicked.connect(lambda: self.generate_document("見積書"))
         self.stack.addWidget(self.estimate_screen)
+        return self.estimate_screen
 
     def create_invoice_screen(self):
-        """請求書作成画面を初期化し、スタックに追加する。"""
+        """請求書作成画面を作成してスタックに追加し、画面を返す。"""
         self.invoice_screen, invoice_input_layout, self.invoice_company_name, self.invoice_table, generate_button = self.create_document_screen("請求書")
         self.invoice_subject = QLineEdit()
         self.invoice_expiry_date = QDateEdit()
@@ -240,9 +475,10 @@ class MainWindow(QMainWindow):
         invoice_input_layout.addRow("取引方法:", self.invoice_transaction_method)
         generate_button.clicked.connect(lambda: self.generate_document("請求書"))
         self.stack.addWidget(self.invoice_screen)
+        return self.invoice_screen
 
     def create_receipt_screen(self):
-        """領収書作成画面を初期化し、スタックに追加する。"""
+        """領収書作成画面を作成してスタックに追加し、画面を返す。"""
         self.receipt_screen, receipt_input_layout, self.receipt_company_name, self.receipt_table, generate_button = self.create_document_screen("領収書")
         self.receipt_period_duration = QDateEdit()
         self.receipt_period_duration.setCalendarPopup(True)
@@ -255,6 +491,119 @@ class MainWindow(QMainWindow):
         receipt_input_layout.addRow("取引方法:", self.receipt_transaction_method)
         generate_button.clicked.connect(lambda: self.generate_document("領収書"))
         self.stack.addWidget(self.receipt_screen)
+        return self.receipt_screen
+
+    def create_job_queue_panel(self):
+        """生成ジョブの一覧（キュー）を表示するパネルを作成する。"""
+        # 変換ワーカー数だけ並行に生成する（1件ずつ soffice を起動する場合は同時実行しない）
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(max(1, get_pool_size()))
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+
+        panel = QWidget()
+        layout = QVBoxLayout()
+        self.job_table = QTableWidget()
+        self.job_table.setColumnCount(5)
+        self.job_table.setHorizontalHeaderLabels(["No", "書類", "取引先企業名", "状態", "進捗"])
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.job_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.job_table.verticalHeader().setVisible(False)
+        layout.addWidget(self.job_table)
+        button_layout = QHBoxLayout()
+        cancel_button = QPushButton("選択したジョブをキャンセル")
+        cancel_button.clicked.connect(self.cancel_selected_jobs)
+        button_layout.addWidget(cancel_button)
+        clear_button = QPushButton("終了したジョブを消去")
+        clear_button.clicked.connect(self.clear_finished_jobs)
+        button_layout.addWidget(clear_button)
+        layout.addLayout(button_layout)
+        panel.setLayout(layout)
+
+        dock = QDockWidget("生成キュー", self)
+        dock.setWidget(panel)
+        dock.setFeatures(QDockWidget.DockWidgetMovable | QDockWidget.DockWidgetFloatable)
+        self.addDockWidget(Qt.BottomDockWidgetArea, dock)
+
+    def find_job_row(self, job_id):
+        """ジョブ一覧からジョブの行番号を探す。見つからなければ -1 を返す。"""
+        for row in range(self.job_table.rowCount()):
+            if self.job_table.item(row, 0).data(Qt.UserRole) == job_id:
+                return row
+        return -1
+
+    def set_job_status(self, job_id, stage, detail=None):
+        """ジョブ一覧の状態と進捗を更新する。"""
+        row = self.find_job_row(job_id)
+        if row < 0:
+            return
+        label, percent = JOB_STAGES[stage]
+        status_item = QTableWidgetItem(f"{label}: {detail}" if detail else label)
+        if detail:
+            status_item.setToolTip(detail)
+        status_item.setData(Qt.UserRole, stage)
+        self.job_table.setItem(row, 3, status_item)
+        self.job_table.cellWidget(row, 4).setValue(percent)
+
+    def submit_generation_job(self, request):
+        """生成依頼をキューに追加し、バックグラウンドで生成を開始する。"""
+        job_id = next(self.job_ids)
+        job = GenerationJob(job_id, self.generator, request, self.db_manager.get_company_info(request.issuer))
+        job.signals.progress.connect(self.on_job_progress)
+        job.signals.finished.connect(self.on_job_finished)
+        job.signals.failed.connect(self.on_job_failed)
+        job.signals.cancelled.connect(self.on_job_cancelled)
+        self.jobs[job_id] = job
+
+        row = self.job_table.rowCount()
+        self.job_table.insertRow(row)
+        id_item = QTableWidgetItem(str(job_id))
+        id_item.setData(Qt.UserRole, job_id)
+        self.job_table.setItem(row, 0, id_item)
+        self.job_table.setItem(row, 1, QTableWidgetItem(request.document_type))
+        self.job_table.setItem(row, 2, QTableWidgetItem(request.company_name))
+        self.job_table.setCellWidget(row, 4, QProgressBar())
+        self.set_job_status(job_id, "queued")
+
+        self.thread_pool.start(job)
+        return job_id
+
+    def on_job_progress(self, job_id, stage):
+        """ジョブの段階が進んだときに一覧を更新する。"""
+        self.set_job_status(job_id, stage)
+
+    def on_job_finished(self, job_id, final_pdf_path):
+        """ジョブが完了したときに一覧を更新する。"""
+        self.jobs.pop(job_id, None)
+        self.set_job_status(job_id, "finished", final_pdf_path)
+        logging.info(f"PDFが正常に保存されました: {final_pdf_path}")
+
+    def on_job_failed(self, job_id, error):
+        """ジョブが失敗したときに一覧を更新する。"""
+        self.jobs.pop(job_id, None)
+        self.set_job_status(job_id, "failed", error)
+
+    def on_job_cancelled(self, job_id):
+        """ジョブがキャンセルされたときに一覧を更新する。"""
+        self.jobs.pop(job_id, None)
+        self.set_job_status(job_id, "cancelled")
+
+    def cancel_selected_jobs(self):
+        """選択したジョブをキャンセルする。開始前のジョブはキューから取り除く。"""
+        for index in self.job_table.selectionModel().selectedRows():
+            job_id = self.job_table.item(index.row(), 0).data(Qt.UserRole)
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            job.cancel()
+            if self.thread_pool.tryTake(job):
+                self.on_job_cancelled(job_id)
+
+    def clear_finished_jobs(self):
+        """完了・失敗・キャンセルしたジョブを一覧から消去する。"""
+        for row in reversed(range(self.job_table.rowCount())):
+            if self.job_table.item(row, 0).data(Qt.UserRole) not in self.jobs:
+                self.job_table.removeRow(row)
 
     def open_remarks_dialog(self):
         """備考入力用のダイアログを表示する。"""
@@ -277,227 +626,97 @@ class MainWindow(QMainWindow):
 
     def add_table_row(self, table):
         """テーブルに新しい行を追加する。"""
-        if isinstance(table, QTableWidget):
-            row_position = table.rowCount()
-            table.insertRow(row_position)
+        model = table.model()
+        model.insertRows(model.rowCount(), 1)
 
     def delete_table_row(self, table):
         """テーブルで選択された行を削除する。"""
-        selected_rows = table.selectionModel().selectedRows()
-        for row in sorted(selected_rows, reverse=True):
-            table.removeRow(row.row())
+        # セル単位で選択できるため、選択したセルを含む行を削除する
+        rows = {index.row() for index in table.selectionModel().selectedIndexes()}
+        for row in sorted(rows, reverse=True):
+            table.model().removeRows(row, 1)
     
     def get_template_path(self, document_type):
         """テンプレートファイルのパスを取得する。"""
         # テンプレートファイルのパスを取得する関数
-        if getattr(sys, "frozen", False):
-            # .exe
-            base_path = os.path.dirname(sys.executable)
-        else:
-            # .py
-            base_path = os.path.dirname(__file__)
-        return base_path
+        return get_base_dir()
 
-    def generate_document(self, document_type="見積書"):
-        """入力内容をもとにExcelファイルを生成し、PDFに変換して保存する。"""
-        # テーブルと入力フィールドの取得
+    def get_document_fields(self, document_type):
+        """書類種別に対応する入力フィールドを辞書で返す。"""
         if document_type == "見積書":
-            table = self.estimate_table
-            company_name_field = self.estimate_company_name
-            subject_field = self.estimate_subject
-            expiry_date_field = self.estimate_expiry_date
-            delivery_date_field = self.estimate_delivery_date
-            delivery_place_field = self.estimate_delivery_place
-            transaction_method_field = self.estimate_transaction_method
+            return {
+                "table": self.estimate_table,
+                "company_name": self.estimate_company_name,
+                "subject": self.estimate_subject,
+                "expiry_date": self.estimate_expiry_date,
+                "delivery_date": self.estimate_delivery_date,
+                "delivery_place": self.estimate_delivery_place,
+                "transaction_method": self.estimate_transaction_method,
+            }
         elif document_type == "請求書":
-            table = self.invoice_table
-            company_name_field = self.invoice_company_name
-            subject_field = self.invoice_subject
-            expiry_date_field = self.invoice_expiry_date
-            delivery_date_field = self.invoice_delivery_date
-            delivery_place_field = self.invoice_delivery_place
-            transaction_method_field = self.invoice_transaction_method
+            return {
+                "table": self.invoice_table,
+                "company_name": self.invoice_company_name,
+                "subject": self.invoice_subject,
+                "expiry_date": self.invoice_expiry_date,
+                "delivery_date": self.invoice_delivery_date,
+                "delivery_place": self.invoice_delivery_place,
+                "transaction_method": self.invoice_transaction_method,
+            }
         elif document_type == "領収書":
-            table = self.receipt_table
-            company_name_field = self.receipt_company_name
-            period_duration_field = self.receipt_period_duration
-            delivery_place_field = self.receipt_delivery_place
-            transaction_method_field = self.receipt_transaction_method
+            return {
+                "table": self.receipt_table,
+                "company_name": self.receipt_company_name,
+                "expiry_date": self.receipt_period_duration,
+                "delivery_place": self.receipt_delivery_place,
+                "transaction_method": self.receipt_transaction_method,
+            }
         else:
             raise ValueError(f"Unknown document type: {document_type}")
 
-        template_path = self.get_template_path(document_type)
-        template_path = os.path.join(template_path, "Templates", f"{document_type}_テンプレート.xlsx")
-        temp_dir = tempfile.mkdtemp()
-        temp_file = os.path.join(temp_dir, f"{document_type}.xlsx")
-        shutil.copy(template_path, temp_file)
-        workbook_openpyxl = load_workbook(temp_file)
-        sheet = workbook_openpyxl.active
-        company_info = self.db_manager.get_company_info()
-
-        # 自社情報
-        sheet["F5"].value = company_info.get("company_name", "")
-        sheet["G6"].value = company_info.get("postal_code", "")
-        sheet["G7"].value = company_info.get("address", "")
-        sheet["G8"].value = company_info.get("address_detail", "")
-        sheet["G9"].value = company_info.get("phone_number", "")
-        sheet["G10"].value = company_info.get("contact_person", "")
-        if document_type == "請求書":
-            sheet["G11"].value = company_info.get("account_type", "")
-            sheet["G12"].value = company_info.get("bank_branch", "")
-            sheet["G13"].value = company_info.get("account_number", "")
-            sheet["G14"].value = company_info.get("account_name", "")
-
-        # 書類情報
-        sheet["A2"].value = company_name_field.text()
-        sheet["A2"].alignment = Alignment(vertical="bottom", horizontal="center")
-        if document_type in ["見積書", "請求書"]:
-            sheet["B5"].value = subject_field.text()
-            sheet["B5"].alignment = Alignment(vertical="center")
-            sheet["B6"].value = QDate.currentDate().toString("yyyy/MM/dd")
-            sheet["B6"].alignment = Alignment(vertical="center")
-            sheet["B7"].value = expiry_date_field.date().toString("yyyy/MM/dd")
-            sheet["B8"].value = delivery_date_field.text()
-            sheet["B8"].alignment = Alignment(vertical="center")
-            sheet["B9"].value = delivery_place_field.text()
-            sheet["B9"].alignment = Alignment(vertical="center")
-            sheet["B10"].value = transaction_method_field.text()
-            sheet["B10"].alignment = Alignment(vertical="center")
-        elif document_type == "領収書":
-            sheet["B5"].value = QDate.currentDate().toString("yyyy/MM/dd")
-            sheet["B5"].alignment = Alignment(vertical="center")
-            sheet["B6"].value = QDate.currentDate().toString("yyyy/MM/dd")
-            sheet["B6"].alignment = Alignment(vertical="center")
-            sheet["B7"].value = period_duration_field.date().toString("yyyy/MM/dd")
-            sheet["B7"].alignment = Alignment(vertical="center")
-            sheet["B8"].value = delivery_place_field.text()
-            sheet["B8"].alignment = Alignment(vertical="center")
-            sheet["B9"].value = transaction_method_field.text()
-            sheet["B9"].alignment = Alignment(vertical="center")
-
-        docRow = 16
-        sumTax = 26
-        taxRow = 28
-        remarksPos = 33
-        if document_type == "請求書":
-            docRow += 1
-            sumTax += 1
-            taxRow += 1
-            remarksPos += 1
-
-        # テーブルデータ
-        total_excluding_tax = 0
-        total_tax = 0
-        tax_10_total = 0
-        tax_8_total = 0
-        tax_0_total = 0
-        for row in range(table.rowCount()):
-            summary = table.item(row, 0).text() if table.item(row, 0) else ""
-            quantity = table.item(row, 1).text() if table.item(row, 1) else "0"
-            unit = table.item(row, 2).text() if table.item(row, 2) else ""
-            unit_price = table.item(row, 3).text() if table.item(row, 3) else "0"
-            discount = table.item(row, 4).text() if table.item(row, 4) else "0"
-            tax_rate = float(table.item(row, 5).text()) / 100 if table.item(row, 5) else 0
-
-            sheet[f"A{docRow + row}"].value = summary
-            sheet[f"D{docRow + row}"].value = quantity
-            sheet[f"D{docRow + row}"].alignment = Alignment(vertical="center", horizontal="right")
-            sheet[f"E{docRow + row}"].value = unit
-            sheet[f"F{docRow + row}"].value = unit_price
-            sheet[f"F{docRow + row}"].alignment = Alignment(vertical="center", horizontal="right")
-            sheet[f"G{docRow + row}"].value = discount
-            sheet[f"G{docRow + row}"].alignment = Alignment(vertical="center", horizontal="right")
-            sheet[f"H{docRow + row}"].value = tax_rate
-            sheet[f"H{docRow + row}"].number_format = '0%'
-            sheet[f"H{docRow + row}"].alignment = Alignment(vertical="center")
-
-            # 小計計算
-            subtotal = (float(quantity) * float(unit_price)) - float(discount or 0)
-            sheet[f"I{docRow + row}"].value = subtotal
-            sheet[f"I{docRow + row}"].alignment = openpyxl.styles.alignment.Alignment(vertical="center")
-
-        # 合計金額の計算と埋め込み
-        total_excluding_tax = sum(float(sheet[f"I{docRow + row}"].value or 0) for row in range(table.rowCount()))
-        total_tax = sum(float(sheet[f"I{docRow + row}"].value or 0) * float(sheet[f"H{docRow + row}"].value or 0) for row in range(table.rowCount()))
-        total_including_tax = total_excluding_tax + total_tax
-
-        sheet[f"I{sumTax}"].value = total_excluding_tax  # 税抜合計
-        sheet[f"I{sumTax+1}"].value = total_tax  # 消費税合計
-        sheet[f"I{sumTax+2}"].value = total_including_tax  # 総合計
-
-        # 税率ごとの合計金額を計算して埋め込み
-        tax_10_total = sum(sheet[f"I{docRow + row}"].value or 0 for row in range(table.rowCount()) if sheet[f"H{docRow + row}"].value == 0.1)
-        tax_10_tax = tax_10_total * 0.1
-        tax_8_total = sum(sheet[f"I{docRow + row}"].value or 0 for row in range(table.rowCount()) if sheet[f"H{docRow + row}"].value == 0.08)
-        tax_8_tax = tax_8_total * 0.08
-        tax_0_total = sum(sheet[f"I{docRow + row}"].value or 0 for row in range(table.rowCount()) if sheet[f"H{docRow + row}"].value in [0, ""])
-
-        sheet[f"B{taxRow}"].value = tax_10_total  # 税率10%商品の税抜合計
-        sheet[f"C{taxRow}"].value = tax_10_tax  # 税率10%商品の消費税額合計
-        sheet[f"B{taxRow + 1}"].value = tax_8_total  # 税率8%商品の税抜合計
-        sheet[f"C{taxRow + 1}"].value = tax_8_tax  # 税率8%商品の消費税額合計
-        sheet[f"B{taxRow + 2}"].value = tax_0_total  # 税率0%商品の税抜合計
-        sheet[f"C{taxRow + 2}"].value = 0  # 税率0%商品の消費税額合計
-
-        # 備考欄の内容を埋め込む
-        if self.remarks_text:
-            sheet[f"A{remarksPos}"].value = self.remarks_text
-            sheet[f"A{remarksPos}"].alignment = openpyxl.styles.alignment.Alignment(vertical="top", horizontal="left")
-
-        # 保存
-        workbook_openpyxl.save(temp_file)
-        print(f"Excelファイルが正常に保存されました: {temp_file}")
-
-        # LibreOfficeのパスを明示的に指定
-        libreoffice_path = r"C:\Program Files\LibreOffice\program\soffice.exe"
-
-        # LibreOfficeを使用して指定シートのみをPDFに変換
-        def convert_sheet_to_pdf_with_libreoffice(input_file, output_dir, sheet_name):
-            try:
-                # LibreOfficeで指定シートをPDFに変換
-                subprocess.run([
-                    libreoffice_path, "--headless", "--convert-to", "pdf:calc_pdf_Export", input_file,
-                    "--outdir", output_dir, f"--infilter=calc:sheet={sheet_name}"
-                ], check=True)
-                logging.info(f"Successfully converted sheet '{sheet_name}' in {input_file} to PDF using LibreOffice.")
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Error converting sheet '{sheet_name}' in {input_file} to PDF: {e}")
-                raise
-            except FileNotFoundError:
-                logging.error("LibreOffice executable not found. Please check the path.")
-                raise
-
-        # PDF保存先
-        pdf_output_dir = os.path.dirname(temp_file)
-        convert_sheet_to_pdf_with_libreoffice(temp_file, pdf_output_dir, document_type)
-
-        base_dir = self.get_template_path(document_type)
-        sub_dir = "見積書" if document_type == "見積書" else ("請求書" if document_type == "請求書" else "領収書")
-        company_dir = os.path.join(base_dir, sub_dir, company_name_field.text(), QDate.currentDate().toString('yyyy'), QDate.currentDate().toString('MM'))
-        os.makedirs(company_dir, exist_ok=True)
-        final_pdf_path = os.path.join(company_dir, f"{QDate.currentDate().toString('yyyyMMdd')}{QTime.currentTime().toString('hhmm')}.pdf")
-        shutil.move(temp_file.replace(".xlsx", ".pdf"), final_pdf_path)
-
-        # 一時ファイルとフォルダを削除
-        shutil.rmtree(temp_dir)
-        
-        # PDF生成後に変数を初期化
-        company_name_field.clear()
+    def build_document_request(self, document_type):
+        """入力画面の内容を生成依頼（DocumentRequest）に変換する。"""
+        fields = self.get_document_fields(document_type)
+        return DocumentRequest(
+            document_type=document_type,
+            company_name=fields["company_name"].text(),
+            subject=fields["subject"].text() if "subject" in fields else "",
+            expiry_date=fields["expiry_date"].date().toPyDate(),
+            delivery_date=fields["delivery_date"].text() if "delivery_date" in fields else "",
+            delivery_place=fields["delivery_place"].text(),
+            transaction_method=fields["transaction_method"].text(),
+            remarks=self.remarks_text,
+            items=fields["table"].model().items(),
+            issuer=self.issuer_fields[document_type].currentData() or "",
+        )
+
+    def clear_document_fields(self, document_type):
+        """PDF生成後に入力画面の内容を初期化する。"""
+        fields = self.get_document_fields(document_type)
+        fields["company_name"].clear()
         if not document_type == "領収書":
-            subject_field.clear()
-            expiry_date_field.setDate(QDate.currentDate())
-            delivery_date_field.clear()
-        delivery_place_field.clear()
-        transaction_method_field.clear()
+            fields["subject"].clear()
+            fields["expiry_date"].setDate(QDate.currentDate())
+            fields["delivery_date"].clear()
+        fields["delivery_place"].clear()
+        fields["transaction_method"].clear()
         self.remarks_text = ""
 
-        # テーブルウィジェットの内容をクリア
-        self.estimate_table.setRowCount(0)
-        self.invoice_table.setRowCount(0)
-        self.receipt_table.setRowCount(0)
-        table.setRowCount(0)
-        
-        print(f"PDFが正常に保存されました: {final_pdf_path}")
+        # 明細表の内容をクリア（作成済みの画面のみ）
+        for screen_type in self.document_screens:
+            self.get_document_fields(screen_type)["table"].model().clear()
+
+    def generate_document(self, document_type="見積書"):
+        """入力内容を生成依頼としてキューに追加し、バックグラウンドでPDFを生成する。"""
+        try:
+            request = self.build_document_request(document_type)
+        except ValueError as e:
+            QMessageBox.warning(self, "入力エラー", f"この内容では書類を作成できません: {e}")
+            return
+        self.submit_generation_job(request)
+
+        # 入力内容はスナップショット済みなので、すぐに次の書類を入力できるよう初期化
+        self.clear_document_fields(document_type)
 
     def add_settings_button(self):
         """自社情報変更ボタンを画面に追加する。"""
@@ -522,6 +741,13 @@ class MainWindow(QMainWindow):
         dialog.setWindowTitle("自社情報設定")
         layout = QFormLayout(dialog)
 
+        # 発行元プロファイルのID。一覧から選ぶと内容を表示し、新しいIDを入力して保存すると発行元を追加する
+        issuer_field = QComboBox()
+        issuer_field.setEditable(True)
+        issuer_field.addItems(list(self.db_manager.get_issuer_profiles()) or [DEFAULT_ISSUER_ID])
+        issuer_field.setCurrentText(DEFAULT_ISSUER_ID)
+        layout.addRow("発行元ID:", issuer_field)
+
         company_name_field = QLineEdit()  # 変数として保持
         layout.addRow("会社名:", company_name_field)
 
@@ -552,19 +778,29 @@ class MainWindow(QMainWindow):
         account_holder_name_field = QLineEdit() # 変数として保持
         layout.addRow("口座名義:", account_holder_name_field)
 
+        output_dir_field = QLineEdit()
+        output_dir_field.setPlaceholderText("空欄ならアプリケーションのフォルダ")
+        layout.addRow("PDFの保存先:", output_dir_field)
+
+        def load_profile(issuer_id):
+            """選択した発行元の自社情報をフィールドに設定する（未登録の発行元なら空欄にする）。"""
+            company_info = self.db_manager.get_company_info(issuer_id) if issuer_id else None
+            company_info = company_info or {}
+            company_name_field.setText(company_info.get("company_name") or "")
+            address_line1.setText(company_info.get("postal_code") or "")
+            address_line2.setText(company_info.get("address") or "")
+            address_line3.setText(company_info.get("address_detail") or "")
+            phone_number_field.setText(company_info.get("phone_number") or "")
+            contact_person_field.setText(company_info.get("contact_person") or "")
+            bank_account_type_field.setText(company_info.get("account_type") or "")
+            bank_name_branch_field.setText(company_info.get("bank_branch") or "")
+            account_number_field.setText(company_info.get("account_number") or "")
+            account_holder_name_field.setText(company_info.get("account_name") or "")
+            output_dir_field.setText(company_info.get("output_dir") or "")
+
         # 既存の自社情報をフィールドに設定
-        company_info = self.db_manager.get_company_info()
-        if company_info:
-            company_name_field.setText(company_info.get("company_name", ""))
-            address_line1.setText(company_info.get("postal_code", ""))
-            address_line2.setText(company_info.get("address", ""))
-            address_line3.setText(company_info.get("address_detail", ""))
-            phone_number_field.setText(company_info.get("phone_number", ""))
-            contact_person_field.setText(company_info.get("contact_person", ""))
-            bank_account_type_field.setText(company_info.get("account_type", ""))
-            bank_name_branch_field.setText(company_info.get("bank_branch", ""))
-            account_number_field.setText(company_info.get("account_number", ""))
-            account_holder_name_field.setText(company_info.get("account_name", ""))
+        load_profile(issuer_field.currentText())
+        issuer_field.activated[str].connect(load_profile)
 
         save_button = QPushButton("保存")
         save_button.clicked.connect(lambda: self.save_company_info(
@@ -578,7 +814,9 @@ class MainWindow(QMainWindow):
             bank_account_type_field,
             bank_name_branch_field,
             account_number_field,
-            account_holder_name_field
+            account_holder_name_field,
+            issuer_field,
+            output_dir_field
         ))
         layout.addWidget(save_button)
 
@@ -596,7 +834,9 @@ class MainWindow(QMainWindow):
         bank_account_type_field,
         bank_name_branch_field,
         account_number_field,
-        account_holder_name_field
+        account_holder_name_field,
+        issuer_field=None,
+        output_dir_field=None
     ):
         """自社情報設定ダイアログで入力された内容をデータベースに保存する。"""
         # 自社情報を保存する処理
@@ -610,36 +850,75 @@ class MainWindow(QMainWindow):
             "account_type": bank_account_type_field.text(),
             "bank_branch": bank_name_branch_field.text(),
             "account_number": account_number_field.text(),
-            "account_name": account_holder_name_field.text()
+            "account_name": account_holder_name_field.text(),
+            "output_dir": output_dir_field.text() if output_dir_field is not None else None
         }
-        self.db_manager.update_company_info(new_info)
+        issuer_id = issuer_field.currentText().strip() if issuer_field is not None else ""
+        self.db_manager.update_company_info(new_info, issuer_id or DEFAULT_ISSUER_ID)
         self.update_company_info()
+        # 作成済みの入力画面の発行元の一覧にも反映する
+        for field in self.issuer_fields.values():
+            self.refresh_issuer_field(field)
         dialog.accept()
 
     def closeEvent(self, event):
         """アプリ終了時にデータベース接続を閉じる。"""
-        # アプリ終了時にデータベース接続を閉じる
+        # 生成中のジョブを待ってから、変換ワーカーとデータベース接続を閉じる（使わなかった書類番号の返却にデータベースを使う）
+        self.thread_pool.waitForDone()
+        if self._generator is not None:
+            self._generator.close()
         self.db_manager.close()
+        self.write_metrics()
         event.accept()
 
+    def write_metrics(self):
+        """環境変数 DOCGEN_METRICS_FILE が設定されていれば、処理時間などの集計をファイルに書き出す。"""
+        metrics_file = os.environ.get("DOCGEN_METRICS_FILE")
+        if not metrics_file:
+            return
+        try:
+            get_registry().write(metrics_file)
+        except OSError as e:
+            logging.error(f"Could not write metrics to {metrics_file}: {e}")
+
     def exit_process(self):
         """アプリケーションを終了する処理。"""
         # アプリケーションを終了する処理
         self.db_manager.close()
         self.close()
 
-if __name__ == "__main__":
-    # アプリケーションのエントリーポイント。自社情報がなければ設定ダイアログを表示。
-    db_manager = DatabaseManager()
-    company_info = db_manager.get_company_info()
-    if company_info:
-        print("自社情報:", company_info)
-    else:
-        print("自社情報が見つかりませんでした。")
+    def check_company_info(self):
+        """自社情報がなければ設定ダイアログを表示する（ウィンドウの表示後に呼ぶ）。"""
+        company_info = self.db_manager.get_company_info()
+        if company_info:
+            logging.info(f"自社情報: {company_info}")
+        else:
+            logging.info("自社情報が見つかりませんでした。")
+            self.open_settings_dialog()  # 自社情報がなければ設定ウィンドウを開く
 
+
+def on_first_window_shown(window, startup):
+    """最初のウィンドウが描画された後の処理。起動時間を報告し、時間のかかる準備を始める。"""
+    startup.mark("first_paint")
+    target_ms = int(os.environ.get("DOCGEN_STARTUP_TARGET_MS", STARTUP_TARGET_MS))
+    within_target = startup.report(target_ms)
+    if os.environ.get("DOCGEN_STARTUP_CHECK"):
+        # 起動時間の確認用。報告だけして終了する（目標時間を超えた場合は終了コード1）
+        QApplication.instance().exit(0 if within_target else 1)
+        return
+    QTimer.singleShot(0, window.warm_up)
+    window.check_company_info()
+
+
+if __name__ == "__main__":
+    # アプリケーションのエントリーポイント。データベースの確認などはウィンドウを表示してから行う。
+    startup = StartupTimer(STARTUP_STARTED)
+    startup.mark("imports")
     app = QApplication(sys.argv)
-    window = MainWindow()
-    if not db_manager.get_company_info():
-        window.open_settings_dialog()  # 自社情報がなければ設定ウィンドウを開く
+    startup.mark("application")
+    window = MainWindow(DatabaseManager())
+    startup.mark("window")
     window.show()
+    # イベントループが始まり、ウィンドウが描画された後に呼ばれる
+    QTimer.singleShot(0, lambda: on_first_window_shown(window, startup))
     sys.exit(app.exec_())
\ No newline at end of file
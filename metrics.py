@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# 所要時間のヒストグラムの区切り（秒）。テンプレートの複製（数ミリ秒）からLibreOfficeの起動（数秒）までを区別できるようにする
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# メトリクス名の接頭辞
+PREFIX = "docgen_"
+
+# 各メトリクスの説明（Prometheus形式の HELP 行）
+HELP = {
+    "stage_duration_seconds": "Time spent in each stage of document generation.",
+    "document_duration_seconds": "End-to-end time to generate one document.",
+    "documents_total": "Documents processed, by document type and result.",
+    "failures_total": "Document generation failures, by stage.",
+    "conversion_retries_total": "LibreOffice conversions retried after a failure, timeout or worker crash.",
+    "conversion_timeouts_total": "LibreOffice conversions killed because they exceeded the timeout.",
+    "conversion_rejections_total": "Conversions rejected because the circuit breaker was open.",
+    "dead_letters_total": "Failed document requests written to the dead-letter queue.",
+    "bundled_documents_total": "Documents concatenated into customer packets.",
+    "render_fallbacks_total": "Native PDF renderings that fell back to LibreOffice.",
+    "database_duration_seconds": "Time spent in database operations.",
+    "database_errors_total": "Database operations that raised an error.",
+    "startup_duration_seconds": "Time spent in each phase of GUI startup.",
+    "server_rejections_total": "Document requests rejected because the server queue was full.",
+}
+
+# 書き出せる形式
+METRIC_FORMATS = ("prometheus", "json")
+
+
+def _label_key(labels):
+    """ラベルの辞書を、集計用のキー（名前順のタプル）に変換する。"""
+    return tuple(sorted((str(name), str(value)) for name, value in (labels or {}).items()))
+
+
+def _escape(value):
+    """ラベルの値を Prometheus 形式の文字列としてエスケープする。"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    """ラベルを Prometheus 形式の {name="value",...} に変換する。"""
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    """数値を Prometheus 形式の文字列に変換する。"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        """区切りごとの件数と、値の合計・件数を保持するヒストグラム（1つのラベルの組み合わせ分）。"""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """値を1件記録する。"""
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """区切りごとの累積件数（Prometheus の le の値）を返す。"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append((float("inf"), self.count))
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """書類生成の件数・失敗数・段階ごとの所要時間を集計する。複数のスレッドから同時に記録できる。"""
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}  # 名前 → {ラベル: 値}
+        self._histograms = {}  # 名前 → {ラベル: Histogram}
+        self.started_at = time.time()
+
+    def increment(self, name, labels=None, amount=1):
+        """カウンターを amount だけ増やす。"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        """ヒストグラムに値を1件記録する。"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def measure(self, name, labels=None):
+        """with ブロックの所要時間をヒストグラムに記録する（例外で抜けた場合も記録する）。"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels)
+
+    @contextmanager
+    def stage(self, stage, document_type=None):
+        """書類生成の1段階の所要時間を記録する。例外で抜けた場合は失敗数にも数える。"""
+        labels = {"stage": stage}
+        if document_type:
+            labels["document_type"] = document_type
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment("failures_total", {"stage": stage})
+            raise
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - started, labels)
+
+    def dump(self):
+        """集計の生の値を、別のプロセスへ渡せる（pickle できる）形で返す。"""
+        with self._lock:
+            return {
+                "counters": {name: dict(series) for name, series in self._counters.items()},
+                "histograms": {
+                    name: {key: (list(histogram.counts), histogram.count, histogram.sum)
+                           for key, histogram in series.items()}
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def merge(self, dumped):
+        """dump で取り出した別の集計（子プロセスの集計など）を加算する。区切りは同じである必要がある。"""
+        with self._lock:
+            for name, series in dumped["counters"].items():
+                target = self._counters.setdefault(name, {})
+                for key, value in series.items():
+                    target[key] = target.get(key, 0) + value
+            for name, series in dumped["histograms"].items():
+                target = self._histograms.setdefault(name, {})
+                for key, (counts, count, total) in series.items():
+                    histogram = target.get(key)
+                    if histogram is None:
+                        histogram = target[key] = Histogram(self.buckets)
+                    histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                    histogram.count += count
+                    histogram.sum += total
+
+    def reset(self):
+        """集計をすべて破棄する。"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """現在の集計をJSONにできる辞書で返す。"""
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+                for name, series in sorted(self._counters.items())
+            }
+            histograms = {
+                name: [
+                    {
+                        "labels": dict(key),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                        "buckets": {_format_value(bound): count for bound, count in histogram.cumulative()},
+                    }
+                    for key, histogram in sorted(series.items())
+                ]
+                for name, series in sorted(self._histograms.items())
+            }
+        return {
+            "started_at": self.started_at,
+            "generated_at": time.time(),
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def to_prometheus(self):
+        """現在の集計を Prometheus のテキスト形式で返す。"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full_name = PREFIX + name
+                if name in HELP:
+                    lines.append(f"# HELP {full_name} {HELP[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_format_labels(key)} {_format_value(value)}")
+            for name, series in sorted(self._histograms.items()):
+                full_name = PREFIX + name
+                if name in HELP:
+                    lines.append(f"# HELP {full_name} {HELP[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in histogram.cumulative():
+                        le = (("le", _format_value(bound)),)
+                        lines.append(f"{full_name}_bucket{_format_labels(key, le)} {count}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {_format_value(histogram.sum)}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, metrics_format=None):
+        """集計をファイルに書き出す。形式を省略した場合は拡張子が .json ならJSON、それ以外は Prometheus 形式。
+
+        node_exporter の textfile collector が書きかけのファイルを読まないよう、別名で書いてから置き換える。
+        """
+        if metrics_format is None:
+            metrics_format = "json" if path.lower().endswith(".json") else "prometheus"
+        if metrics_format == "json":
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2) + "\n"
+        else:
+            text = self.to_prometheus()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        logging.debug(f"Metrics written to {path}")
+
+
+# プロセス全体で共有する既定の集計先
+_default_registry = MetricsRegistry()
+
+
+def get_registry():
+    """プロセス全体で共有する既定の集計先を返す。"""
+    return _default_registry
+
+
+def get_log_level(level=None):
+    """ログレベルを決める。未指定なら環境変数 DOCGEN_LOG_LEVEL（既定 INFO）を使う。"""
+    level = level or os.environ.get("DOCGEN_LOG_LEVEL") or "INFO"
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return value
@@ -0,0 +1,305 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+from tax_calculator import to_decimal
+from workspace import publishing_path
+
+# 既定の上限（環境変数で変更できる）
+DEFAULT_MAX_MEGABYTES = 1024
+DEFAULT_MAX_AGE_DAYS = 30
+
+# 表記ゆれ（"1" / 1 / "1.0" など）を吸収するため数値として正規化する明細の列
+NUMERIC_ITEM_FIELDS = ("quantity", "unit_price", "discount", "tax_rate")
+
+# キーの形式を変えたときに古いエントリを使わないようにするための版数
+KEY_VERSION = 2
+
+
+def _normalize(value):
+    """生成依頼の値を、JSONにできる比較用の値に変換する。"""
+    if dataclasses.is_dataclass(value):
+        return {field.name: _normalize(getattr(value, field.name)) for field in dataclasses.fields(value)}
+    if isinstance(value, datetime):
+        # 書類Noと保存先のファイル名は分単位のため、秒以下は区別しない
+        return value.strftime("%Y-%m-%dT%H:%M")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(element) for element in value]
+    if isinstance(value, dict):
+        return {str(key): _normalize(element) for key, element in value.items()}
+    return value
+
+
+def normalize_request(request):
+    """生成依頼を、出力に影響する内容だけを持つ正規化済みの辞書に変換する。"""
+    normalized = _normalize(request)
+    # 書類番号は内容が同じ書類を印刷し直しても変わらないよう、キーに含めずエントリと一緒に保存する
+    normalized.pop("document_number", None)
+    for item in normalized.get("items", ()):
+        for name in NUMERIC_ITEM_FIELDS:
+            try:
+                item[name] = format(to_decimal(item.get(name), name).normalize(), "f")
+            except ValueError:
+                # 不正な値は記入時にエラーになるため、そのままキーに含める
+                pass
+    return normalized
+
+
+class OutputCache:
+    def __init__(self, cache_dir, max_bytes=None, max_age=None):
+        """同じ内容の書類のPDFを再利用するための、内容のハッシュをキーにしたキャッシュ。
+
+        max_bytes を超えると最後に使われたのが古いものから、max_age（秒）を過ぎたものは使われていなくても削除する。
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes if max_bytes is not None else DEFAULT_MAX_MEGABYTES * 1024 * 1024
+        self.max_age = max_age if max_age is not None else DEFAULT_MAX_AGE_DAYS * 24 * 60 * 60
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = None  # キー → [サイズ, 作成日時, 最終使用日時]
+        self._total_bytes = 0
+        self._template_digests = {}
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _entry_path(self, key):
+        """キーに対応するPDFの保存先を返す（1つのディレクトリにファイルが集中しないよう先頭2文字で分ける）。"""
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pdf")
+
+    def _number_path(self, key):
+        """キーに対応するPDFに記入した書類番号の保存先を返す。"""
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_number(self, key):
+        """エントリのPDFに記入した書類番号を返す（番号のないPDFや読めない場合は空文字）。"""
+        try:
+            with open(self._number_path(key), encoding="utf-8") as f:
+                return str(json.load(f).get("document_number") or "")
+        except (OSError, ValueError, AttributeError):
+            return ""
+
+    def _load_index(self):
+        """キャッシュディレクトリを走査してエントリの一覧を作る（最初に使うときに1度だけ）。"""
+        if self._index is not None:
+            return
+        self._index = {}
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".pdf"):
+                    stat = entry.stat()
+                    self._index[entry.name[:-4]] = [stat.st_size, stat.st_mtime, stat.st_mtime]
+                    self._total_bytes += stat.st_size
+        # 前回から上限を変更した場合に備えて、読み込んだ時点で上限を適用する
+        self._evict()
+
+    def template_digest(self, template_path):
+        """テンプレートファイルの内容のハッシュを返す。ファイルが変わらない限り計算し直さない。"""
+        stat = os.stat(template_path)
+        version = (os.path.abspath(template_path), stat.st_mtime_ns, stat.st_size)
+        digest = self._template_digests.get(version)
+        if digest is None:
+            with open(template_path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            self._template_digests[version] = digest
+        return digest
+
+    def make_key(self, request, template_path, company_info, options=None):
+        """生成依頼・テンプレートの内容・自社情報・生成オプションからキャッシュのキーを作る。"""
+        material = {
+            "version": KEY_VERSION,
+            "request": normalize_request(request),
+            "template": self.template_digest(template_path),
+            "company_info": _normalize(dict(company_info or {})),
+            "options": _normalize(options or {}),
+        }
+        encoded = json.dumps(material, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def lookup(self, key, document_number=""):
+        """キャッシュにあれば、そのPDFに記入した書類番号（番号のないPDFは空文字）を返す。なければ None を返す。
+
+        document_number を指定した場合、別の番号を記入したPDFはないものとして扱う。
+        """
+        with self._lock:
+            self._load_index()
+            entry = self._index.get(key)
+            if entry is not None and time.time() - entry[1] > self.max_age:
+                self._remove(key)
+                entry = None
+            number = self._read_number(key) if entry is not None else None
+            if number is None or (document_number and number != document_number):
+                self.misses += 1
+                return None
+            return number
+
+    def fetch(self, key, destination):
+        """キャッシュにあれば destination にハードリンク（できなければコピー）して True を返す。
+
+        別名で配置してから置き換え、コピー途中のファイルを保存先の名前で見せない。
+        """
+        path = self._entry_path(key)
+        with self._lock:
+            self._load_index()
+            entry = self._index.get(key)
+            if entry is not None and time.time() - entry[1] > self.max_age:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False
+            entry[2] = time.time()
+        temp_path = publishing_path(destination)
+        try:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            _link_or_copy(path, temp_path)
+            os.replace(temp_path, destination)
+            # 保存先が既に同じファイルへのハードリンクなら置き換えは行われず、別名のリンクが残る
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        except FileNotFoundError:
+            # 外部から削除されていた場合はミスとして扱う
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return False
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self.hits += 1
+        logging.debug(f"Output cache hit, reused PDF: {destination}")
+        return True
+
+    def store(self, key, pdf_file, document_number=""):
+        """生成したPDFを、記入した書類番号と一緒にキャッシュに登録し、必要なら古いエントリを削除する。"""
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 別名で用意してから置き換え、読み取り中の不完全なファイルを見せない
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            self._write_number(key, document_number)
+            _link_or_copy(pdf_file, temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not store PDF in the output cache: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            self._load_index()
+            self._forget(key)
+            self._index[key] = [size, now, now]
+            self._total_bytes += size
+            self.stores += 1
+            self._evict()
+
+    def _write_number(self, key, document_number):
+        """エントリのPDFに記入した書類番号を保存する（番号がなければ保存済みのものを削除する）。"""
+        number_path = self._number_path(key)
+        if not document_number:
+            if os.path.exists(number_path):
+                os.remove(number_path)
+            return
+        temp_path = f"{number_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"document_number": document_number}, f, ensure_ascii=False)
+            os.replace(temp_path, number_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def evict(self):
+        """期限切れのエントリと、上限を超えた分の古いエントリを削除する。"""
+        with self._lock:
+            self._load_index()
+            self._evict()
+
+    def _evict(self):
+        """evict の本体（ロックを取得した状態で呼ぶ）。"""
+        now = time.time()
+        for key in [key for key, entry in self._index.items() if now - entry[1] > self.max_age]:
+            self._remove(key)
+        if self._total_bytes > self.max_bytes:
+            # 最後に使われた日時が古い順に削除する
+            for key, _ in sorted(self._index.items(), key=lambda pair: pair[1][2]):
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._remove(key)
+
+    def _forget(self, key):
+        """一覧からエントリを外す。"""
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[0]
+
+    def _remove(self, key):
+        """エントリを一覧とディスクから削除する（ハードリンクした出力先のPDFは残る）。"""
+        self._forget(key)
+        for path in (self._entry_path(key), self._number_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.evictions += 1
+
+    def clear(self):
+        """キャッシュをすべて削除する。"""
+        with self._lock:
+            self._load_index()
+            for key in list(self._index):
+                self._remove(key)
+
+    def stats(self):
+        """ヒット数・ミス数などの統計を辞書で返す。"""
+        with self._lock:
+            self._load_index()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _link_or_copy(source, destination):
+    """ハードリンクを作成する。別のドライブなどでリンクできなければコピーする。"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def create_output_cache(cache_dir=None, max_megabytes=None, max_age_days=None):
+    """設定に応じて出力キャッシュを作成する。未指定なら環境変数 DOCGEN_OUTPUT_CACHE を使い、それもなければ None。"""
+    cache_dir = cache_dir or os.environ.get("DOCGEN_OUTPUT_CACHE")
+    if not cache_dir:
+        return None
+    if max_megabytes is None:
+        max_megabytes = float(os.environ.get("DOCGEN_OUTPUT_CACHE_MAX_MB", DEFAULT_MAX_MEGABYTES))
+    if max_age_days is None:
+        max_age_days = float(os.environ.get("DOCGEN_OUTPUT_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS))
+    return OutputCache(cache_dir, max_bytes=int(max_megabytes * 1024 * 1024), max_age=max_age_days * 24 * 60 * 60)
@@ -0,0 +1,307 @@
+"""取引先・月ごとに、請求書・領収書などのPDFをしおり付きの1つのPDF（送付用のまとめPDF）に結合する。
+
+元のPDFは1件ずつ読み込み、ページとページから参照されるオブジェクトをその場でまとめPDFに書き出して手放すため、
+数百件をまとめてもメモリに残るのは書き出し位置とページ・しおりの一覧だけで済む。pypdf が必要（任意の依存）。
+"""
+import copy
+import logging
+import os
+import uuid
+from collections import deque
+
+from document_request import DEFAULT_ISSUER_ID
+
+try:
+    from pypdf import PdfReader
+    from pypdf.generic import (ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject,
+                               create_string_object)
+except ImportError:
+    PdfReader = None
+
+# 既定でまとめる書類の種別（まとめPDF内もこの順に並べる）
+BUNDLE_TYPES = ("請求書", "領収書")
+
+# ページをコピーするときに引き継がない項目（元のページツリー・構造ツリーへの参照）
+SKIPPED_PAGE_KEYS = ("/Parent", "/StructParents", "/B")
+
+
+def is_available():
+    """pypdf が利用できるかを返す。"""
+    return PdfReader is not None
+
+
+def _ref(number):
+    """まとめPDFのオブジェクト番号への参照を作る。"""
+    return IndirectObject(number, 0, None)
+
+
+class StreamingPdfWriter:
+    def __init__(self, path):
+        """PDFを1件ずつ追加し、ページを順に書き出していく結合用のライター。
+
+        書き出し中は同じディレクトリの一時ファイルに書き、close で保存先に置き換える（途中で失敗しても
+        既存のまとめPDFは壊れない）。with ブロックで使うと、例外で抜けた場合は一時ファイルを削除する。
+        """
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._temp_path = os.path.join(os.path.dirname(self.path),
+                                       f".{os.path.basename(self.path)}.{uuid.uuid4().hex}.tmp")
+        self._file = open(self._temp_path, "wb")
+        self._offsets = []  # オブジェクト番号 - 1 → ファイル内の位置
+        self._pages = []  # ページのオブジェクト番号（まとめPDF内の順）
+        self._outline = []  # (グループ, 見出し, 最初のページのオブジェクト番号)
+        self._catalog = self._allocate()
+        self._page_tree = self._allocate()
+        self._file.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def page_count(self):
+        """これまでに追加したページ数。"""
+        return len(self._pages)
+
+    def _allocate(self):
+        """まとめPDFのオブジェクト番号を1つ割り当てる。"""
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _write(self, number, obj):
+        """オブジェクトを書き出す。"""
+        self._offsets[number - 1] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n".encode("ascii"))
+        obj.write_to_stream(self._file)
+        self._file.write(b"\nendobj\n")
+
+    def add_document(self, path, title, group=None):
+        """PDFのすべてのページを末尾に追加し、最初のページにしおり（group の下の title）を付ける。追加したページ数を返す。"""
+        reader = PdfReader(path)
+        if reader.is_encrypted:
+            raise ValueError(f"Encrypted PDF cannot be bundled: {path}")
+        numbers = {}  # 元のPDFの (オブジェクト番号, 世代) → まとめPDFのオブジェクト番号
+        pending = deque()
+
+        def copy_object(obj):
+            """参照先をまとめPDFのオブジェクト番号に付け替えた複製を作る（参照先は書き出し待ちに加える）。"""
+            if isinstance(obj, IndirectObject):
+                key = (obj.idnum, obj.generation)
+                number = numbers.get(key)
+                if number is None:
+                    number = numbers[key] = self._allocate()
+                    pending.append((number, obj))
+                return _ref(number)
+            if isinstance(obj, DictionaryObject):
+                # ストリームは圧縮済みのデータをそのまま引き継ぐ（展開・再圧縮しない）
+                copied = copy.copy(obj)
+                for key, value in obj.items():
+                    copied[key] = copy_object(value)
+                return copied
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(copy_object(value) for value in obj)
+            return obj
+
+        # 注釈のリンク先などからページが参照されても、ページ自体は下で1度だけ書き出す
+        pages = []
+        for page in reader.pages:
+            reference = page.indirect_reference
+            number = numbers[(reference.idnum, reference.generation)] = self._allocate()
+            pages.append((number, page))
+        for number, page in pages:
+            copied = DictionaryObject()
+            for key, value in page.items():
+                if key not in SKIPPED_PAGE_KEYS:
+                    copied[NameObject(key)] = copy_object(value)
+            copied[NameObject("/Parent")] = _ref(self._page_tree)
+            self._write(number, copied)
+            while pending:
+                referenced, reference = pending.popleft()
+                self._write(referenced, copy_object(reference.get_object()))
+
+        if pages:
+            self._pages.extend(number for number, _ in pages)
+            self._outline.append((group, title, pages[0][0]))
+        return len(pages)
+
+    def _outline_item(self, number, title, page, parent, previous, following):
+        """しおりの項目を作る。"""
+        item = DictionaryObject({
+            NameObject("/Title"): create_string_object(title),
+            NameObject("/Parent"): _ref(parent),
+            NameObject("/Dest"): ArrayObject([_ref(page), NameObject("/Fit")]),
+        })
+        if previous is not None:
+            item[NameObject("/Prev")] = _ref(previous)
+        if following is not None:
+            item[NameObject("/Next")] = _ref(following)
+        return item
+
+    def _write_outline_level(self, parent, entries):
+        """しおりの1階層（(見出し, ページ, 子の項目のリスト) のリスト）を書き出し、(最初, 最後, 表示される項目数) を返す。"""
+        numbers = [self._allocate() for _ in entries]
+        visible = len(entries)
+        for index, (number, (title, page, children)) in enumerate(zip(numbers, entries)):
+            item = self._outline_item(number, title, page, parent,
+                                      numbers[index - 1] if index > 0 else None,
+                                      numbers[index + 1] if index + 1 < len(numbers) else None)
+            if children:
+                first, last, count = self._write_outline_level(number, children)
+                item[NameObject("/First")] = _ref(first)
+                item[NameObject("/Last")] = _ref(last)
+                item[NameObject("/Count")] = NumberObject(count)
+                visible += count
+            self._write(number, item)
+        return numbers[0], numbers[-1], visible
+
+    def _write_outline(self):
+        """しおりを書き出し、しおりのルートのオブジェクト番号を返す（しおりがなければ None）。
+
+        グループを指定した書類はグループ（最初に現れた順）の下に、指定しない書類は最上位に並べる。
+        """
+        if not self._outline:
+            return None
+        entries = []
+        groups = {}
+        for group, title, page in self._outline:
+            if group is None:
+                entries.append((title, page, None))
+                continue
+            if group not in groups:
+                groups[group] = []
+                entries.append((group, page, groups[group]))
+            groups[group].append((title, page, None))
+        root = self._allocate()
+        first, last, count = self._write_outline_level(root, entries)
+        self._write(root, DictionaryObject({
+            NameObject("/Type"): NameObject("/Outlines"),
+            NameObject("/First"): _ref(first),
+            NameObject("/Last"): _ref(last),
+            NameObject("/Count"): NumberObject(count),
+        }))
+        return root
+
+    def close(self):
+        """ページツリー・しおり・相互参照表を書き出し、一時ファイルを保存先に置き換える。"""
+        self._write(self._page_tree, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(_ref(number) for number in self._pages),
+            NameObject("/Count"): NumberObject(len(self._pages)),
+        }))
+        catalog = DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): _ref(self._page_tree),
+        })
+        outline = self._write_outline()
+        if outline is not None:
+            catalog[NameObject("/Outlines")] = _ref(outline)
+            catalog[NameObject("/PageMode")] = NameObject("/UseOutlines")
+        self._write(self._catalog, catalog)
+
+        xref = self._file.tell()
+        lines = [f"xref\n0 {len(self._offsets) + 1}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{offset:010d} 00000 n \n" for offset in self._offsets)
+        lines.append(f"trailer\n<< /Size {len(self._offsets) + 1} /Root {self._catalog} 0 R >>\n"
+                     f"startxref\n{xref}\n%%EOF\n")
+        self._file.write("".join(lines).encode("ascii"))
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """書き出しを中止し、一時ファイルを削除する。"""
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def entry_from_request(request, pdf_path):
+    """生成した書類を、まとめる対象の一覧の項目（発行台帳の行と同じ項目名の辞書）にする。"""
+    return {
+        "document_type": request.document_type,
+        "customer_name": request.company_name,
+        "issue_date": request.issued_at.date().isoformat(),
+        "issuer_id": request.issuer or DEFAULT_ISSUER_ID,
+        # 生成結果には採番後の書類番号が含まれないため、ファイル名（書類番号）から取る
+        "document_number": os.path.splitext(os.path.basename(pdf_path))[0],
+        "subject": request.subject,
+        "output_path": pdf_path,
+    }
+
+
+def group_documents(entries, document_types=BUNDLE_TYPES):
+    """書類の一覧を (発行元, 取引先, 発行年月 "yyyy-MM") ごとに分け、種別・発行日・書類番号の順に並べる。
+
+    同じファイルが複数回含まれる場合（再発行・出力キャッシュの再利用など）は1度だけ含める。
+    """
+    groups = {}
+    seen = set()
+    for entry in entries:
+        if entry["document_type"] not in document_types:
+            continue
+        path = os.path.abspath(entry["output_path"])
+        if path in seen:
+            continue
+        seen.add(path)
+        key = (entry.get("issuer_id") or DEFAULT_ISSUER_ID, entry["customer_name"], entry["issue_date"][:7])
+        groups.setdefault(key, []).append(entry)
+    for documents in groups.values():
+        documents.sort(key=lambda entry: (document_types.index(entry["document_type"]), entry["issue_date"],
+                                          entry.get("document_number") or "", entry["output_path"]))
+    return groups
+
+
+def get_bundle_path(bundle_dir, issuer_id, customer_name, month):
+    """まとめPDFの保存先（<bundle_dir>/[<発行元>/]<yyyy>/<MM>/<取引先>.pdf）を返す。既定の発行元はディレクトリを分けない。"""
+    year, month_number = month.split("-")
+    if issuer_id and issuer_id != DEFAULT_ISSUER_ID:
+        bundle_dir = os.path.join(bundle_dir, issuer_id)
+    return os.path.join(bundle_dir, year, month_number, f"{customer_name}.pdf")
+
+
+def bookmark_title(entry):
+    """書類のしおりの見出し（書類番号・発行日と件名）を返す。"""
+    label = entry.get("document_number") or entry["issue_date"]
+    subject = entry.get("subject")
+    return f"{label} {subject}" if subject else label
+
+
+def bundle_documents(entries, bundle_dir, document_types=BUNDLE_TYPES, metrics=None):
+    """書類を取引先・月ごとにまとめPDFに結合し、(保存先, 書類数, ページ数, エラー) のリストを返す。
+
+    1件でも読み込めない書類があるまとめPDFは作成せず（既存のものは残し）、エラーを返す。
+    """
+    if not is_available():
+        raise RuntimeError("pypdf is not installed; PDFs cannot be bundled.")
+    results = []
+    for (issuer_id, customer_name, month), documents in group_documents(entries, document_types).items():
+        bundle_path = get_bundle_path(bundle_dir, issuer_id, customer_name, month)
+        try:
+            if metrics is not None:
+                with metrics.stage("bundle"):
+                    pages = _write_bundle(bundle_path, documents)
+                metrics.increment("bundled_documents_total", amount=len(documents))
+            else:
+                pages = _write_bundle(bundle_path, documents)
+        except Exception as e:
+            logging.error(f"Could not bundle {len(documents)} documents into {bundle_path}: {e}")
+            results.append((bundle_path, len(documents), 0, e))
+            continue
+        logging.info(f"Bundled {len(documents)} documents ({pages} pages): {bundle_path}")
+        results.append((bundle_path, len(documents), pages, None))
+    return results
+
+
+def _write_bundle(bundle_path, documents):
+    """1つのまとめPDFを書き出し、ページ数を返す。"""
+    with StreamingPdfWriter(bundle_path) as writer:
+        for entry in documents:
+            try:
+                writer.add_document(entry["output_path"], bookmark_title(entry), entry["document_type"])
+            except Exception as e:
+                raise RuntimeError(f"Could not read {entry['output_path']}: {e}") from e
+    return writer.page_count
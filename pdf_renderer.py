@@ -0,0 +1,543 @@
+"""LibreOfficeを使わず、記入済みのテンプレートのシートを直接PDFに描画するレンダラー。
+
+セルの位置・結合・罫線・塗りつぶし・フォントサイズ・表示形式はテンプレートのものをそのまま使うため、
+テンプレートを編集すれば描画結果にも反映される。reportlab が必要（任意の依存）。
+"""
+import colorsys
+import logging
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from datetime import date, datetime
+from decimal import Decimal
+
+from openpyxl.utils import get_column_letter, range_boundaries
+
+try:
+    from reportlab.lib.pagesizes import A3, A4, A5, B4, B5, LETTER, LEGAL
+    from reportlab.lib.utils import simpleSplit
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+RENDERERS = ("libreoffice", "native")
+
+# 埋め込みに使う日本語フォントの候補（TrueType のみ。先に見つかったものを使う）
+FONT_CANDIDATES = (
+    r"C:\Windows\Fonts\YuGothM.ttc",
+    r"C:\Windows\Fonts\meiryo.ttc",
+    r"C:\Windows\Fonts\msgothic.ttc",
+    "/usr/share/fonts/opentype/ipaexfont-gothic/ipaexg.ttf",
+    "/usr/share/fonts/truetype/ipaexfont-gothic/ipaexg.ttf",
+    "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf",
+    "/Library/Fonts/ipaexg.ttf",
+)
+
+# フォントが見つからない場合に使う reportlab 組み込みのCIDフォント（埋め込まれない）
+FALLBACK_CID_FONT = "HeiseiKakuGo-W5"
+
+# Excel の用紙サイズ番号と用紙の対応（よく使うもののみ）
+PAPER_SIZES = {1: LETTER, 5: LEGAL, 8: A3, 9: A4, 11: A5, 12: B4, 13: B5} if canvas else {}
+
+# 罫線の種類ごとの線幅（pt）と破線パターン
+BORDER_STYLES = {
+    "hair": (0.25, None),
+    "thin": (0.5, None),
+    "medium": (1.0, None),
+    "thick": (1.5, None),
+    "double": (0.5, None),
+    "dotted": (0.5, (1, 1)),
+    "dashed": (0.5, (3, 2)),
+    "mediumDashed": (1.0, (3, 2)),
+    "dashDot": (0.5, (3, 1, 1, 1)),
+    "mediumDashDot": (1.0, (3, 1, 1, 1)),
+    "dashDotDot": (0.5, (3, 1, 1, 1, 1, 1)),
+    "mediumDashDotDot": (1.0, (3, 1, 1, 1, 1, 1)),
+    "slantDashDot": (1.0, (3, 1, 1, 1)),
+}
+
+# 列幅・行高の既定値（Excel の標準）と、文字数単位の列幅をptに換算する係数
+DEFAULT_COLUMN_WIDTH = 8.43
+DEFAULT_ROW_HEIGHT = 15.0
+POINTS_PER_CHARACTER = 5.25
+CELL_PADDING = 2.0
+
+_THEME_NAMESPACE = {"a": "http://schemas.openxmlformats.org/drawingml/2006/main"}
+# セルの色の theme 番号は lt1 / dk1 / lt2 / dk2 の順に並ぶ
+_THEME_ORDER = ("lt1", "dk1", "lt2", "dk2", "accent1", "accent2", "accent3", "accent4", "accent5", "accent6",
+                "hlink", "folHlink")
+
+_fonts_lock = threading.Lock()
+_registered_fonts = {}
+
+
+class RenderError(Exception):
+    """PDFの直接描画に失敗したことを表す例外。"""
+
+
+def is_available():
+    """reportlab が利用できるかを返す。"""
+    return canvas is not None
+
+
+def get_renderer_name(renderer=None):
+    """使用するレンダラー名を決める。未指定なら環境変数 DOCGEN_RENDERER（既定 "libreoffice"）を使う。"""
+    renderer = renderer or os.environ.get("DOCGEN_RENDERER", "libreoffice")
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unknown renderer: {renderer} (choose from {', '.join(RENDERERS)})")
+    return renderer
+
+
+def find_font():
+    """埋め込みに使う日本語TrueTypeフォントを探す。環境変数 DOCGEN_PDF_FONT を優先する。"""
+    configured = os.environ.get("DOCGEN_PDF_FONT")
+    if configured:
+        return configured
+    for candidate in FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def register_font(font_path=None):
+    """フォントを reportlab に登録してフォント名を返す。登録はプロセス内で1度だけ行う。"""
+    font_path = font_path or find_font()
+    with _fonts_lock:
+        name = _registered_fonts.get(font_path)
+        if name is not None:
+            return name
+        if font_path:
+            name = f"DocGen-{len(_registered_fonts)}"
+            # TrueType フォントは使用した文字だけをサブセットとして埋め込む
+            pdfmetrics.registerFont(TTFont(name, font_path, subfontIndex=0))
+            logging.info(f"PDF font registered: {font_path}")
+        else:
+            name = FALLBACK_CID_FONT
+            pdfmetrics.registerFont(UnicodeCIDFont(name))
+            logging.warning(f"Japanese TrueType font not found; using non-embedded {name}. Set DOCGEN_PDF_FONT.")
+        _registered_fonts[font_path] = name
+        return name
+
+
+def load_theme_colors(workbook):
+    """ブックのテーマから、theme 番号順の色（"RRGGBB"）のリストを返す。"""
+    colors = []
+    if not workbook.loaded_theme:
+        return colors
+    scheme = ET.fromstring(workbook.loaded_theme).find("a:themeElements/a:clrScheme", _THEME_NAMESPACE)
+    if scheme is None:
+        return colors
+    for name in _THEME_ORDER:
+        element = scheme.find(f"a:{name}", _THEME_NAMESPACE)
+        value = "000000"
+        if element is not None and len(element):
+            color = element[0]
+            value = color.get("lastClr") or color.get("val") or value
+        colors.append(value)
+    return colors
+
+
+def _apply_tint(rgb, tint):
+    """Excel の tint（明るさの補正）を色に適用する。"""
+    red, green, blue = (int(rgb[index:index + 2], 16) / 255 for index in (0, 2, 4))
+    hue, lightness, saturation = colorsys.rgb_to_hls(red, green, blue)
+    if tint < 0:
+        lightness *= 1 + tint
+    else:
+        lightness = lightness * (1 - tint) + tint
+    return colorsys.hls_to_rgb(hue, lightness, saturation)
+
+
+def resolve_color(color, theme_colors, default=None):
+    """openpyxl の Color を (r, g, b)（0〜1）に変換する。解決できなければ default を返す。"""
+    if color is None:
+        return default
+    rgb = None
+    if color.type == "rgb" and isinstance(color.rgb, str):
+        rgb = color.rgb[-6:]
+    elif color.type == "theme" and color.theme is not None and color.theme < len(theme_colors):
+        rgb = theme_colors[color.theme]
+    elif color.type == "indexed" and color.indexed == 64:
+        # システムの前景色
+        rgb = "000000"
+    if rgb is None:
+        return default
+    return _apply_tint(rgb, color.tint or 0)
+
+
+def _split_sections(number_format):
+    """表示形式を ; で区切られたセクションに分ける（引用符内の ; は区切りとみなさない）。"""
+    sections = [""]
+    quoted = False
+    for char in number_format:
+        if char == '"':
+            quoted = not quoted
+        if char == ";" and not quoted:
+            sections.append("")
+        else:
+            sections[-1] += char
+    return sections
+
+
+def format_number(value, number_format):
+    """数値を Excel の表示形式（よく使う書式のみ対応）で文字列にし、(文字列, 赤字か) を返す。"""
+    if not number_format or number_format == "General":
+        return _general(value), False
+    sections = _split_sections(number_format)
+    section = sections[0]
+    if value < 0 and len(sections) > 1:
+        section = sections[1]
+        value = -value
+    red = "[Red]" in section
+    section = re.sub(r"\[[^\]]*\]", "", section)
+
+    # 数値部分（0 # , . %）と前後の文字列を分ける
+    output = []
+    number_done = False
+    index = 0
+    while index < len(section):
+        char = section[index]
+        if char == '"':
+            end = section.index('"', index + 1)
+            output.append(section[index + 1:end])
+            index = end + 1
+            continue
+        if char == "\\":
+            output.append(section[index + 1:index + 2])
+            index += 2
+            continue
+        if char in "_*":
+            # 文字幅分の空白・繰り返し文字は空白1つで代用する
+            output.append(" ")
+            index += 2
+            continue
+        if char in "0#,." and not number_done:
+            end = index
+            while end < len(section) and section[end] in "0#,.":
+                end += 1
+            pattern = section[index:end]
+            percent = "%" in section[end:]
+            number = Decimal(value) * 100 if percent else Decimal(value)
+            decimals = len(pattern.split(".")[1]) if "." in pattern else 0
+            text = f"{number:,.{decimals}f}" if "," in pattern else f"{number:.{decimals}f}"
+            output.append(text)
+            number_done = True
+            index = end
+            continue
+        output.append(char)
+        index += 1
+    return "".join(output), red
+
+
+def _general(value):
+    """「標準」の表示形式で数値を文字列にする。"""
+    if isinstance(value, Decimal):
+        text = format(value.normalize(), "f")
+        return text
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _excel_date_format(text_format):
+    """TEXT関数の日付書式（yyyy/MM/dd など）を strftime の書式に変換する。"""
+    tokens = re.split(r"(yyyy|yy|mm|dd|hh|ss|m|d|h)", text_format, flags=re.IGNORECASE)
+    result = []
+    previous = None
+    for token in tokens:
+        lower = token.lower()
+        if lower in ("mm", "m"):
+            # 時の直後の mm は分、それ以外は月
+            result.append("%M" if previous == "hh" else "%m")
+        elif lower in ("yyyy",):
+            result.append("%Y")
+        elif lower == "yy":
+            result.append("%y")
+        elif lower in ("dd", "d"):
+            result.append("%d")
+        elif lower in ("hh", "h"):
+            result.append("%H")
+            lower = "hh"
+        elif lower == "ss":
+            result.append("%S")
+        else:
+            result.append(token.replace("%", "%%"))
+            continue
+        previous = lower
+    return "".join(result)
+
+
+class NativePdfRenderer:
+    def __init__(self, font_path=None):
+        """記入済みのシートを、印刷範囲・ページ設定に従ってPDFに直接描画するレンダラー。"""
+        if not is_available():
+            raise RenderError("reportlab is not installed.")
+        self.font_name = register_font(font_path)
+        self._theme_colors = {}
+
+    def render(self, sheet, output_file, issued_at=None):
+        """シートの印刷範囲をPDFとして output_file に書き出す。"""
+        try:
+            self._render(sheet, output_file, issued_at or datetime.now())
+        except RenderError:
+            raise
+        except Exception as e:
+            raise RenderError(f"Failed to render {output_file}: {e}") from e
+        return output_file
+
+    def _render(self, sheet, output_file, issued_at):
+        """描画の本体。"""
+        min_col, min_row, max_col, max_row = self._print_range(sheet)
+        columns = [self._column_width(sheet, column) for column in range(min_col, max_col + 1)]
+        rows = [self._row_height(sheet, row) for row in range(min_row, max_row + 1)]
+        # 各列・各行の左端・上端の位置（シート上の座標、pt）
+        xs = [0.0]
+        for width in columns:
+            xs.append(xs[-1] + width)
+        ys = [0.0]
+        for height in rows:
+            ys.append(ys[-1] + height)
+
+        page_width, page_height = PAPER_SIZES.get(sheet.page_setup.paperSize or 9, A4)
+        if sheet.page_setup.orientation == "landscape":
+            page_width, page_height = page_height, page_width
+        margins = sheet.page_margins
+        left, right, top, bottom = (margins.left * 72, margins.right * 72, margins.top * 72, margins.bottom * 72)
+        printable_width = page_width - left - right
+        printable_height = page_height - top - bottom
+        # 1ページに収まるよう縮小する（拡大はしない）
+        scale = min(1.0, printable_width / xs[-1], printable_height / ys[-1])
+        if not sheet.sheet_properties.pageSetUpPr or not sheet.sheet_properties.pageSetUpPr.fitToPage:
+            scale = min(scale, (sheet.page_setup.scale or 100) / 100)
+        origin_x = left
+        if sheet.print_options.horizontalCentered:
+            origin_x += (printable_width - xs[-1] * scale) / 2
+        origin_y = page_height - top
+
+        pdf = canvas.Canvas(output_file, pagesize=(page_width, page_height))
+        pdf.setTitle(sheet.title)
+        pdf.translate(origin_x, origin_y)
+        pdf.scale(scale, -scale)  # 以降はシートの座標（左上原点、下向き）で描画する
+
+        theme_colors = self._get_theme_colors(sheet.parent)
+        merged = {}
+        covered = set()
+        # 結合セル内の各セルについて、結合範囲の外周に接する辺（上・下・左・右）
+        edges_of = {}
+        for merged_range in sheet.merged_cells.ranges:
+            merged[(merged_range.min_row, merged_range.min_col)] = (merged_range.max_row, merged_range.max_col)
+            for row in range(merged_range.min_row, merged_range.max_row + 1):
+                for column in range(merged_range.min_col, merged_range.max_col + 1):
+                    if (row, column) != (merged_range.min_row, merged_range.min_col):
+                        covered.add((row, column))
+                    edges_of[(row, column)] = (row == merged_range.min_row, row == merged_range.max_row,
+                                               column == merged_range.min_col, column == merged_range.max_col)
+
+        def rect_of(row, column, last_row, last_column):
+            """セル範囲のシート上の矩形 (x, y, 幅, 高さ) を返す。印刷範囲外は切り詰める。"""
+            last_row = min(last_row, max_row)
+            last_column = min(last_column, max_col)
+            x = xs[column - min_col]
+            y = ys[row - min_row]
+            return x, y, xs[last_column - min_col + 1] - x, ys[last_row - min_row + 1] - y
+
+        cells = [(row, column, sheet.cell(row, column))
+                 for row in range(min_row, max_row + 1) for column in range(min_col, max_col + 1)]
+
+        # 塗りつぶし → 罫線 → 文字の順に描く
+        for row, column, cell in cells:
+            if (row, column) in covered or cell.fill is None or cell.fill.fill_type != "solid":
+                continue
+            color = resolve_color(cell.fill.fgColor, theme_colors)
+            if color is None:
+                continue
+            last_row, last_column = merged.get((row, column), (row, column))
+            pdf.setFillColorRGB(*color)
+            pdf.rect(*rect_of(row, column, last_row, last_column), stroke=0, fill=1)
+
+        for row, column, cell in cells:
+            # 結合セルの内側の罫線は Excel と同じく描かない
+            self._draw_borders(pdf, cell, rect_of(row, column, row, column), theme_colors,
+                               edges_of.get((row, column), (True, True, True, True)))
+
+        for row, column, cell in cells:
+            if (row, column) in covered:
+                continue
+            text = self._display_text(sheet, cell, issued_at)
+            if not text:
+                continue
+            last_row, last_column = merged.get((row, column), (row, column))
+            if cell.alignment.horizontal == "centerContinuous":
+                # 右隣の空欄で同じく「選択範囲内で中央」のセルまでを1つの範囲とみなす
+                while last_column < max_col:
+                    neighbour = sheet.cell(row, last_column + 1)
+                    if neighbour.value is not None or neighbour.alignment.horizontal != "centerContinuous":
+                        break
+                    last_column += 1
+            self._draw_text(pdf, cell, text[0], text[1], rect_of(row, column, last_row, last_column), theme_colors)
+
+        pdf.showPage()
+        pdf.save()
+
+    def _get_theme_colors(self, workbook):
+        """ブックごとのテーマ色を返す（テンプレートごとに1度だけ解析する）。"""
+        key = workbook.loaded_theme
+        colors = self._theme_colors.get(key)
+        if colors is None:
+            colors = self._theme_colors[key] = load_theme_colors(workbook)
+        return colors
+
+    def _print_range(self, sheet):
+        """印刷範囲（min_col, min_row, max_col, max_row）を返す。"""
+        if sheet.print_area:
+            return range_boundaries(sheet.print_area.split(",")[0].split("!")[-1])
+        return 1, 1, sheet.max_column, sheet.max_row
+
+    def _column_width(self, sheet, column):
+        """列幅をptで返す。非表示の列は0。"""
+        letter = get_column_letter(column)
+        dimension = sheet.column_dimensions.get(letter)
+        if dimension is None:
+            # 複数列をまとめた設定（min〜max）に含まれるか調べる
+            for candidate in sheet.column_dimensions.values():
+                if candidate.min and candidate.max and candidate.min <= column <= candidate.max:
+                    dimension = candidate
+                    break
+        if dimension is not None and dimension.hidden:
+            return 0.0
+        width = dimension.width if dimension is not None and dimension.width else None
+        if width is None:
+            width = sheet.sheet_format.defaultColWidth or DEFAULT_COLUMN_WIDTH
+        return width * POINTS_PER_CHARACTER + CELL_PADDING * 2
+
+    def _row_height(self, sheet, row):
+        """行の高さをptで返す。非表示の行は0。"""
+        dimension = sheet.row_dimensions.get(row)
+        if dimension is not None and dimension.hidden:
+            return 0.0
+        if dimension is not None and dimension.height:
+            return dimension.height
+        return sheet.sheet_format.defaultRowHeight or DEFAULT_ROW_HEIGHT
+
+    def _value(self, sheet, cell, issued_at, depth=0):
+        """セルの値を返す。数式はテンプレートで使う簡単なものだけ評価する。"""
+        value = cell.value
+        if isinstance(value, str) and value.startswith("="):
+            return self._evaluate(sheet, value[1:], issued_at, depth)
+        return value
+
+    def _display_text(self, sheet, cell, issued_at):
+        """セルの表示文字列と赤字かどうかを返す。"""
+        value = self._value(sheet, cell, issued_at)
+        if value is None or value == "":
+            return None
+        if isinstance(value, bool):
+            return ("TRUE" if value else "FALSE"), False
+        if isinstance(value, (int, float, Decimal)):
+            return format_number(value, cell.number_format)
+        if isinstance(value, (datetime, date)):
+            return value.strftime("%Y/%m/%d"), False
+        return str(value), False
+
+    def _evaluate(self, sheet, formula, issued_at, depth):
+        """=TEXT(NOW(),"書式") / =TEXT(TODAY(),"書式") / =セル参照 の形の数式を評価する。"""
+        match = re.fullmatch(r'TEXT\((NOW|TODAY)\(\),"([^"]*)"\)', formula.replace(" ", ""), flags=re.IGNORECASE)
+        if match:
+            return issued_at.strftime(_excel_date_format(match.group(2)))
+        match = re.fullmatch(r"\$?([A-Z]{1,3})\$?(\d+)", formula)
+        if match and depth < 10:
+            return self._value(sheet, sheet[f"{match.group(1)}{match.group(2)}"], issued_at, depth + 1)
+        logging.debug(f"Formula not supported by the native renderer, left blank: ={formula}")
+        return None
+
+    def _draw_borders(self, pdf, cell, rect, theme_colors, visible_edges):
+        """セルの罫線を描く。visible_edges は上・下・左・右の辺を描くかどうか。"""
+        x, y, width, height = rect
+        if width <= 0 or height <= 0:
+            return
+        border = cell.border
+        edges = (
+            (border.top, (x, y, x + width, y)),
+            (border.bottom, (x, y + height, x + width, y + height)),
+            (border.left, (x, y, x, y + height)),
+            (border.right, (x + width, y, x + width, y + height)),
+        )
+        for (side, line), visible in zip(edges, visible_edges):
+            if not visible or side is None or not side.style:
+                continue
+            line_width, dash = BORDER_STYLES.get(side.style, BORDER_STYLES["thin"])
+            pdf.setStrokeColorRGB(*resolve_color(side.color, theme_colors, (0, 0, 0)))
+            pdf.setLineWidth(line_width)
+            if dash:
+                pdf.setDash(dash)
+            else:
+                pdf.setDash()
+            if side.style == "double":
+                horizontal = line[1] == line[3]
+                dx, dy = (0, 1) if horizontal else (1, 0)
+                pdf.line(line[0] - dx, line[1] - dy, line[2] - dx, line[3] - dy)
+                pdf.line(line[0] + dx, line[1] + dy, line[2] + dx, line[3] + dy)
+            else:
+                pdf.line(*line)
+        pdf.setDash()
+
+    def _draw_text(self, pdf, cell, text, red, rect, theme_colors):
+        """セルの配置・フォントに従って文字を描く。"""
+        x, y, width, height = rect
+        font = cell.font
+        size = font.sz or 11
+        color = (1, 0, 0) if red else resolve_color(font.color, theme_colors, (0, 0, 0))
+        alignment = cell.alignment
+        horizontal = alignment.horizontal or "general"
+        if horizontal == "general":
+            horizontal = "right" if isinstance(cell.value, (int, float, Decimal)) else "left"
+        vertical = alignment.vertical or "bottom"
+
+        inner_width = max(width - CELL_PADDING * 2, 0)
+        lines = []
+        for paragraph in text.split("\n"):
+            if alignment.wrap_text or "\n" in text:
+                lines.extend(simpleSplit(paragraph, self.font_name, size, inner_width) or [""])
+            else:
+                lines.append(paragraph)
+        line_height = size * 1.25
+        block_height = line_height * len(lines)
+        if vertical == "top":
+            baseline = y + size + CELL_PADDING / 2
+        elif vertical in ("center", "justify", "distributed"):
+            baseline = y + (height - block_height) / 2 + size
+        else:
+            baseline = y + height - block_height + size - CELL_PADDING / 2
+
+        pdf.saveState()
+        pdf.setFillColorRGB(*color)
+        if font.b:
+            # 太字のフォントファイルは使わず、輪郭を太らせて表現する
+            pdf.setStrokeColorRGB(*color)
+            pdf.setLineWidth(size / 30)
+        for index, line in enumerate(lines):
+            line_width = pdfmetrics.stringWidth(line, self.font_name, size)
+            line_y = baseline + index * line_height
+            text_object = pdf.beginText()
+            text_object.setFont(self.font_name, size)
+            if font.b:
+                text_object.setTextRenderMode(2)
+            # 座標系を上下反転しているため、文字だけ元の向きに戻す
+            text_object.setTextTransform(1, 0, 0, -1, 0, line_y)
+            if horizontal == "distributed" and len(line) > 1 and line_width < inner_width:
+                # 均等割り付け
+                text_object.setCharSpace((inner_width - line_width) / (len(line) - 1))
+                text_object.setTextTransform(1, 0, 0, -1, x + CELL_PADDING, line_y)
+            elif horizontal in ("center", "centerContinuous", "distributed", "fill", "justify"):
+                text_object.setTextTransform(1, 0, 0, -1, x + (width - line_width) / 2, line_y)
+            elif horizontal == "right":
+                text_object.setTextTransform(1, 0, 0, -1, x + width - CELL_PADDING - line_width, line_y)
+            else:
+                text_object.setTextTransform(1, 0, 0, -1, x + CELL_PADDING + (alignment.indent or 0) * size, line_y)
+            text_object.textLine(line)
+            pdf.drawText(text_object)
+        pdf.restoreState()
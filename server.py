@@ -0,0 +1,309 @@
+import asyncio
+import json
+import logging
+import signal
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from document_request import DocumentRequest
+
+# 既定の待ち受けアドレス（同じマシンの業務システムからの利用を想定し、外部には公開しない）
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# 受け付ける生成依頼の本文の上限（バイト）
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# PDFを送信するときの1回あたりの読み込みサイズ
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# 満杯で受け付けなかったときに、再送までの待ち時間として返す秒数
+RETRY_AFTER_SECONDS = 1
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        """HTTPのエラー応答として返す例外。"""
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class ServerJob:
+    def __init__(self, job_id, request):
+        """サーバーが受け付けた生成ジョブ1件の状態。"""
+        self.job_id = job_id
+        self.request = request
+        self.status = "queued"  # queued / running / finished / failed
+        self.stage = "queued"
+        self.path = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    def report_progress(self, stage):
+        """生成処理の段階の切り替わりを記録する（ワーカースレッドから呼ばれる）。"""
+        self.stage = stage
+
+    def as_dict(self):
+        """状態の問い合わせへの応答の内容を返す。"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "document_type": self.request.document_type,
+            "company_name": self.request.company_name,
+            "path": self.path,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "status_url": f"/jobs/{self.job_id}",
+            "pdf_url": f"/jobs/{self.job_id}/pdf",
+        }
+
+
+class GenerationServer:
+    def __init__(self, generator, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=1, queue_size=16, max_jobs=1000):
+        """生成依頼をHTTP/JSONで受け付け、上限付きの待ち行列を通して書類を生成するサーバー。
+
+        同時に生成するのは workers 件まで、待ち行列は queue_size 件までで、それを超える依頼には
+        429 Too Many Requests を返す。完了したジョブの状態は新しいものから max_jobs 件まで保持する。
+        """
+        self.generator = generator
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.queue = None
+        self.server = None
+        self._executor = None
+        self._worker_tasks = []
+
+    async def start(self):
+        """ワーカーを起動して待ち受けを開始する。"""
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="docgen-server")
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        # port=0 を指定した場合に実際に割り当てられたポートを反映する
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info(f"Document server listening on http://{self.host}:{self.port} "
+                     f"(workers={self.workers}, queue={self.queue_size})")
+
+    async def close(self):
+        """待ち受けを終了し、実行中の生成が終わるのを待ってからワーカーを止める。"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def submit(self, request):
+        """生成依頼を待ち行列に入れてジョブを返す。満杯なら 429 の HttpError を送出する。"""
+        job = ServerJob(uuid.uuid4().hex, request)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.generator.metrics.increment("server_rejections_total")
+            raise HttpError(HTTPStatus.TOO_MANY_REQUESTS, "The generation queue is full, retry later.",
+                            {"Retry-After": str(RETRY_AFTER_SECONDS)})
+        self.jobs[job.job_id] = job
+        self._prune_jobs()
+        return job
+
+    def _prune_jobs(self):
+        """完了したジョブの状態を古いものから削除し、保持件数を max_jobs 件に抑える。"""
+        if len(self.jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done.is_set()]:
+            if len(self.jobs) <= self.max_jobs:
+                break
+            del self.jobs[job_id]
+
+    async def _worker(self):
+        """待ち行列からジョブを取り出し、スレッドプールで書類を生成する。"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                job.status = "running"
+                job.path = await loop.run_in_executor(self._executor, self._generate, job)
+                job.status = "finished"
+                job.stage = "finished"
+            except Exception as e:
+                logging.exception(f"Document generation failed (job {job.job_id})")
+                job.status = "failed"
+                job.stage = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                job.done.set()
+                self.queue.task_done()
+
+    def _generate(self, job):
+        """ワーカースレッドで書類を1件生成する。"""
+        return self.generator.generate(job.request, progress=job.report_progress)
+
+    async def handle_connection(self, reader, writer):
+        """1回の接続で1件の要求を処理する。"""
+        try:
+            try:
+                method, path, query, body = await self._read_request(reader)
+                await self.dispatch(writer, method, path, query, body)
+            except HttpError as e:
+                await self._respond_json(writer, e.status, {"error": e.message}, e.headers)
+            except Exception as e:
+                logging.exception("Unexpected error while handling a request")
+                await self._respond_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # 応答を返す前に切断された
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        """要求行・ヘッダー・本文を読み込む。"""
+        request_line = await reader.readline()
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line.")
+        method, target, _ = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body is too large.")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), body
+
+    async def dispatch(self, writer, method, path, query, body):
+        """パスとメソッドに応じて要求を処理する。"""
+        segments = path.strip("/").split("/")
+        if path == "/health" and method == "GET":
+            await self._respond_json(writer, HTTPStatus.OK, {
+                "status": "ok",
+                "queued": self.queue.qsize(),
+                "queue_size": self.queue_size,
+                "workers": self.workers,
+            })
+        elif path == "/metrics" and method == "GET":
+            await self._respond(writer, HTTPStatus.OK, self.generator.metrics.to_prometheus().encode("utf-8"),
+                                "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/documents":
+            if method != "POST":
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use POST to submit a document request.")
+            await self.post_document(writer, query, body)
+        elif segments[0] == "jobs" and len(segments) in (2, 3):
+            if method != "GET":
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use GET to query a job.")
+            job = self.jobs.get(segments[1])
+            if job is None:
+                raise HttpError(HTTPStatus.NOT_FOUND, "Unknown job ID.")
+            if len(segments) == 2:
+                await self._respond_json(writer, HTTPStatus.OK, job.as_dict())
+            elif segments[2] == "pdf":
+                await self.send_pdf(writer, job)
+            else:
+                raise HttpError(HTTPStatus.NOT_FOUND, "Not found.")
+        else:
+            raise HttpError(HTTPStatus.NOT_FOUND, "Not found.")
+
+    async def post_document(self, writer, query, body):
+        """生成依頼を受け付ける。wait=true なら完了を待ってPDFを返し、それ以外は 202 でジョブIDを返す。"""
+        try:
+            request = DocumentRequest.from_dict(json.loads(body.decode("utf-8")))
+        except (ValueError, TypeError, AttributeError) as e:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Invalid document request: {e}")
+        job = self.submit(request)
+        if query.get("wait", ["false"])[0].lower() in ("1", "true", "yes"):
+            await job.done.wait()
+            await self.send_pdf(writer, job)
+        else:
+            await self._respond_json(writer, HTTPStatus.ACCEPTED, job.as_dict(), {"Location": f"/jobs/{job.job_id}"})
+
+    async def send_pdf(self, writer, job):
+        """完了したジョブのPDFを少しずつ読み込みながら送信する。"""
+        if job.status == "failed":
+            raise HttpError(HTTPStatus.INTERNAL_SERVER_ERROR, job.error or "Document generation failed.")
+        if job.status != "finished":
+            raise HttpError(HTTPStatus.CONFLICT, f"The document is not ready yet ({job.status}).",
+                            {"Retry-After": str(RETRY_AFTER_SECONDS)})
+        try:
+            f = open(job.path, "rb")
+        except OSError:
+            raise HttpError(HTTPStatus.GONE, "The generated PDF no longer exists.")
+        with f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(0)
+            self._write_head(writer, HTTPStatus.OK, "application/pdf", size, {"X-Job-Id": job.job_id})
+            while True:
+                chunk = f.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+
+    def _write_head(self, writer, status, content_type, length, headers=None):
+        """ステータス行とヘッダーを書き込む（1回の接続で1件のみ処理するため常に Connection: close）。"""
+        status = HTTPStatus(status)
+        lines = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {length}",
+            "Connection: close",
+        ]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    async def _respond(self, writer, status, body, content_type, headers=None):
+        """応答を送信する。"""
+        self._write_head(writer, status, content_type, len(body), headers)
+        writer.write(body)
+        await writer.drain()
+
+    async def _respond_json(self, writer, status, payload, headers=None):
+        """JSONの応答を送信する。"""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._respond(writer, status, body, "application/json; charset=utf-8", headers)
+
+
+async def serve(generator, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=1, queue_size=16):
+    """サーバーを起動し、終了の合図（Ctrl+C / SIGTERM）を受けるまで待ち受ける。"""
+    server = GenerationServer(generator, host, port, workers, queue_size)
+    await server.start()
+    stop = asyncio.Event()
+    if sys.platform != "win32":
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Shutting down the document server...")
+        await server.close()
@@ -0,0 +1,115 @@
+"""常駐LibreOfficeワーカー。
+
+LibreOffice同梱のPython（または python3-uno が使えるPython）で実行する。
+専用のユーザープロファイルで soffice を1つ起動してUNOのパイプ接続で操作し、
+標準入力から1行1件のJSONで変換ジョブを受け取り、結果を標準出力に1行のJSONで返す。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+
+def _property(name, value):
+    """UNOの PropertyValue を作成する。"""
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+def start_office(soffice_path, profile_dir, pipe_name):
+    """専用プロファイルとパイプ名で soffice をヘッドレス起動する。"""
+    os.makedirs(profile_dir, exist_ok=True)
+    return subprocess.Popen([
+        soffice_path, "--headless", "--invisible", "--nologo", "--nodefault", "--norestore", "--nolockcheck",
+        f"-env:UserInstallation={uno.systemPathToFileUrl(os.path.abspath(profile_dir))}",
+        f"--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext",
+    ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def connect(pipe_name, process, timeout):
+    """起動した soffice にUNOで接続し、Desktopオブジェクトを返す。"""
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_context)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            context = resolver.resolve(f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext")
+            return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        except NoConnectException:
+            if process.poll() is not None:
+                raise RuntimeError(f"soffice exited during startup (code {process.returncode})")
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def convert(desktop, input_file, output_dir, sheet_name):
+    """ブックを開き、指定シートのみをPDFとして書き出す。"""
+    input_url = uno.systemPathToFileUrl(os.path.abspath(input_file))
+    document = desktop.loadComponentFromURL(input_url, "_blank", 0, (_property("Hidden", True),))
+    try:
+        sheets = document.getSheets()
+        if sheet_name and sheets.hasByName(sheet_name):
+            # 指定シート以外を削除してから書き出す（元のブックは保存しない）
+            for name in sheets.getElementNames():
+                if name != sheet_name:
+                    sheets.removeByName(name)
+        output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + ".pdf")
+        document.storeToURL(uno.systemPathToFileUrl(os.path.abspath(output_file)), (_property("FilterName", "calc_pdf_Export"),))
+    finally:
+        document.close(True)
+    return output_file
+
+
+def main():
+    """ワーカーのエントリーポイント。標準入出力でジョブを処理し続ける。"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--soffice", required=True)
+    parser.add_argument("--profile", required=True)
+    parser.add_argument("--pipe-name", required=True)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    process = start_office(args.soffice, args.profile, args.pipe_name)
+    desktop = None
+    try:
+        desktop = connect(args.pipe_name, process, args.startup_timeout)
+        sys.stdout.write(json.dumps({"ready": True}) + "\n")
+        sys.stdout.flush()
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            try:
+                output_file = convert(desktop, job["input"], job["output_dir"], job.get("sheet"))
+                reply = {"ok": True, "output": output_file}
+            except Exception as e:
+                reply = {"ok": False, "error": str(e), "crashed": process.poll() is not None}
+            sys.stdout.write(json.dumps(reply, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+            if process.poll() is not None:
+                # soffice が落ちた場合はワーカーごと終了し、プール側で再起動させる
+                break
+    finally:
+        if process.poll() is None:
+            try:
+                desktop.terminate()
+            except Exception:
+                process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+from dataclasses import dataclass, field
+from decimal import ROUND_DOWN, ROUND_HALF_UP, ROUND_UP, Decimal, InvalidOperation
+
+# 端数処理の指定名（設定ファイル等で使う）と decimal の丸めモードの対応
+ROUNDING_MODES = {
+    "down": ROUND_DOWN,      # 切り捨て
+    "half_up": ROUND_HALF_UP,  # 四捨五入
+    "up": ROUND_UP,          # 切り上げ
+}
+
+# 明細金額（数量×単価−値引）の端数処理。テンプレートの ROUNDDOWN(D*F-G,0) と同じ切り捨て
+LINE_ROUNDING = ROUND_DOWN
+
+# 消費税額の端数処理の既定値（適格請求書では税率ごとに1回だけ端数処理する）
+DEFAULT_TAX_ROUNDING = ROUND_DOWN
+
+_ZERO = Decimal(0)
+_ONE = Decimal(1)
+_HUNDRED = Decimal(100)
+
+
+def to_decimal(value, name="value"):
+    """入力値（文字列・数値）を Decimal に変換する。空欄は0とみなす。"""
+    if value is None:
+        return _ZERO
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        # 2進小数の誤差を持ち込まないよう文字列経由で変換する
+        value = repr(value)
+    text = str(value).strip().replace(",", "")
+    if not text:
+        return _ZERO
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"Invalid {name}: {value!r}")
+
+
+def resolve_rounding(rounding):
+    """端数処理の指定（"down" などの名前または decimal の丸めモード）を丸めモードに変換する。"""
+    if rounding is None:
+        return DEFAULT_TAX_ROUNDING
+    return ROUNDING_MODES.get(rounding, rounding)
+
+
+@dataclass
+class TaxBucket:
+    """税率1つ分の集計（税抜金額と消費税額）。"""
+    rate: Decimal
+    taxable: int = 0
+    tax: int = 0
+
+
+@dataclass
+class DocumentTotals:
+    """書類1件分の計算結果。金額はすべて円単位の整数。"""
+    line_amounts: list = field(default_factory=list)
+    buckets: dict = field(default_factory=dict)
+    total_excluding_tax: int = 0
+    total_tax: int = 0
+    total_including_tax: int = 0
+
+    def bucket(self, rate):
+        """税率（パーセント）に対応する集計を返す。該当する明細がなければ0円の集計を返す。"""
+        rate = to_decimal(rate, "tax rate")
+        return self.buckets.get(rate) or TaxBucket(rate)
+
+    def as_dict(self):
+        """テンプレートの税率別内訳（10% / 8% / 0%）と合計を辞書で返す。"""
+        return {
+            "total_excluding_tax": self.total_excluding_tax,
+            "tax_10_total": self.bucket(10).taxable,
+            "tax_10_tax": self.bucket(10).tax,
+            "tax_8_total": self.bucket(8).taxable,
+            "tax_8_tax": self.bucket(8).tax,
+            "tax_0_total": self.bucket(0).taxable,
+            "total_tax": self.total_tax,
+            "total_including_tax": self.total_including_tax,
+        }
+
+
+def calculate_line_amount(quantity, unit_price, discount):
+    """明細1行の金額（数量×単価−値引、円未満切り捨て）を返す。"""
+    amount = to_decimal(quantity, "quantity") * to_decimal(unit_price, "unit price") - to_decimal(discount, "discount")
+    return int(amount.to_integral_value(rounding=LINE_ROUNDING))
+
+
+def calculate_tax(taxable, rate, rounding=None):
+    """税抜金額と税率（パーセント）から消費税額を端数処理して返す。"""
+    tax = Decimal(taxable) * rate / _HUNDRED
+    return int(tax.quantize(_ONE, rounding=resolve_rounding(rounding)))
+
+
+def calculate_totals(items, rounding=None):
+    """明細を1回だけ走査して、明細金額・税率別集計・合計を計算する。
+
+    items は quantity / unit_price / discount / tax_rate（パーセント）属性を持つ明細の列。
+    rounding は消費税額の端数処理で、全税率共通の指定か、税率（パーセント）をキーにした辞書を渡す。
+    """
+    rounding = _normalize_rounding(rounding)
+    totals = DocumentTotals()
+    taxable_by_rate = {}
+    # 税率の種類は少ないため、入力値ごとの変換結果を使い回す
+    rates = {}
+    for index, item in enumerate(items):
+        try:
+            amount = calculate_line_amount(item.quantity, item.unit_price, item.discount)
+            rate = rates.get(item.tax_rate)
+            if rate is None:
+                rate = rates[item.tax_rate] = to_decimal(item.tax_rate, "tax rate")
+        except ValueError as e:
+            raise ValueError(f"Line {index + 1}: {e}")
+        totals.line_amounts.append(amount)
+        taxable_by_rate[rate] = taxable_by_rate.get(rate, 0) + amount
+
+    return _summarize(totals, taxable_by_rate, rounding)
+
+
+def _normalize_rounding(rounding):
+    """税率ごとの端数処理の辞書のキーを Decimal にそろえる。"""
+    if isinstance(rounding, dict):
+        return {to_decimal(rate, "tax rate"): mode for rate, mode in rounding.items()}
+    return rounding
+
+
+def _summarize(totals, taxable_by_rate, rounding):
+    """税率ごとの税抜金額から消費税額と合計を計算して totals に設定する。"""
+    # 消費税額は税率ごとに合計してから1回だけ端数処理する
+    for rate, taxable in sorted(taxable_by_rate.items(), reverse=True):
+        rate_rounding = rounding.get(rate) if isinstance(rounding, dict) else rounding
+        tax = calculate_tax(taxable, rate, rate_rounding)
+        totals.buckets[rate] = TaxBucket(rate, taxable, tax)
+        totals.total_excluding_tax += taxable
+        totals.total_tax += tax
+    totals.total_including_tax = totals.total_excluding_tax + totals.total_tax
+    return totals
+
+
+class RunningTotals:
+    def __init__(self, rounding=None):
+        """明細の変更に合わせて差分だけを更新する集計（入力中の合計表示用）。
+
+        行ごとの明細金額と税率を覚えておき、1セルの変更ではその行の分だけを差し引き・加算する。
+        消費税額は税率の種類（数種類）ごとに計算するため、明細の行数によらず一定の時間で合計を得られる。
+        """
+        self.rounding = _normalize_rounding(rounding)
+        self.clear()
+
+    def clear(self):
+        """すべての行を削除する。"""
+        self.amounts = []  # 行ごとの明細金額
+        self.rates = []  # 行ごとの税率
+        self.taxable_by_rate = {}
+        self.lines_by_rate = {}  # 税率ごとの行数（行がなくなった税率を内訳から外すため）
+
+    def _add(self, amount, rate, sign):
+        """1行分の金額を税率ごとの集計に加算（sign=-1 なら減算）する。"""
+        self.taxable_by_rate[rate] = self.taxable_by_rate.get(rate, 0) + sign * amount
+        lines = self.lines_by_rate.get(rate, 0) + sign
+        if lines:
+            self.lines_by_rate[rate] = lines
+        else:
+            del self.lines_by_rate[rate]
+            del self.taxable_by_rate[rate]
+
+    def insert_rows(self, position, count):
+        """position の位置に金額0・税率0%の行を count 行挿入する。"""
+        self.amounts[position:position] = [0] * count
+        self.rates[position:position] = [_ZERO] * count
+        self.lines_by_rate[_ZERO] = self.lines_by_rate.get(_ZERO, 0) + count
+        self.taxable_by_rate.setdefault(_ZERO, 0)
+
+    def remove_rows(self, position, count):
+        """position から count 行を削除する。"""
+        for amount, rate in zip(self.amounts[position:position + count], self.rates[position:position + count]):
+            self._add(amount, rate, -1)
+        del self.amounts[position:position + count]
+        del self.rates[position:position + count]
+
+    def set_line(self, row, quantity, unit_price, discount, tax_rate):
+        """row 行目の数量・単価・値引・税率が変わったときに、その行の分だけ集計を更新する。"""
+        amount = calculate_line_amount(quantity, unit_price, discount)
+        rate = to_decimal(tax_rate, "tax rate")
+        self._add(self.amounts[row], self.rates[row], -1)
+        self._add(amount, rate, 1)
+        self.amounts[row] = amount
+        self.rates[row] = rate
+
+    def totals(self):
+        """現在の税率別集計と合計を返す（明細金額の一覧 line_amounts は含まない）。"""
+        return _summarize(DocumentTotals(), self.taxable_by_rate, self.rounding)
@@ -0,0 +1,79 @@
+import copyreg
+import io
+import logging
+import os
+import pickle
+import threading
+
+from openpyxl import load_workbook
+from openpyxl.utils.indexed_list import IndexedList
+
+
+def _reduce_indexed_list(indexed_list):
+    """IndexedList をコンストラクタ経由で復元させる（通常のpickleでは重複要素の索引が崩れるため）。"""
+    return IndexedList, (list(indexed_list),)
+
+
+def snapshot_workbook(workbook):
+    """読み込み済みのブックを、高速に複製できるバイト列に変換する。"""
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = copyreg.dispatch_table.copy()
+    pickler.dispatch_table[IndexedList] = _reduce_indexed_list
+    pickler.dump(workbook)
+    return buffer.getvalue()
+
+
+def restore_workbook(snapshot):
+    """スナップショットから独立したブックを復元する。"""
+    return pickle.loads(snapshot)
+
+
+class TemplateCache:
+    def __init__(self):
+        """テンプレートを1度だけ読み込み、書き込み用の複製を払い出すキャッシュ。"""
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_workbook(self, template_path):
+        """テンプレートの独立した複製を返す。ファイルが更新されていれば読み込み直す。"""
+        template_path = os.path.abspath(template_path)
+        stat = os.stat(template_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(template_path)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                snapshot = entry[1]
+            else:
+                snapshot = None
+        if snapshot is None:
+            # ロックの外で読み込む（同時に読み込まれても結果は同じ）
+            snapshot = snapshot_workbook(load_workbook(template_path))
+            with self._lock:
+                self.misses += 1
+                if entry is not None:
+                    self.invalidations += 1
+                    logging.info(f"Template changed on disk, reloading: {template_path}")
+                self._entries[template_path] = (version, snapshot)
+        return restore_workbook(snapshot)
+
+    def clear(self):
+        """キャッシュをすべて破棄する。"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ヒット数・ミス数などの統計を辞書で返す。"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
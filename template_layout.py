@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import threading
+
+from openpyxl.styles import Alignment
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE, BUILTIN_FORMATS_REVERSE
+from openpyxl.utils.cell import column_index_from_string, coordinate_from_string
+from openpyxl.utils.exceptions import CellCoordinatesException
+
+from tax_calculator import to_decimal
+
+# レイアウト定義で指定できる配置の項目（openpyxl の Alignment の引数）
+ALIGNMENT_KEYS = ("horizontal", "vertical", "wrap_text", "shrink_to_fit", "indent", "text_rotation")
+
+# 明細の列に書き込める項目（明細行と明細金額から値を取り出す関数）。税率は割合（10% → 0.1）で書き込む
+LINE_FIELDS = {
+    "summary": lambda item, amount: item.summary,
+    "quantity": lambda item, amount: to_decimal(item.quantity, "quantity"),
+    "unit": lambda item, amount: item.unit,
+    "unit_price": lambda item, amount: to_decimal(item.unit_price, "unit price"),
+    "discount": lambda item, amount: to_decimal(item.discount, "discount"),
+    "tax_rate": lambda item, amount: to_decimal(item.tax_rate, "tax rate") / 100,
+    "amount": lambda item, amount: amount,
+}
+
+# 同じ内容の配置は、すべてのテンプレートで1つの Alignment を共有する
+_alignments = {}
+_alignments_lock = threading.Lock()
+
+
+def intern_alignment(spec):
+    """配置の指定（辞書）に対応する共有の Alignment を返す。"""
+    key = tuple(sorted(spec.items()))
+    with _alignments_lock:
+        alignment = _alignments.get(key)
+        if alignment is None:
+            alignment = _alignments[key] = Alignment(**spec)
+        return alignment
+
+
+def parse_cell(coordinate):
+    """セル番地（"B5"）を (行, 列) の番号に変換する。"""
+    try:
+        column, row = coordinate_from_string(coordinate)
+        return row, column_index_from_string(column)
+    except CellCoordinatesException:
+        raise ValueError(f"invalid cell {coordinate!r}")
+
+
+def document_values(request, company_info, totals):
+    """レイアウト定義の項目名（"request.subject" など）から書き込む値を引く辞書を作成する。"""
+    issue_date = request.issued_at.strftime("%Y/%m/%d")
+    values = {f"company.{key}": value for key, value in company_info.items()}
+    values.update({f"totals.{key}": value for key, value in totals.as_dict().items()})
+    values.update({
+        "request.company_name": request.company_name,
+        "request.subject": request.subject,
+        "request.issue_date": issue_date,
+        "request.expiry_date": (request.expiry_date or request.issued_at.date()).strftime("%Y/%m/%d"),
+        "request.delivery_date": request.delivery_date,
+        "request.delivery_place": request.delivery_place,
+        "request.transaction_method": request.transaction_method,
+        "request.remarks": request.remarks,
+        "request.document_number": request.document_number,
+    })
+    return values
+
+
+class CellStyle:
+    def __init__(self, alignment=None, number_format=None):
+        """レイアウト定義の書式1つ分（共有の Alignment と表示形式）。"""
+        self.alignment = alignment
+        self.number_format = number_format
+
+    def resolve(self, workbook):
+        """ブックの書式一覧に登録し、セルの書式に設定する番号を返す（ブックごとに1度だけ呼ぶ）。"""
+        alignment_id = workbook._alignments.add(self.alignment) if self.alignment is not None else None
+        number_format_id = None
+        if self.number_format is not None:
+            number_format_id = BUILTIN_FORMATS_REVERSE.get(self.number_format)
+            if number_format_id is None:
+                number_format_id = workbook._number_formats.add(self.number_format) + BUILTIN_FORMATS_MAX_SIZE
+        return alignment_id, number_format_id
+
+
+def apply_style(cell, style_ids):
+    """resolve で得た番号をセルの書式に設定する（cell.alignment = ... と同じ結果を、書式の検索なしで得る）。"""
+    alignment_id, number_format_id = style_ids
+    style = cell._style
+    if style is None:
+        style = cell._style = StyleArray()
+    if alignment_id is not None:
+        style.alignmentId = alignment_id
+    if number_format_id is not None:
+        style.numFmtId = number_format_id
+
+
+class FillPlan:
+    def __init__(self, definition, source="<layout>"):
+        """テンプレートのレイアウト定義（JSON）を、記入に使う形に1度だけ変換したもの。
+
+        セル番地は (行, 列) の番号に、書式は共有の Alignment に変換しておき、記入時は定義をたどるだけにする。
+        """
+        self.source = source
+        try:
+            self._compile(definition)
+        except KeyError as e:
+            raise ValueError(f"Invalid layout definition {source}: missing key {e}")
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid layout definition {source}: {e}")
+
+    def _compile(self, definition):
+        """レイアウト定義を検証して変換する。"""
+        self.styles = []
+        style_indexes = {}
+        for name, spec in (definition.get("styles") or {}).items():
+            unknown = set(spec) - set(ALIGNMENT_KEYS) - {"number_format"}
+            if unknown:
+                raise ValueError(f"unknown style keys in {name!r}: {sorted(unknown)}")
+            alignment = {key: spec[key] for key in ALIGNMENT_KEYS if key in spec}
+            style_indexes[name] = len(self.styles)
+            self.styles.append(CellStyle(intern_alignment(alignment) if alignment else None, spec.get("number_format")))
+
+        def style_index(name):
+            if name is None:
+                return None
+            if name not in style_indexes:
+                raise ValueError(f"unknown style {name!r}")
+            return style_indexes[name]
+
+        # 明細以外の欄: (行, 列, 項目名, 固定値, 書式の番号, 空欄なら書き込まないか)
+        self.fields = []
+        for field in definition["fields"]:
+            if ("field" in field) == ("value" in field):
+                raise ValueError(f"specify either 'field' or 'value' for {field['cell']}")
+            row, column = parse_cell(field["cell"])
+            self.fields.append((row, column, field.get("field"), field.get("value"), style_index(field.get("style")),
+                                bool(field.get("skip_empty"))))
+
+        lines = definition["line_items"]
+        self.first_line_row = int(lines["first_row"])
+        self.last_line_row = int(lines["last_row"])
+        if self.last_line_row < self.first_line_row:
+            raise ValueError("line_items.last_row is before first_row")
+        # 明細の列: (列, 値を取り出す関数, 書式の番号)
+        self.line_columns = []
+        for column in lines["columns"]:
+            if column["field"] not in LINE_FIELDS:
+                raise ValueError(f"unknown line item field {column['field']!r}")
+            self.line_columns.append((column_index_from_string(column["column"]), LINE_FIELDS[column["field"]],
+                                      style_index(column.get("style"))))
+        self.line_column_fields = {column["field"]: column_index_from_string(column["column"])
+                                   for column in lines["columns"]}
+        self.grand_total_cell = definition.get("grand_total_cell")
+
+    @property
+    def capacity(self):
+        """テンプレートの明細欄に収まる行数。"""
+        return self.last_line_row - self.first_line_row + 1
+
+    def line_style(self, column):
+        """明細の列に指定された書式を返す（指定がなければ None）。"""
+        for line_column, _, index in self.line_columns:
+            if line_column == column and index is not None:
+                return self.styles[index]
+        return None
+
+    def resolve_styles(self, workbook):
+        """書式をブックに登録し、書式の番号ごとのセルへの設定値のリストを返す。"""
+        return [style.resolve(workbook) for style in self.styles]
+
+    def fill_fields(self, sheet, values, style_ids=None):
+        """明細以外の欄に、values（document_values の辞書）の値を書き込む。"""
+        if style_ids is None:
+            style_ids = self.resolve_styles(sheet.parent)
+        for row, column, field, constant, style, skip_empty in self.fields:
+            value = values.get(field, "") if field is not None else constant
+            if skip_empty and not value:
+                continue
+            cell = sheet.cell(row=row, column=column)
+            cell.value = value
+            if style is not None:
+                apply_style(cell, style_ids[style])
+
+    def fill_line_items(self, sheet, items, line_amounts, style_ids=None):
+        """明細行を明細欄の先頭行から書き込む。"""
+        if style_ids is None:
+            style_ids = self.resolve_styles(sheet.parent)
+        columns = [(column, getter, style_ids[style] if style is not None else None)
+                   for column, getter, style in self.line_columns]
+        for row, (item, amount) in enumerate(zip(items, line_amounts), self.first_line_row):
+            for column, getter, ids in columns:
+                cell = sheet.cell(row=row, column=column)
+                cell.value = getter(item, amount)
+                if ids is not None:
+                    apply_style(cell, ids)
+
+
+def load_fill_plan(path):
+    """レイアウト定義のファイルを読み込み、記入プランに変換する。"""
+    with open(path, encoding="utf-8") as f:
+        definition = json.load(f)
+    return FillPlan(definition, path)
+
+
+class FillPlanCache:
+    def __init__(self):
+        """レイアウト定義を1度だけ読み込んで変換し、記入プランを使い回すキャッシュ。"""
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """記入プランを返す。ファイルが更新されていれば読み込み直す。"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        plan = load_fill_plan(path)
+        with self._lock:
+            if entry is not None:
+                logging.info(f"Layout definition changed on disk, reloading: {path}")
+            self._entries[path] = (version, plan)
+        return plan
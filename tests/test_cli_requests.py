@@ -0,0 +1,121 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import cli
+from dead_letter import DeadLetterQueue
+from metrics import MetricsRegistry
+
+
+class FakeGenerator:
+    """生成依頼の読み込みと失敗の書き留めだけを行う書類生成エンジンの代わり。"""
+
+    def __init__(self, dead_letter):
+        self.dead_letter = dead_letter
+        self.rejected = []
+
+    def reject(self, record, error):
+        self.rejected.append(record)
+        self.dead_letter.put_record(record, error)
+
+    def fail(self, request, error, started, company_info=None):
+        self.rejected.append(request)
+        self.dead_letter.put(request, error)
+
+    def generate(self, request, company_info):
+        return f"/out/{request.company_name}.pdf"
+
+
+def write_jsonl(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_iter_jsonl_requests_yields_raw_lines_with_line_numbers(tmp_path):
+    path = write_jsonl(tmp_path / "r.jsonl", ['{"a": 1}', "", "not json"])
+    assert list(cli.iter_jsonl_requests(path)) == [(1, '{"a": 1}'), (3, "not json")]
+
+
+def test_iter_csv_requests_groups_rows_by_document_id(tmp_path):
+    path = tmp_path / "r.csv"
+    path.write_text(
+        "document_id,document_type,company_name,summary,quantity,unit_price\n"
+        "1,請求書,顧客A,作業費,1,100\n"
+        "1,請求書,顧客A,交通費,2,50\n"
+        "2,不明,顧客B,作業費,1,100\n",
+        encoding="utf-8",
+    )
+    records = list(cli.iter_csv_requests(str(path)))
+    assert [key for key, _ in records] == ["1", "2"]
+    assert [item["summary"] for item in records[0][1]["items"]] == ["作業費", "交通費"]
+    assert cli.parse_request(records[0][1]).document_type == "請求書"
+    with pytest.raises(ValueError):
+        cli.parse_request(records[1][1])
+
+
+@pytest.mark.parametrize("record", ["not json", "[1, 2]", '{"document_type": "不明", "company_name": "A"}'])
+def test_parse_request_rejects_invalid_records(record):
+    with pytest.raises(ValueError):
+        cli.parse_request(record)
+
+
+def test_invalid_records_fail_alone_and_are_dead_lettered(tmp_path):
+    path = write_jsonl(tmp_path / "r.jsonl", [
+        '{"document_type": "請求書", "company_name": "顧客A"}',
+        "{broken",
+        '{"document_type": "不明", "company_name": "顧客B"}',
+        '{"document_type": "見積書", "company_name": "顧客C"}',
+    ])
+    dead_letter = DeadLetterQueue(str(tmp_path / "failed.jsonl"), MetricsRegistry())
+    generator = FakeGenerator(dead_letter)
+    args = SimpleNamespace(inputs=[path], issuer=None, fail_fast=False)
+    results = []
+
+    def report(source, key, pdf_path=None, error=None, request=None):
+        results.append((key, pdf_path, error))
+
+    cli._run_concurrent(args, generator, {"default": {"company_name": "自社"}}, report, 1)
+
+    assert sorted((key, pdf_path) for key, pdf_path, error in results if error is None) == [
+        (1, "/out/顧客A.pdf"), (4, "/out/顧客C.pdf")]
+    assert sorted(key for key, _, error in results if error is not None) == [2, 3]
+    failed = [json.loads(line) for line in open(dead_letter.path, encoding="utf-8")]
+    assert failed[0]["raw"] == "{broken"
+    assert failed[0]["dead_letter"]["error_type"] == "JSONDecodeError"
+    assert failed[1]["document_type"] == "不明"
+
+
+def test_fail_fast_stops_at_the_first_invalid_record(tmp_path):
+    path = write_jsonl(tmp_path / "r.jsonl", ["{broken", '{"document_type": "請求書", "company_name": "顧客A"}'])
+    generator = FakeGenerator(DeadLetterQueue(str(tmp_path / "failed.jsonl"), MetricsRegistry()))
+    args = SimpleNamespace(inputs=[path], issuer=None, fail_fast=True)
+    with pytest.raises(cli._FailFast):
+        cli._run_concurrent(args, generator, {"default": {}}, lambda *a, **k: None, 1)
+    assert generator.rejected == ["{broken"]
+
+
+def test_unknown_issuer_is_dead_lettered(tmp_path):
+    path = write_jsonl(tmp_path / "r.jsonl", [
+        '{"document_type": "請求書", "company_name": "顧客A", "issuer": "branch"}',
+        '{"document_type": "請求書", "company_name": "顧客B"}',
+    ])
+    dead_letter = DeadLetterQueue(str(tmp_path / "failed.jsonl"), MetricsRegistry())
+    args = SimpleNamespace(inputs=[path], issuer=None, fail_fast=False)
+    results = []
+    cli._run_concurrent(args, FakeGenerator(dead_letter), {"default": {}},
+                        lambda source, key, pdf_path=None, error=None, request=None: results.append((key, error)), 1)
+    assert [key for key, error in results if error is not None] == [1]
+    failed = [json.loads(line) for line in open(dead_letter.path, encoding="utf-8")]
+    assert [(record["company_name"], record["issuer"]) for record in failed] == [("顧客A", "branch")]
+
+
+@pytest.mark.parametrize("command", [["generate", "requests.jsonl"], ["serve"]])
+def test_generator_uses_the_database_given_by_db(tmp_path, monkeypatch, command):
+    monkeypatch.delenv("DOCGEN_OUTPUT_CACHE", raising=False)
+    monkeypatch.setattr(cli, "create_converter", lambda **options: SimpleNamespace(close=lambda: None))
+    db_path = tmp_path / "branch.db"
+    args = cli.build_parser().parse_args(command + ["--db", str(db_path)])
+    generator = cli.create_generator(args, workers=0)
+    assert generator.db_manager.db_path == str(db_path)
+    generator.db_manager.close()
@@ -0,0 +1,216 @@
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+import converter
+from converter import (
+    MAX_RETRY_BACKOFF, CircuitBreaker, ConversionError, ConversionTimeout, ConverterUnavailable,
+    SupervisedConverter, run_soffice,
+)
+from metrics import MetricsRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        """time.monotonic の代わりに、テストから進められる時計。"""
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FlakyConverter:
+    def __init__(self, failures, error=ConversionError):
+        """最初の failures 回だけ error を送出し、その後はPDFのパスを返すコンバーター。"""
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def convert(self, input_file, output_dir, sheet_name):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("soffice failed")
+        return os.path.join(output_dir, f"{sheet_name}.pdf")
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(converter.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """再試行の待ち時間を実際には待たずに記録する。"""
+    delays = []
+    monkeypatch.setattr(converter.time, "sleep", delays.append)
+    return delays
+
+
+def counter(metrics, name):
+    return sum(metrics._counters.get(name, {}).values())
+
+
+def test_breaker_opens_after_threshold_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_recovers_on_success(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # 試行中の1件が終わるまでは次の変換を通さない
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_breaker_half_open_reopens_on_failure(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    # 止め直した時刻から数え直す
+    clock.now += 30
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_supervised_converter_retries_with_backoff(clock, sleeps, tmp_path):
+    metrics = MetricsRegistry()
+    fake = FlakyConverter(failures=3)
+    supervised = SupervisedConverter(fake, retries=3, backoff=1.0,
+                                     breaker=CircuitBreaker(failure_threshold=10), metrics=metrics)
+    pdf_file = supervised.convert("in.xlsx", str(tmp_path), "請求書")
+    assert pdf_file == os.path.join(str(tmp_path), "請求書.pdf")
+    assert fake.calls == 4
+    assert sleeps == [1.0, 2.0, 4.0]
+    assert counter(metrics, "conversion_retries_total") == 3
+    assert supervised.breaker.state == "closed"
+    assert supervised.breaker.failures == 0
+
+
+def test_supervised_converter_caps_the_backoff(clock, sleeps, tmp_path):
+    supervised = SupervisedConverter(FlakyConverter(failures=8), retries=8, backoff=1.0,
+                                     breaker=CircuitBreaker(failure_threshold=100), metrics=MetricsRegistry())
+    supervised.convert("in.xlsx", str(tmp_path), "請求書")
+    assert sleeps == [1.0, 2.0, 4.0, 8.0, 16.0, MAX_RETRY_BACKOFF, MAX_RETRY_BACKOFF, MAX_RETRY_BACKOFF]
+
+
+def test_supervised_converter_gives_up_after_retries(clock, sleeps, tmp_path):
+    metrics = MetricsRegistry()
+    fake = FlakyConverter(failures=10, error=ConversionTimeout)
+    supervised = SupervisedConverter(fake, retries=2, backoff=0.5,
+                                     breaker=CircuitBreaker(failure_threshold=10), metrics=metrics)
+    with pytest.raises(ConversionTimeout):
+        supervised.convert("in.xlsx", str(tmp_path), "請求書")
+    assert fake.calls == 3
+    assert sleeps == [0.5, 1.0]
+    assert counter(metrics, "conversion_timeouts_total") == 3
+    assert counter(metrics, "conversion_retries_total") == 2
+
+
+def test_supervised_converter_does_not_retry_other_errors(clock, sleeps, tmp_path):
+    fake = FlakyConverter(failures=1, error=FileNotFoundError)
+    supervised = SupervisedConverter(fake, retries=3, breaker=CircuitBreaker(failure_threshold=10),
+                                     metrics=MetricsRegistry())
+    with pytest.raises(FileNotFoundError):
+        supervised.convert("in.xlsx", str(tmp_path), "請求書")
+    assert fake.calls == 1
+    assert sleeps == []
+    assert supervised.breaker.failures == 1
+
+
+def test_open_breaker_rejects_until_reset_timeout(clock, sleeps, tmp_path):
+    metrics = MetricsRegistry()
+    fake = FlakyConverter(failures=2)
+    supervised = SupervisedConverter(fake, retries=5, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+                                     metrics=metrics)
+    # 2回目の失敗でブレーカーが開き、3回目は soffice に送らずに断る
+    with pytest.raises(ConverterUnavailable):
+        supervised.convert("in.xlsx", str(tmp_path), "請求書")
+    assert fake.calls == 2
+    assert counter(metrics, "conversion_rejections_total") == 1
+    with pytest.raises(ConverterUnavailable):
+        supervised.convert("in.xlsx", str(tmp_path), "請求書")
+    assert fake.calls == 2
+    assert counter(metrics, "conversion_rejections_total") == 2
+
+    clock.now += 60
+    assert supervised.convert("in.xlsx", str(tmp_path), "請求書").endswith("請求書.pdf")
+    assert fake.calls == 3
+    assert supervised.breaker.state == "closed"
+
+
+def is_running(pid):
+    """pid のプロセスが動いているか（終了して回収待ちのものは動いていないとみなす）。"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="プロセスグループの強制終了は POSIX で確認する")
+def test_run_soffice_timeout_kills_the_process_group(tmp_path):
+    pid_file = tmp_path / "child.pid"
+    # soffice が soffice.bin を起動するのと同じように、子プロセスを起動してから待ち続ける
+    script = textwrap.dedent(f"""
+        import subprocess, sys, time
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        with open({str(pid_file)!r}, "w") as f:
+            f.write(str(child.pid))
+        time.sleep(60)
+    """)
+    started = time.monotonic()
+    with pytest.raises(ConversionTimeout):
+        run_soffice([sys.executable, "-c", script], timeout=2)
+    assert time.monotonic() - started < 30
+    child_pid = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while is_running(child_pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not is_running(child_pid)
+
+
+def test_run_soffice_reports_a_nonzero_exit():
+    with pytest.raises(subprocess.CalledProcessError):
+        run_soffice([sys.executable, "-c", "import sys; sys.exit(3)"], timeout=30)
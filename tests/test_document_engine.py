@@ -0,0 +1,86 @@
+import dataclasses
+import os
+from datetime import datetime
+
+import pytest
+
+from database import DatabaseManager
+from document_engine import DocumentGenerator, OutputPathConflict
+from document_request import DocumentRequest, LineItem
+from metrics import MetricsRegistry
+from pdf_bundle import entry_from_request, group_documents
+from workspace import ScratchWorkspace
+
+
+class FakeConverter:
+    """ブックのパスを書いたPDFを出力するだけのコンバーター。"""
+
+    def convert(self, input_file, output_dir, sheet_name):
+        pdf_file = os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + ".pdf")
+        with open(pdf_file, "wb") as f:
+            f.write(b"%PDF-1.4 " + sheet_name.encode("utf-8"))
+        return pdf_file
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "documents.db"), MetricsRegistry())
+    manager.update_company_info({"company_name": "既定の会社"})
+    manager.update_company_info({"company_name": "B社"}, "b")
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def generator(tmp_path, db_manager, monkeypatch):
+    monkeypatch.delenv("DOCGEN_OUTPUT_CACHE", raising=False)
+    generator = DocumentGenerator(db_manager=db_manager, output_dir=str(tmp_path / "out"), converter=FakeConverter(),
+                                  renderer="libreoffice", metrics=db_manager.metrics,
+                                  workspace=ScratchWorkspace(str(tmp_path / "scratch")))
+    yield generator
+    generator.close()
+
+
+def make_request(issuer=""):
+    return DocumentRequest(document_type="請求書", company_name="顧客X", issuer=issuer,
+                           issued_at=datetime(2025, 3, 10, 9, 0),
+                           items=(LineItem(summary="作業費", quantity="1", unit_price="1000", tax_rate="10"),))
+
+
+def test_issuers_with_the_same_number_do_not_share_a_file(tmp_path, generator, db_manager):
+    default_path = generator.generate(make_request())
+    issuer_path = generator.generate(make_request("b"))
+
+    assert os.path.basename(default_path) == os.path.basename(issuer_path) == "2025-000001.pdf"
+    assert default_path == str(tmp_path / "out" / "請求書" / "顧客X" / "2025" / "03" / "2025-000001.pdf")
+    assert issuer_path == str(tmp_path / "out" / "b" / "請求書" / "顧客X" / "2025" / "03" / "2025-000001.pdf")
+    assert os.path.exists(default_path) and os.path.exists(issuer_path)
+    rows = db_manager.search_documents()
+    assert sorted((row["issuer_id"], row["output_path"]) for row in rows) == [("b", issuer_path), ("default", default_path)]
+
+    # まとめPDFでも発行元ごとに別の書類として扱われる
+    entries = [entry_from_request(make_request(), default_path), entry_from_request(make_request("b"), issuer_path)]
+    assert sorted(group_documents(entries)) == [("b", "顧客X", "2025-03"), ("default", "顧客X", "2025-03")]
+
+
+def test_publish_refuses_to_replace_another_documents_pdf(tmp_path, generator, db_manager):
+    # 2つの発行元に同じ保存先を設定し、保存先が重なる状態にする
+    db_manager.update_company_info({"company_name": "既定の会社", "output_dir": "shared"})
+    db_manager.update_company_info({"company_name": "B社", "output_dir": "shared"}, "b")
+    first = generator.generate(make_request())
+    with open(first, "rb") as f:
+        original = f.read()
+
+    with pytest.raises(OutputPathConflict):
+        generator.generate(make_request("b"))
+    with open(first, "rb") as f:
+        assert f.read() == original
+    assert [row["issuer_id"] for row in db_manager.search_documents()] == ["default"]
+    # 置き換えなかった書類の番号は返却され、次の書類に使われる
+    assert generator.numbering.allocate(make_request("b")) == "2025-000001"
+
+    # 同じ書類の再発行は置き換えてよい
+    assert generator.generate(dataclasses.replace(make_request(), document_number="2025-000001")) == first
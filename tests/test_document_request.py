@@ -0,0 +1,35 @@
+import pytest
+
+from document_request import DocumentRequest
+
+
+def make_request(**values):
+    return DocumentRequest.from_dict({"document_type": "請求書", "company_name": "株式会社サンプル", **values})
+
+
+@pytest.mark.parametrize("company_name", [
+    "", "   ", "..", ".", "../../x", "a/b", "a\\b", "C:x", "顧客\x00", "顧客\n", "CON", "nul.txt", "Com1",
+])
+def test_unsafe_company_names_are_rejected(company_name):
+    with pytest.raises(ValueError):
+        make_request(company_name=company_name)
+
+
+@pytest.mark.parametrize("document_number", ["../../../tmp/evil", "..", "2025/000001", "AUX", "x\x00"])
+def test_unsafe_document_numbers_are_rejected(document_number):
+    with pytest.raises(ValueError):
+        make_request(document_number=document_number)
+
+
+@pytest.mark.parametrize("issuer", ["../b", "b/c", "..", "LPT1"])
+def test_unsafe_issuers_are_rejected(issuer):
+    with pytest.raises(ValueError):
+        make_request(issuer=issuer)
+
+
+def test_ordinary_values_are_accepted():
+    request = make_request(company_name="株式会社サンプル（東京）", document_number="2025-000001", issuer="branch.tokyo")
+    assert request.company_name == "株式会社サンプル（東京）"
+    # 番号・発行元は省略できる
+    assert make_request().document_number == ""
+    assert make_request(company_name="Console Inc.").company_name == "Console Inc."
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import openpyxl
+import pytest
+
+from document_engine import DocumentGenerator
+from document_request import DocumentRequest, LineItem
+from large_document import CARRY_IN_LABEL, CARRY_OUT_LABEL
+from metrics import MetricsRegistry
+
+COMPANY_INFO = {"company_name": "自社"}
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    monkeypatch.delenv("DOCGEN_OUTPUT_CACHE", raising=False)
+    return DocumentGenerator(record_ledger=False, renderer="libreoffice", metrics=MetricsRegistry())
+
+
+def make_request(lines):
+    items = tuple(LineItem(summary=f"品目{line}", quantity="1", unit_price=str(100 + line), tax_rate="10")
+                  for line in range(1, lines + 1))
+    return DocumentRequest(document_type="見積書", company_name="顧客A", items=items,
+                           issued_at=datetime(2025, 3, 10, 9, 0))
+
+
+def write(generator, tmp_path, lines):
+    request = make_request(lines)
+    plan = generator.get_fill_plan(request.document_type)
+    template = generator.template_cache.get_workbook(generator.get_template_path(request.document_type))
+    output_file = str(tmp_path / "large.xlsx")
+    totals = generator.fill_large_workbook(template.active, request, COMPANY_INFO, output_file, plan)
+    sheet = openpyxl.load_workbook(output_file).active
+    return plan, totals, sheet
+
+
+def column_values(sheet, column):
+    return [sheet.cell(row, column).value for row in range(1, sheet.max_row + 1)]
+
+
+def test_rows_over_capacity_continue_on_carried_pages(generator, tmp_path):
+    lines = 100
+    plan, totals, sheet = write(generator, tmp_path, lines)
+    assert len(make_request(lines).items) > plan.capacity
+
+    amount_column = plan.line_column_fields["amount"]
+    labels = column_values(sheet, 1)
+    # 明細はすべて順に書き出される
+    assert [label for label in labels if isinstance(label, str) and label.startswith("品目")] == [
+        f"品目{line}" for line in range(1, lines + 1)]
+
+    # 改ページごとに「次頁へ繰越」と次のページの「前頁より繰越」が同じ小計で対になる
+    breaks = [item.id for item in sheet.row_breaks.brk]
+    carry_out = [row for row, label in enumerate(labels, 1) if label == CARRY_OUT_LABEL]
+    carry_in = [row for row, label in enumerate(labels, 1) if label == CARRY_IN_LABEL]
+    assert len(breaks) == len(carry_out) == len(carry_in) >= 2
+    assert breaks == carry_out
+    for out_row, in_row in zip(carry_out, carry_in):
+        subtotal = sum(100 + int(label[2:]) for label in labels[:out_row] if str(label).startswith("品目"))
+        assert sheet.cell(out_row, amount_column).value == subtotal
+        assert sheet.cell(in_row, amount_column).value == subtotal
+        # 次のページは表題行、繰越行の順で始まる
+        assert in_row == out_row + 2
+
+    # 1ページの行数はテンプレートの印刷範囲を超えない
+    page_starts = [0] + breaks
+    page_ends = breaks + [sheet.max_row]
+    assert all(end - start <= 37 for start, end in zip(page_starts, page_ends))
+    assert totals["total_excluding_tax"] == sum(100 + line for line in range(1, lines + 1))
+
+
+def test_footer_and_totals_are_on_the_last_page(generator, tmp_path):
+    plan, totals, sheet = write(generator, tmp_path, 30)
+    # テンプレートの合計欄（明細の次の行から）が、最終ページの最後の明細に続けて書き出される
+    footer_first = column_values(sheet, 1).index("品目30") + 2
+    assert footer_first > sheet.row_breaks.brk[-1].id
+    assert sheet.cell(footer_first, 9).value == totals["total_excluding_tax"] == sum(range(101, 131))
+    assert sheet.cell(footer_first + 1, 9).value == totals["total_tax"] == totals["total_excluding_tax"] // 10
+    assert sheet.cell(footer_first + 2, 9).value == totals["total_including_tax"]
+    assert sheet[plan.grand_total_cell].value == totals["total_including_tax"]
+    # 印刷範囲の列はテンプレートの印刷範囲（A〜I列）に合わせる
+    first, last = sheet.print_area.split("!")[-1].split(":")
+    assert first == "$A$1" and last.startswith("$I$") and int(last[3:]) >= sheet.max_row
+
+
+def test_page_count_grows_with_the_number_of_lines(generator, tmp_path):
+    request = make_request(11)
+    plan = generator.get_fill_plan(request.document_type)
+    template = generator.template_cache.get_workbook(generator.get_template_path(request.document_type))
+    few = generator.fill_large_workbook(template.active, request, COMPANY_INFO, str(tmp_path / "few.xlsx"), plan)
+    assert few["total_excluding_tax"] == sum(range(101, 112))
+    pages = [len(write(generator, tmp_path, lines)[2].row_breaks.brk) + 1 for lines in (11, 100, 300)]
+    assert pages[0] < pages[1] < pages[2]
@@ -0,0 +1,124 @@
+import math
+from decimal import Decimal
+
+import pytest
+
+from line_item_store import COLUMNS, LineItemStore, parse_delimited, parse_number
+from tax_calculator import calculate_totals
+
+SUMMARY, QUANTITY, UNIT, UNIT_PRICE, DISCOUNT, TAX_RATE = range(len(COLUMNS))
+
+
+def texts(store):
+    return [[store.text(row, column) for column in range(len(COLUMNS))] for row in range(len(store))]
+
+
+def assert_totals_match_items(store):
+    """差分で更新した合計が、明細から計算し直した合計と一致することを確かめる。"""
+    assert store.totals().as_dict() == calculate_totals(store.items(), store.running_totals.rounding).as_dict()
+
+
+@pytest.mark.parametrize("text, expected", [("1,200", 1200.0), ("10%", 10.0), (" 8 % ", 8.0), ("0.5", 0.5), (3, 3.0)])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "  ", None])
+def test_parse_number_blank_is_nan(text):
+    assert math.isnan(parse_number(text))
+
+
+@pytest.mark.parametrize("text", ["abc", "inf", "nan", "1.2.3"])
+def test_parse_number_rejects_non_numbers(text):
+    with pytest.raises(ValueError):
+        parse_number(text)
+
+
+def test_parse_delimited_detects_tabs_and_commas():
+    assert parse_delimited("作業\t1\t式\r\n部品\t2\t個\r\n") == [["作業", "1", "式"], ["部品", "2", "個"]]
+    assert parse_delimited('"作業, 追加",1,"1,200"\n') == [["作業, 追加", "1", "1,200"]]
+    assert parse_delimited("\n") == []
+
+
+def test_paste_adds_rows_and_updates_totals():
+    store = LineItemStore()
+    store.insert_rows(0, 1)
+    store.set_text(0, SUMMARY, "既存")
+    invalid = store.paste(0, QUANTITY, [["2", "式", "1,000", "", "10"], ["3", "個", "500", "100", "8%"]])
+    assert invalid == []
+    assert texts(store) == [["既存", "2", "式", "1000", "", "10"], ["", "3", "個", "500", "100", "8"]]
+    assert store.totals().total_excluding_tax == 3400
+    assert_totals_match_items(store)
+
+
+def test_paste_ignores_cells_beyond_the_last_column():
+    store = LineItemStore()
+    store.paste(0, TAX_RATE, [["10", "余分", "余分"]])
+    assert texts(store) == [["", "", "", "", "", "10"]]
+
+
+def test_paste_reports_invalid_cells_and_keeps_the_rest():
+    store = LineItemStore()
+    invalid = store.paste(0, 0, [["作業", "一式", "式", "1000", "", "10"], ["部品", "2", "個", "千円", "", "10"]])
+    assert invalid == [(0, QUANTITY), (1, UNIT_PRICE)]
+    assert texts(store) == [["作業", "", "式", "1000", "", "10"], ["部品", "2", "個", "", "", "10"]]
+    assert_totals_match_items(store)
+
+
+def test_invalid_input_leaves_the_cell_and_totals_unchanged():
+    store = LineItemStore()
+    store.paste(0, 0, [["作業", "2", "式", "1000", "", "10"]])
+    before = store.totals().as_dict()
+    with pytest.raises(ValueError):
+        store.set_text(0, UNIT_PRICE, "未定")
+    assert store.text(0, UNIT_PRICE) == "1000"
+    assert store.totals().as_dict() == before
+
+
+def test_import_text_with_header_maps_columns_by_name():
+    store = LineItemStore()
+    store.paste(0, 0, [["既存", "1", "式", "100", "", "10"]])
+    text = "単価\t摘要\t税率 (%)\t数量\t備考\n1,500\t保守\t10\t2\t無視する\n200\t送料\t\t1\t\n"
+    assert store.import_text(text) == []
+    assert texts(store)[1:] == [["保守", "2", "", "1500", "", "10"], ["送料", "1", "", "200", "", ""]]
+    assert_totals_match_items(store)
+
+
+def test_import_text_with_english_header():
+    store = LineItemStore()
+    store.import_text("summary,quantity,unit_price,tax_rate\n弁当,3,540,8\n")
+    assert texts(store) == [["弁当", "3", "", "540", "", "8"]]
+    assert store.totals().bucket(8).taxable == 1620
+
+
+def test_import_text_without_header_pastes_at_the_position():
+    store = LineItemStore()
+    store.insert_rows(0, 3)
+    assert store.import_text("2\t個\t300\n4\t箱\t50\n", row=1, column=QUANTITY) == []
+    assert texts(store) == [["", "", "", "", "", ""], ["", "2", "個", "300", "", ""], ["", "4", "箱", "50", "", ""]]
+    store.import_text("追加\t1\n")
+    assert len(store) == 4
+    assert store.text(3, SUMMARY) == "追加"
+
+
+def test_items_keep_decimal_values():
+    store = LineItemStore()
+    store.paste(0, 0, [["時間外作業", "0.1", "時間", "3000.5", "", "10"]])
+    item, = store.items()
+    assert (item.quantity, item.unit_price, item.discount, item.tax_rate) == (
+        Decimal("0.1"), Decimal("3000.5"), Decimal(0), Decimal(10))
+    assert_totals_match_items(store)
+
+
+def test_totals_follow_inserted_and_removed_rows():
+    store = LineItemStore("half_up")
+    store.paste(0, 0, [["A", "1", "", "1000", "", "10"], ["B", "1", "", "333", "", "8"], ["C", "3", "", "111", "", "10"]])
+    store.insert_rows(1, 2)
+    store.paste(1, 0, [["D", "2", "", "250", "50", "0"]])
+    assert_totals_match_items(store)
+    store.remove_rows(0, 2)
+    assert [row[SUMMARY] for row in texts(store)] == ["", "B", "C"]
+    assert_totals_match_items(store)
+    store.clear()
+    assert len(store) == 0
+    assert store.totals().total_including_tax == 0
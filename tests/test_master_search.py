@@ -0,0 +1,120 @@
+from datetime import datetime
+
+import pytest
+
+from database import DatabaseManager
+from document_request import DocumentRequest, LineItem
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "documents.db"))
+    manager.connect()
+    yield manager
+    manager.close()
+
+
+@pytest.fixture(params=["fts", "like"])
+def searchable(request, db_manager):
+    """FTS5 の索引で検索する場合と、FTS5 を使えない SQLite の LIKE 検索の両方で確かめる。"""
+    if request.param == "fts":
+        if not db_manager.fts_enabled:
+            pytest.skip("この SQLite では FTS5 の trigram トークナイザを使えない")
+    else:
+        db_manager.fts_enabled = False
+    return db_manager
+
+
+def record(db_manager, company_name, *summaries, issued_at=datetime(2026, 4, 1, 10, 0)):
+    request = DocumentRequest(document_type="請求書", company_name=company_name, issued_at=issued_at,
+                              items=tuple(LineItem(summary=summary, quantity="1", unit="式", unit_price="1000",
+                                                   tax_rate="10") for summary in summaries))
+    db_manager.record_document(request, {}, f"/out/{company_name}.pdf")
+
+
+def test_import_customers_skips_blank_and_registered_names(db_manager):
+    assert db_manager.import_customers(["株式会社テスト商事", " ", "", "有限会社サンプル"]) == 2
+    assert db_manager.import_customers(["株式会社テスト商事", "  合同会社見本  "]) == 1
+    assert db_manager.search_customers("合同会社") == ["合同会社見本"]
+
+
+def test_import_items_updates_registered_items(db_manager):
+    assert db_manager.import_items([
+        {"summary": "保守作業", "unit": "時間", "unit_price": "8000", "tax_rate": "10"},
+        {"summary": "", "unit": "個"},
+    ]) == 1
+    db_manager.import_items([{"summary": "保守作業", "unit": "月", "unit_price": "50000"}])
+    assert db_manager.search_items("保守作業") == [
+        {"summary": "保守作業", "unit": "月", "unit_price": "50000", "tax_rate": ""}]
+
+
+def test_search_finds_substrings(searchable):
+    searchable.import_customers(["株式会社テスト商事", "テスト工業株式会社", "有限会社サンプル"])
+    assert sorted(searchable.search_customers("テスト")) == ["テスト工業株式会社", "株式会社テスト商事"]
+    assert searchable.search_customers("株式会社") == ["テスト工業株式会社", "株式会社テスト商事"]
+    assert searchable.search_customers("存在しない") == []
+    assert searchable.search_customers("   ") == []
+
+
+def test_short_input_matches_by_prefix(searchable):
+    searchable.import_customers(["株式会社テスト商事", "テスト工業株式会社", "テ"])
+    # trigram で引けない2文字以下の入力は前方一致で探す
+    assert searchable.search_customers("テス") == ["テスト工業株式会社"]
+    assert searchable.search_customers("テ") == ["テ", "テスト工業株式会社"]
+    assert searchable.search_customers("株式") == ["株式会社テスト商事"]
+
+
+def test_search_orders_by_use_count(searchable):
+    searchable.import_customers(["テスト商事A", "テスト商事B", "テスト商事C"])
+    for _ in range(2):
+        record(searchable, "テスト商事C")
+    record(searchable, "テスト商事B")
+    assert searchable.search_customers("テスト商事") == ["テスト商事C", "テスト商事B", "テスト商事A"]
+    assert searchable.search_customers("テスト商事", limit=2) == ["テスト商事C", "テスト商事B"]
+
+
+def test_search_treats_input_as_literal_text(searchable):
+    searchable.import_customers(['A"B"C商会', "100%_商店", "1000商店"])
+    assert searchable.search_customers('"B"C') == ['A"B"C商会']
+    assert searchable.search_customers("0%_商") == ["100%_商店"]
+    assert searchable.search_customers("OR") == []
+
+
+def test_issued_items_are_learned_with_their_latest_price(searchable):
+    record(searchable, "顧客A", "システム保守", "出張費")
+    searchable.import_items([{"summary": "システム開発", "unit": "人月", "unit_price": "800000", "tax_rate": "10"}])
+    record(searchable, "顧客B", "システム保守", issued_at=datetime(2026, 5, 1, 10, 0))
+    assert [item["summary"] for item in searchable.search_items("システム")] == ["システム保守", "システム開発"]
+    assert searchable.search_items("出張")[0] == {"summary": "出張費", "unit": "式", "unit_price": "1000", "tax_rate": "10"}
+    assert searchable.search_customers("顧客") == ["顧客B", "顧客A"]
+
+
+def test_index_follows_renames_and_deletions(db_manager):
+    db_manager.import_customers(["株式会社テスト商事", "有限会社サンプル"])
+    with db_manager.conn:
+        db_manager.conn.execute("UPDATE customers SET name = '株式会社見本商事' WHERE name = '株式会社テスト商事'")
+        db_manager.conn.execute("DELETE FROM customers WHERE name = '有限会社サンプル'")
+    assert db_manager.search_customers("テスト商事") == []
+    assert db_manager.search_customers("見本商事") == ["株式会社見本商事"]
+    assert db_manager.search_customers("サンプル") == []
+
+
+def test_index_is_built_for_existing_rows(tmp_path):
+    path = str(tmp_path / "documents.db")
+    manager = DatabaseManager(path)
+    manager.connect()
+    if not manager.fts_enabled:
+        manager.close()
+        pytest.skip("この SQLite では FTS5 の trigram トークナイザを使えない")
+    manager.import_customers(["株式会社テスト商事"])
+    # 索引を作る前のバージョンで登録された行を再現する
+    with manager.conn:
+        for suffix in ("insert", "delete", "update"):
+            manager.conn.execute(f"DROP TRIGGER customers_fts_{suffix}")
+        manager.conn.execute("DROP TABLE customers_fts")
+    manager.close()
+
+    manager = DatabaseManager(path)
+    manager.connect()
+    assert manager.search_customers("テスト商事") == ["株式会社テスト商事"]
+    manager.close()
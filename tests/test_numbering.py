@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+import document_numbering
+from database import DatabaseManager
+from document_numbering import DocumentNumberAllocator
+from document_request import DocumentRequest
+
+
+def make_request(document_type="請求書", issuer="", document_number=""):
+    return DocumentRequest(document_type=document_type, company_name="顧客A", issuer=issuer,
+                           issued_at=datetime(2026, 4, 1, 10, 0), document_number=document_number)
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "documents.db"))
+    yield manager
+    manager.close()
+
+
+def test_allocate_issues_consecutive_numbers_per_type_and_issuer(db_manager):
+    allocator = DocumentNumberAllocator(db_manager, block_size=3)
+    numbers = [allocator.allocate(make_request()) for _ in range(5)]
+    assert numbers == [f"2026-{n:06d}" for n in range(1, 6)]
+    assert allocator.allocate(make_request("見積書")) == "2026-000001"
+    assert allocator.allocate(make_request(issuer="branch")) == "2026-000001"
+
+
+def test_released_number_is_used_by_the_next_document(db_manager):
+    allocator = DocumentNumberAllocator(db_manager, block_size=5)
+    first = allocator.allocate(make_request())
+    second = allocator.allocate(make_request())
+    assert allocator.release(make_request(document_number=first))
+    # 払い出していない番号・返却済みの番号は返却できない
+    assert not allocator.release(make_request(document_number=first))
+    assert not allocator.release(make_request(document_number="2026-999999"))
+    assert allocator.allocate(make_request()) == first
+    assert allocator.allocate(make_request()) != second
+
+
+def test_confirmed_number_cannot_be_released(db_manager):
+    allocator = DocumentNumberAllocator(db_manager)
+    request = make_request(document_number=allocator.allocate(make_request()))
+    allocator.confirm(request)
+    assert not allocator.release(request)
+
+
+def test_close_returns_unused_numbers_to_the_database(db_manager):
+    allocator = DocumentNumberAllocator(db_manager, block_size=10)
+    used = allocator.allocate(make_request())
+    allocator.confirm(make_request(document_number=used))
+    allocator.close()
+
+    # 別のプロセスに相当する新しい払い出しは、返却された番号から使う
+    other = DocumentNumberAllocator(db_manager, block_size=10)
+    assert [other.allocate(make_request()) for _ in range(10)] == [f"2026-{n:06d}" for n in range(2, 12)]
+
+
+def test_numbers_reserved_by_an_exited_process_are_reclaimed(db_manager, monkeypatch):
+    allocator = DocumentNumberAllocator(db_manager, block_size=4)
+    allocator.allocate(make_request())
+    # 予約したプロセスが異常終了した状態にする
+    with db_manager.connect() as conn:
+        conn.execute("UPDATE document_number_reservations SET owner_pid = 999999999")
+    monkeypatch.setattr(document_numbering, "process_exists", lambda pid: pid != 999999999)
+
+    other = DocumentNumberAllocator(db_manager, block_size=4)
+    assert other.allocate(make_request()) == "2026-000001"
+    assert db_manager.reclaim_document_numbers(lambda pid: False) == 0
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+
+from document_request import DocumentRequest, LineItem
+from output_cache import OutputCache
+
+
+def make_request(**changes):
+    values = dict(
+        document_type="請求書", company_name="顧客A", subject="保守費用",
+        items=(LineItem(summary="保守", quantity="1", unit="式", unit_price="10000", tax_rate="10"),),
+        issued_at=datetime(2026, 4, 1, 10, 0, 12),
+    )
+    values.update(changes)
+    return DocumentRequest(**values)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return OutputCache(str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = tmp_path / "請求書.xlsx"
+    path.write_bytes(b"template")
+    return str(path)
+
+
+def test_make_key_is_stable_for_identical_requests(cache, template):
+    company_info = {"company_name": "自社"}
+    key = cache.make_key(make_request(), template, company_info, {"renderer": "native"})
+    assert cache.make_key(make_request(), template, dict(company_info), {"renderer": "native"}) == key
+    # 数値の表記ゆれと秒以下の違いは同じ内容として扱う
+    same = make_request(
+        items=(LineItem(summary="保守", quantity="1.0", unit="式", unit_price="10000.00", tax_rate="10"),),
+        issued_at=datetime(2026, 4, 1, 10, 0, 59),
+    )
+    assert cache.make_key(same, template, company_info, {"renderer": "native"}) == key
+
+
+def test_make_key_ignores_document_number(cache, template):
+    key = cache.make_key(make_request(), template, {}, {})
+    assert cache.make_key(make_request(document_number="2026-000001"), template, {}, {}) == key
+    assert cache.make_key(make_request(document_number="2026-000002"), template, {}, {}) == key
+
+
+def test_make_key_changes_with_content(cache, template, tmp_path):
+    key = cache.make_key(make_request(), template, {}, {})
+    assert cache.make_key(make_request(subject="別件"), template, {}, {}) != key
+    assert cache.make_key(make_request(issuer="branch"), template, {}, {}) != key
+    assert cache.make_key(make_request(), template, {"company_name": "自社"}, {}) != key
+    assert cache.make_key(make_request(), template, {}, {"renderer": "libreoffice"}) != key
+    with open(template, "wb") as f:
+        f.write(b"changed template")
+    assert cache.make_key(make_request(), template, {}, {}) != key
+
+
+def test_lookup_returns_the_number_stored_with_the_pdf(cache, tmp_path):
+    pdf_file = tmp_path / "2026-000007.pdf"
+    pdf_file.write_bytes(b"%PDF-1.4")
+    assert cache.lookup("ab" * 32) is None
+    cache.store("ab" * 32, str(pdf_file), "2026-000007")
+    assert cache.lookup("ab" * 32) == "2026-000007"
+    assert cache.lookup("ab" * 32, "2026-000007") == "2026-000007"
+    # 別の番号を指定した再発行には使わない
+    assert cache.lookup("ab" * 32, "2026-000008") is None
+
+    destination = tmp_path / "out" / "2026-000007.pdf"
+    assert cache.fetch("ab" * 32, str(destination))
+    assert destination.read_bytes() == b"%PDF-1.4"
+
+    # 再起動後も番号を引き継ぐ
+    assert OutputCache(cache.cache_dir).lookup("ab" * 32) == "2026-000007"
+
+
+def test_cleared_entries_lose_their_number(cache, tmp_path):
+    pdf_file = tmp_path / "a.pdf"
+    pdf_file.write_bytes(b"%PDF-1.4")
+    cache.store("cd" * 32, str(pdf_file), "2026-000001")
+    cache.clear()
+    assert cache.lookup("cd" * 32) is None
+    assert not list((tmp_path / "cache").rglob("*.json"))
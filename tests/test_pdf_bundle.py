@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+pytest.importorskip("reportlab")
+
+from reportlab.pdfgen import canvas  # noqa: E402
+
+from pdf_bundle import StreamingPdfWriter, bundle_documents  # noqa: E402
+
+
+def make_pdf(path, label, pages=2):
+    """ページごとに "<label> p<番号>" と書いたPDFを作る。"""
+    pdf = canvas.Canvas(str(path))
+    for page in range(1, pages + 1):
+        pdf.drawString(72, 720, f"{label} p{page}")
+        pdf.showPage()
+    pdf.save()
+    return str(path)
+
+
+def outline_titles(reader):
+    """しおりを (見出し, ページ番号, 子の見出しのリスト) のリストにする。"""
+    def walk(items):
+        result = []
+        for index, item in enumerate(items):
+            if isinstance(item, list):
+                continue
+            children = items[index + 1] if index + 1 < len(items) and isinstance(items[index + 1], list) else []
+            result.append((item.title, reader.get_destination_page_number(item), walk(children)))
+        return result
+    return walk(reader.outline)
+
+
+def test_three_documents_are_merged_with_bookmarks(tmp_path):
+    sources = [make_pdf(tmp_path / f"{label}.pdf", label) for label in ("A", "B", "C")]
+    bundle = tmp_path / "bundle" / "顧客A.pdf"
+    with StreamingPdfWriter(str(bundle)) as writer:
+        writer.add_document(sources[0], "2026-000001 4月分", "請求書")
+        writer.add_document(sources[1], "2026-000002 追加分", "請求書")
+        writer.add_document(sources[2], "2026-000001", "領収書")
+    assert writer.page_count == 6
+
+    reader = pypdf.PdfReader(str(bundle))
+    assert len(reader.pages) == 6
+    texts = [page.extract_text().strip() for page in reader.pages]
+    assert texts == ["A p1", "A p2", "B p1", "B p2", "C p1", "C p2"]
+    assert outline_titles(reader) == [
+        ("請求書", 0, [("2026-000001 4月分", 0, []), ("2026-000002 追加分", 2, [])]),
+        ("領収書", 4, [("2026-000001", 4, [])]),
+    ]
+    assert os.listdir(bundle.parent) == ["顧客A.pdf"]
+
+
+def test_documents_without_group_are_top_level_bookmarks(tmp_path):
+    bundle = tmp_path / "bundle.pdf"
+    with StreamingPdfWriter(str(bundle)) as writer:
+        writer.add_document(make_pdf(tmp_path / "a.pdf", "A", pages=1), "first")
+        writer.add_document(make_pdf(tmp_path / "b.pdf", "B", pages=1), "second")
+    assert outline_titles(pypdf.PdfReader(str(bundle))) == [("first", 0, []), ("second", 1, [])]
+
+
+def test_failed_bundle_keeps_the_existing_file(tmp_path):
+    bundle = tmp_path / "bundle.pdf"
+    bundle.write_bytes(b"previous")
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    with pytest.raises(Exception):
+        with StreamingPdfWriter(str(bundle)) as writer:
+            writer.add_document(make_pdf(tmp_path / "a.pdf", "A"), "first")
+            writer.add_document(str(broken), "second")
+    assert bundle.read_bytes() == b"previous"
+    assert sorted(os.listdir(tmp_path)) == ["a.pdf", "broken.pdf", "bundle.pdf"]
+
+
+def test_bundle_documents_groups_by_customer_and_month(tmp_path):
+    def entry(document_type, customer, day, number):
+        path = make_pdf(tmp_path / f"{document_type}{customer}{number}.pdf", number, pages=1)
+        return {"document_type": document_type, "customer_name": customer, "issue_date": f"2026-04-{day:02d}",
+                "issuer_id": "default", "document_number": number, "subject": "", "output_path": path}
+
+    entries = [
+        entry("領収書", "顧客A", 20, "2026-000003"),
+        entry("請求書", "顧客A", 10, "2026-000002"),
+        entry("見積書", "顧客A", 1, "2026-000001"),
+        entry("請求書", "顧客B", 5, "2026-000001"),
+    ]
+    results = bundle_documents(entries, str(tmp_path / "bundles"))
+    assert sorted((os.path.relpath(path, tmp_path), documents, pages, error)
+                  for path, documents, pages, error in results) == [
+        (os.path.join("bundles", "2026", "04", "顧客A.pdf"), 2, 2, None),
+        (os.path.join("bundles", "2026", "04", "顧客B.pdf"), 1, 1, None),
+    ]
+    reader = pypdf.PdfReader(str(tmp_path / "bundles" / "2026" / "04" / "顧客A.pdf"))
+    assert [title for title, _, _ in outline_titles(reader)] == ["請求書", "領収書"]
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import server
+from metrics import MetricsRegistry
+from server import GenerationServer
+
+REQUEST = {"document_type": "請求書", "company_name": "テスト商事", "items": [{"summary": "作業", "quantity": "1"}]}
+
+
+class FakeGenerator:
+    """PDFの代わりに取引先名を書いたファイルを作る書類生成エンジンの代わり。"""
+
+    def __init__(self, output_dir, blocked=False):
+        self.output_dir = output_dir
+        self.metrics = MetricsRegistry()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not blocked:
+            self.release.set()
+        self.error = None
+
+    def generate(self, request, progress=None):
+        self.started.set()
+        progress("excel")
+        # テストから release されるまで生成中のままにする
+        self.release.wait(10)
+        if self.error:
+            raise self.error
+        path = self.output_dir / f"{request.company_name}.pdf"
+        path.write_bytes(b"%PDF-" + request.company_name.encode("utf-8"))
+        return str(path)
+
+
+async def send(port, method, target, body=b"", headers=None):
+    """1件の要求を送り、(ステータス, ヘッダー, 本文) を返す。"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    headers = {"Content-Length": str(len(body)), **(headers or {})}
+    head = f"{method} {target} HTTP/1.1\r\nHost: localhost\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    response_headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+    return status, response_headers, payload
+
+
+async def post(port, payload=REQUEST, query=""):
+    return await send(port, "POST", f"/documents{query}", json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+
+def run_with_server(generator, scenario, **options):
+    """port=0 でサーバーを起動して scenario(server) を実行し、終わったら停止する。"""
+    async def main():
+        generation_server = GenerationServer(generator, port=0, **options)
+        await generation_server.start()
+        try:
+            await scenario(generation_server)
+        finally:
+            generator.release.set()
+            await generation_server.close()
+
+    asyncio.run(main())
+
+
+async def wait_for(event):
+    """ワーカースレッドでの生成が始まるのを、イベントループを止めずに待つ。"""
+    await asyncio.get_running_loop().run_in_executor(None, event.wait, 10)
+
+
+def test_job_status_and_pdf_endpoints(tmp_path):
+    generator = FakeGenerator(tmp_path, blocked=True)
+
+    async def scenario(generation_server):
+        port = generation_server.port
+        status, headers, body = await post(port)
+        assert status == 202
+        job = json.loads(body)
+        assert headers["location"] == f"/jobs/{job['job_id']}"
+        await wait_for(generator.started)
+
+        status, _, body = await send(port, "GET", job["status_url"])
+        assert status == 200
+        assert json.loads(body)["status"] == "running"
+        assert json.loads(body)["stage"] == "excel"
+
+        # 生成中はPDFを返さず、再取得までの待ち時間を知らせる
+        status, headers, _ = await send(port, "GET", job["pdf_url"])
+        assert status == 409
+        assert headers["retry-after"] == str(server.RETRY_AFTER_SECONDS)
+
+        generator.release.set()
+        await generation_server.jobs[job["job_id"]].done.wait()
+        status, _, body = await send(port, "GET", job["status_url"])
+        assert json.loads(body)["status"] == "finished"
+        status, headers, body = await send(port, "GET", job["pdf_url"])
+        assert status == 200
+        assert headers["content-type"] == "application/pdf"
+        assert headers["x-job-id"] == job["job_id"]
+        assert body == "%PDF-テスト商事".encode("utf-8")
+
+        status, _, _ = await send(port, "GET", "/jobs/unknown")
+        assert status == 404
+
+    run_with_server(generator, scenario)
+
+
+def test_wait_returns_the_pdf_in_the_response(tmp_path):
+    generator = FakeGenerator(tmp_path)
+
+    async def scenario(generation_server):
+        status, headers, body = await post(generation_server.port, query="?wait=true")
+        assert status == 200
+        assert headers["content-type"] == "application/pdf"
+        assert int(headers["content-length"]) == len(body)
+        assert body == "%PDF-テスト商事".encode("utf-8")
+
+    run_with_server(generator, scenario)
+
+
+def test_wait_reports_a_failed_job(tmp_path):
+    generator = FakeGenerator(tmp_path)
+    generator.error = RuntimeError("soffice crashed")
+
+    async def scenario(generation_server):
+        status, _, body = await post(generation_server.port, query="?wait=true")
+        assert status == 500
+        assert json.loads(body) == {"error": "soffice crashed"}
+
+    run_with_server(generator, scenario)
+
+
+def test_full_queue_is_rejected_with_retry_after(tmp_path):
+    generator = FakeGenerator(tmp_path, blocked=True)
+
+    async def scenario(generation_server):
+        port = generation_server.port
+        # 1件目はワーカーが生成中、2件目で待ち行列が満杯になる
+        status, _, _ = await post(port)
+        assert status == 202
+        await wait_for(generator.started)
+        status, _, _ = await post(port)
+        assert status == 202
+
+        status, headers, body = await post(port)
+        assert status == 429
+        assert headers["retry-after"] == str(server.RETRY_AFTER_SECONDS)
+        assert "queue is full" in json.loads(body)["error"]
+        assert sum(generator.metrics._counters["server_rejections_total"].values()) == 1
+        assert len(generation_server.jobs) == 2
+
+    run_with_server(generator, scenario, workers=1, queue_size=1)
+
+
+def test_oversized_body_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "MAX_BODY_BYTES", 64)
+    generator = FakeGenerator(tmp_path)
+
+    async def scenario(generation_server):
+        status, _, body = await send(generation_server.port, "POST", "/documents", b"x" * 65)
+        assert status == 413
+        assert "too large" in json.loads(body)["error"]
+        assert generation_server.jobs == {}
+
+    run_with_server(generator, scenario)
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[]", json.dumps({"document_type": "納品書"}).encode("utf-8"),
+                                  json.dumps({"company_name": "../外部"}).encode("utf-8")])
+def test_invalid_request_is_rejected(tmp_path, body):
+    generator = FakeGenerator(tmp_path)
+
+    async def scenario(generation_server):
+        status, _, _ = await send(generation_server.port, "POST", "/documents", body)
+        assert status == 400
+        assert generation_server.jobs == {}
+
+    run_with_server(generator, scenario)
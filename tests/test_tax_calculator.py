@@ -0,0 +1,115 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+from document_request import LineItem
+from tax_calculator import RunningTotals, calculate_line_amount, calculate_tax, calculate_totals
+
+
+def item(quantity, unit_price, tax_rate, discount="0"):
+    return LineItem(summary="品目", quantity=str(quantity), unit_price=str(unit_price), discount=str(discount),
+                    tax_rate=str(tax_rate))
+
+
+def test_amounts_are_split_into_tax_rate_buckets():
+    totals = calculate_totals([
+        item(2, 1000, 10),
+        item(1, 500, 10, discount=100),
+        item(3, 300, 8),
+        item(1, 700, 0),
+    ])
+    assert totals.line_amounts == [2000, 400, 900, 700]
+    assert totals.as_dict() == {
+        "total_excluding_tax": 4000,
+        "tax_10_total": 2400, "tax_10_tax": 240,
+        "tax_8_total": 900, "tax_8_tax": 72,
+        "tax_0_total": 700,
+        "total_tax": 312,
+        "total_including_tax": 4312,
+    }
+
+
+def test_tax_is_rounded_once_per_rate_not_per_line():
+    # 1行ずつ切り捨てると 9円×3 = 27円だが、税率ごとに合計してから切り捨てるので 29円
+    totals = calculate_totals([item(1, 99, 10)] * 3)
+    assert totals.bucket(10).taxable == 297
+    assert totals.total_tax == 29
+
+
+@pytest.mark.parametrize("quantity, unit_price, discount, expected", [
+    ("0.5", "999", "0", 499),       # 499.5 → 切り捨て
+    ("1.5", "333", "0", 499),       # 499.5 → 切り捨て
+    ("0.333", "3", "0", 0),         # 0.999 → 0
+    ("2.25", "100", "0.5", 224),    # 225 - 0.5 = 224.5 → 224
+    ("1,000", "1", "0", 1000),      # 桁区切りのカンマ
+    ("", "100", "", 0),             # 空欄は0
+    ("1", "100", "150", -50),       # 値引が金額を上回る場合は負の金額
+])
+def test_line_amount_rounds_down_fractional_quantities(quantity, unit_price, discount, expected):
+    assert calculate_line_amount(quantity, unit_price, discount) == expected
+
+
+@pytest.mark.parametrize("taxable, rate, rounding, expected", [
+    (1005, Decimal(10), None, 100),        # 100.5 → 既定は切り捨て
+    (1005, Decimal(10), "half_up", 101),   # 四捨五入
+    (1004, Decimal(10), "half_up", 100),
+    (1001, Decimal(10), "up", 101),        # 切り上げ
+    (1000, Decimal(10), "up", 100),        # 端数がなければそのまま
+    (1299, Decimal(8), None, 103),         # 103.92 → 103
+    (1299, Decimal(8), "half_up", 104),
+])
+def test_tax_rounding_at_the_boundaries(taxable, rate, rounding, expected):
+    assert calculate_tax(taxable, rate, rounding) == expected
+
+
+def test_rounding_can_differ_per_rate():
+    totals = calculate_totals([item(1, 1005, 10), item(1, 1299, 8)], {10: "half_up", "8": "down"})
+    assert (totals.bucket(10).tax, totals.bucket(8).tax) == (101, 103)
+
+
+def test_invalid_values_report_the_line():
+    with pytest.raises(ValueError, match="Line 2"):
+        calculate_totals([item(1, 100, 10), item("abc", 100, 10)])
+
+
+def test_running_totals_match_calculate_totals():
+    rng = random.Random(8)
+    running = RunningTotals("half_up")
+    lines = []
+
+    def random_line():
+        return (str(rng.choice([1, 2, "0.5", "1.25", 3])), str(rng.randrange(1, 5000)),
+                str(rng.choice([0, 0, 10, "0.5"])), str(rng.choice([10, 8, 0])))
+
+    for _ in range(300):
+        operation = rng.random()
+        if operation < 0.4 or not lines:
+            position = rng.randint(0, len(lines))
+            count = rng.randint(1, 3)
+            running.insert_rows(position, count)
+            lines[position:position] = [("0", "0", "0", "0")] * count
+        elif operation < 0.55:
+            position = rng.randrange(len(lines))
+            count = rng.randint(1, 2)
+            running.remove_rows(position, count)
+            del lines[position:position + count]
+        else:
+            row = rng.randrange(len(lines))
+            lines[row] = random_line()
+            running.set_line(row, *lines[row])
+        expected = calculate_totals([item(q, p, r, discount=d) for q, p, d, r in lines], "half_up")
+        assert running.totals().as_dict() == expected.as_dict()
+        assert running.amounts == expected.line_amounts
+
+
+def test_running_totals_forget_rates_without_lines():
+    running = RunningTotals()
+    running.insert_rows(0, 2)
+    running.set_line(0, "1", "1000", "0", "8")
+    running.set_line(1, "1", "1000", "0", "10")
+    running.remove_rows(0, 1)
+    assert Decimal(8) not in running.totals().buckets
+    assert running.totals().total_including_tax == 1100
+    running.clear()
+    assert running.totals().total_including_tax == 0
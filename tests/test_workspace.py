@@ -0,0 +1,99 @@
+import errno
+import os
+
+import pytest
+
+import workspace
+from workspace import OutputPublisher
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "work" / "請求書.pdf"
+    path.parent.mkdir()
+    path.write_bytes(b"%PDF-new")
+    return path
+
+
+def simulate_other_filesystem(monkeypatch, source):
+    """source からの名前の変更だけを、別のファイルシステムへの移動として失敗させる。"""
+    replace = os.replace
+
+    def cross_device_replace(src, dst):
+        if os.fspath(src) == os.fspath(source):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        return replace(src, dst)
+
+    monkeypatch.setattr(workspace.os, "replace", cross_device_replace)
+
+
+def test_publish_replaces_the_destination(tmp_path, source):
+    destination = tmp_path / "out" / "2026" / "2026-000001.pdf"
+    destination.parent.mkdir(parents=True)
+    destination.write_bytes(b"%PDF-old")
+    OutputPublisher().publish(str(source), str(destination))
+    assert destination.read_bytes() == b"%PDF-new"
+    assert not source.exists()
+    assert os.listdir(destination.parent) == ["2026-000001.pdf"]
+
+
+def test_publish_across_filesystems_copies_then_renames(tmp_path, source, monkeypatch):
+    simulate_other_filesystem(monkeypatch, source)
+    destination = tmp_path / "out" / "2026-000001.pdf"
+    OutputPublisher().publish(str(source), str(destination))
+    assert destination.read_bytes() == b"%PDF-new"
+    assert not source.exists()
+    assert os.listdir(destination.parent) == ["2026-000001.pdf"]
+
+
+def test_failed_copy_keeps_the_previous_file(tmp_path, source, monkeypatch):
+    simulate_other_filesystem(monkeypatch, source)
+    destination = tmp_path / "out" / "2026-000001.pdf"
+    destination.parent.mkdir()
+    destination.write_bytes(b"%PDF-old")
+
+    def broken_copy(src, dst):
+        dst.write(b"%PDF-ne")
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(workspace.shutil, "copyfileobj", broken_copy)
+    with pytest.raises(OSError):
+        OutputPublisher().publish(str(source), str(destination))
+    # 書きかけのファイルは保存先の名前で見えず、一時ファイルも残らない
+    assert destination.read_bytes() == b"%PDF-old"
+    assert os.listdir(destination.parent) == ["2026-000001.pdf"]
+    assert source.exists()
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc to tell directories from files")
+@pytest.mark.parametrize("cross_device", [False, True])
+def test_publish_syncs_file_before_and_directory_after_rename(tmp_path, source, monkeypatch, cross_device):
+    if cross_device:
+        simulate_other_filesystem(monkeypatch, source)
+    destination = tmp_path / "out" / "2026-000001.pdf"
+    events = []
+    fsync, replace = os.fsync, workspace.os.replace
+
+    def recording_fsync(fd):
+        events.append(("fsync", os.path.isdir(f"/proc/self/fd/{fd}")))
+        fsync(fd)
+
+    def recording_replace(src, dst):
+        result = replace(src, dst)
+        events.append(("replace", os.fspath(dst)))
+        return result
+
+    monkeypatch.setattr(workspace.os, "fsync", recording_fsync)
+    monkeypatch.setattr(workspace.os, "replace", recording_replace)
+    OutputPublisher().publish(str(source), str(destination))
+    assert events[-2:] == [("replace", str(destination)), ("fsync", True)]
+    assert ("fsync", False) in events[:-2]
+
+
+def test_publish_recreates_a_removed_directory(tmp_path, source):
+    publisher = OutputPublisher()
+    destination = tmp_path / "out" / "2026-000001.pdf"
+    publisher.ensure_directory(str(destination.parent))
+    os.rmdir(destination.parent)
+    publisher.publish(str(source), str(destination))
+    assert destination.read_bytes() == b"%PDF-new"
@@ -0,0 +1,279 @@
+"""作業用の一時ファイル（ブック・変換したPDF）の置き場所と、完成したファイルの保存先への配置。
+
+作業領域はメモリ上のファイルシステム（/dev/shm）に置けるようにし、書類ごとの一時ディレクトリの作成・削除をなくす。
+保存先（共有フォルダなど）には、同じディレクトリの一時ファイルに書き込んでから名前を変えて配置し、
+書きかけのPDFが保存先の名前で見えないようにする。
+"""
+import errno
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# 変換に使う一時ディレクトリの接頭辞。異常終了で残ったものを起動時に掃除するときの目印にする
+TEMP_PREFIX = "docgen_"
+
+# 一時ディレクトリの種類（書類1件の作業用 / まとめ変換のステージング / 常駐ワーカーのプロファイル / 作業領域）
+TEMP_KINDS = ("job", "staging", "profiles", "scratch")
+
+# 作業用の一時ファイルを置くメモリ上のファイルシステムと、使うのに必要な空き容量（バイト）
+SHM_DIR = "/dev/shm"
+MIN_SCRATCH_FREE = 256 * 1024 * 1024
+
+# 作成したプロセスが分からない一時ディレクトリは、この時間（秒）より古ければ残ったものとして削除する
+STALE_TEMP_AGE = 24 * 60 * 60
+
+
+def temp_prefix(kind):
+    """一時ディレクトリの接頭辞（docgen_<種類>_<プロセスID>_）を返す。掃除の際に作成したプロセスが動作中かを確かめる。"""
+    return f"{TEMP_PREFIX}{kind}_{os.getpid()}_"
+
+
+def get_scratch_root(scratch_dir=None):
+    """作業用の一時ファイル（ブック・変換したPDF）を置くディレクトリを決める。
+
+    未指定なら環境変数 DOCGEN_SCRATCH_DIR、なければ空き容量が十分あればメモリ上の /dev/shm、
+    どちらもなければ通常の一時ディレクトリを使う。
+    """
+    scratch_dir = scratch_dir or os.environ.get("DOCGEN_SCRATCH_DIR")
+    if scratch_dir:
+        os.makedirs(scratch_dir, exist_ok=True)
+        return scratch_dir
+    try:
+        if os.access(SHM_DIR, os.W_OK | os.X_OK) and shutil.disk_usage(SHM_DIR).free >= MIN_SCRATCH_FREE:
+            return SHM_DIR
+    except OSError:
+        pass
+    return tempfile.gettempdir()
+
+
+def process_exists(pid):
+    """プロセスIDのプロセスが動作中かどうかを返す。"""
+    if sys.platform == "win32":
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_stale_temp_dirs(max_age=STALE_TEMP_AGE, temp_dir=None):
+    """異常終了などで残った変換用の一時ディレクトリ（docgen_*）を削除し、削除した数を返す。
+
+    作成したプロセスが終了しているものは削除する。作成したプロセスが分からないものは max_age 秒より古ければ削除する。
+    """
+    if temp_dir is None:
+        # 作業領域が通常の一時ディレクトリと別の場所（/dev/shm など）なら、そこも掃除する
+        scratch_root = get_scratch_root()
+        removed = remove_stale_temp_dirs(max_age, tempfile.gettempdir())
+        if os.path.realpath(scratch_root) != os.path.realpath(tempfile.gettempdir()):
+            removed += remove_stale_temp_dirs(max_age, scratch_root)
+        return removed
+    try:
+        entries = list(os.scandir(temp_dir))
+    except OSError as e:
+        logging.warning(f"Could not scan {temp_dir} for stale temporary directories: {e}")
+        return 0
+    removed = 0
+    now = time.time()
+    for entry in entries:
+        if not entry.name.startswith(TEMP_PREFIX):
+            continue
+        parts = entry.name[len(TEMP_PREFIX):].split("_")
+        if parts[0] not in TEMP_KINDS:
+            continue
+        try:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if len(parts) >= 3 and parts[1].isdigit():
+                pid = int(parts[1])
+                if pid == os.getpid() or process_exists(pid):
+                    continue
+            elif now - entry.stat(follow_symlinks=False).st_mtime < max_age:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logging.info(f"Removed {removed} abandoned temporary directories from {temp_dir}.")
+    return removed
+
+
+def clear_directory(directory):
+    """ディレクトリの中身をすべて削除する。削除できないものが残った場合は False を返す。"""
+    cleared = True
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+        except OSError as e:
+            logging.warning(f"Could not remove {entry.path} from the scratch workspace: {e}")
+            cleared = False
+    return cleared
+
+
+class ScratchWorkspace:
+    def __init__(self, scratch_dir=None):
+        """書類1件分の作業ディレクトリを使い回す作業領域。
+
+        書類ごとに一時ディレクトリを作成・削除せず、使い終わった作業ディレクトリは中のファイルだけを削除して次の書類に使う。
+        作業領域は最初に使うときに get_scratch_root のディレクトリに作成する。
+        """
+        self.scratch_dir = scratch_dir
+        self.path = None
+        self._free = []
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def job(self):
+        """書類1件分の空の作業ディレクトリを貸し出す。with ブロックを抜けると中身を削除して返却される。"""
+        with self._lock:
+            if self.path is None:
+                self.path = tempfile.mkdtemp(prefix=temp_prefix("scratch"), dir=get_scratch_root(self.scratch_dir))
+            directory = self._free.pop() if self._free else None
+            if directory is None:
+                self._created += 1
+                directory = os.path.join(self.path, f"job{self._created}")
+                os.mkdir(directory)
+        try:
+            yield directory
+        finally:
+            # 中身を削除できなかった作業ディレクトリは使い回さない
+            if clear_directory(directory):
+                with self._lock:
+                    self._free.append(directory)
+            else:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def close(self):
+        """作業領域を削除する。"""
+        with self._lock:
+            path, self.path = self.path, None
+            self._free.clear()
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def publishing_path(destination):
+    """保存先と同じディレクトリの、配置途中のファイルの名前（.<ファイル名>.<乱数>.tmp）を返す。"""
+    directory, name = os.path.split(destination)
+    return os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+
+
+class OutputPublisher:
+    def __init__(self):
+        """完成したファイルを保存先に配置する。
+
+        保存先のディレクトリは1度作成したら覚えておき、書類ごとに作成し直さない。
+        """
+        self._directories = set()
+        self._lock = threading.Lock()
+
+    def ensure_directory(self, directory):
+        """ディレクトリがなければ作成する（作成済みのディレクトリはファイルシステムを確かめない）。"""
+        with self._lock:
+            if directory in self._directories:
+                return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._directories.add(directory)
+
+    def forget_directory(self, directory):
+        """作成済みとして覚えているディレクトリを忘れる（外部から削除された場合など）。"""
+        with self._lock:
+            self._directories.discard(directory)
+
+    def publish(self, source, destination):
+        """source のファイルを destination に移動する。
+
+        同じファイルシステムなら名前の変更だけで置き換える。別のファイルシステム（作業領域が /dev/shm の場合など）なら
+        保存先のディレクトリの一時ファイルに書き込んでから名前を変え、書きかけのファイルを保存先の名前で見せない。
+        """
+        directory = os.path.dirname(destination)
+        self.ensure_directory(directory)
+        try:
+            self._move(source, destination)
+        except FileNotFoundError:
+            if not os.path.exists(source):
+                raise
+            # 覚えていたディレクトリが実行中に削除された場合は作成し直す
+            self.forget_directory(directory)
+            self.ensure_directory(directory)
+            self._move(source, destination)
+        return destination
+
+    def _move(self, source, destination):
+        """source を destination へ置き換える形で移動する。
+
+        名前を変える前にファイルの内容を、変えた後にディレクトリをディスクに書き出し、
+        停電などの直後に保存先の名前で空や書きかけのPDFが残らないようにする。
+        """
+        directory = os.path.dirname(destination) or os.curdir
+        fsync_file(source)
+        try:
+            os.replace(source, destination)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        else:
+            fsync_directory(directory)
+            return
+        temp_path = publishing_path(destination)
+        try:
+            with open(source, "rb") as src, open(temp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        fsync_directory(directory)
+        os.remove(source)
+
+
+def fsync_file(path):
+    """ファイルの内容をディスクに書き出す。"""
+    # Windows では書き込みできるように開いたファイルでないと書き出せない
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(directory):
+    """ディレクトリへの追加・名前の変更をディスクに書き出す。
+
+    Windows ではディレクトリを開けないため何もしない。対応していないファイルシステム（一部の共有フォルダなど）では無視する。
+    """
+    if sys.platform == "win32":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.ENOTSUP, errno.EBADF):
+            raise
+        logging.debug(f"Could not fsync directory {directory}: {e}")
+    finally:
+        os.close(fd)